@@ -8,12 +8,16 @@ import logging.config
 
 from .db import KnipseDB
 from .dhash import cli_dhash
-from .scan import cli_scan, cli_purge
+from .scan import cli_scan, cli_purge, cli_backfill_hashes
 from .symlink import cli_symlink
 from .gui import cli_display, cli_kivy
 from .show import cli_show_image
 from .lists import cli_list
 from .thumbnail import cli_update_thumbnails
+from .watch import cli_watch
+from .similar import cli_similar
+from .duplicates import cli_duplicates
+from .query import cli_query, cli_search
 
 
 _DEFAULT_LOGGING_CONFIG = {
@@ -80,6 +84,12 @@ cli_knipse.add_command(cli_list)
 cli_knipse.add_command(cli_kivy)
 cli_knipse.add_command(cli_update_thumbnails)
 cli_knipse.add_command(cli_purge)
+cli_knipse.add_command(cli_backfill_hashes)
+cli_knipse.add_command(cli_watch)
+cli_knipse.add_command(cli_similar)
+cli_knipse.add_command(cli_duplicates)
+cli_knipse.add_command(cli_query)
+cli_knipse.add_command(cli_search)
 
 
 if __name__ == "__main__":
@@ -1,29 +1,68 @@
 # -*- coding: utf-8 -*-
 
+import re
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
-from collections import Counter
+from collections import Counter, OrderedDict
 import io
-from typing import Optional, Iterable, Tuple
+import json
+import logging
+import struct
+from typing import Optional, Iterable, Iterator, Tuple, List, Callable, \
+    Union, Dict  # noqa: 401
 
+import numpy as np
 from PIL import Image
 
-from .descriptor import ImageDescriptor, ListDescriptor, \
-                        ListEntryDescriptor
+from .descriptor import ImageDescriptor, FolderDescriptor, ListDescriptor, \
+                        ListEntryDescriptor, ScanSessionDescriptor
+from .stats import ScanStats, NO_STATS
+from .index import ImageIndex, micros_from_nanos, write_index_records
+from .table import ImageTable
 
 
+logger = logging.getLogger(__name__)
+
+# timestamps are stored as nanoseconds since the (naive) epoch
 _CREATE_IMAGE_TABLE = \
     '''CREATE TABLE IF NOT EXISTS images (
         path text,
-        created_at timestamp,
-        modified_at timestamp,
+        created_at int,
+        modified_at int,
         md5 blob,
         dhash blob,
         active bool
     );
     '''
 
+# counter of changes to the images table, identifies its state
+# e.g. for checking if an `ImageIndex` is up to date
+_CREATE_IMAGES_GENERATION_TABLE = \
+    '''CREATE TABLE IF NOT EXISTS images_generation (
+        generation int
+    );
+    '''
+
+_INIT_IMAGES_GENERATION = \
+    '''INSERT INTO images_generation (generation)
+       SELECT 0
+       WHERE NOT EXISTS (SELECT 1 FROM images_generation);
+    '''
+
+_CREATE_IMAGES_GENERATION_TRIGGER = \
+    '''CREATE TRIGGER IF NOT EXISTS images_generation_{0}
+       AFTER {0} ON images
+       BEGIN
+         UPDATE images_generation SET generation = generation + 1;
+       END;
+    '''
+
+_GET_IMAGES_GENERATION = \
+    '''SELECT generation FROM images_generation;'''
+
 _CREATE_LISTS_TABLE = \
     '''CREATE TABLE IF NOT EXISTS lists (
         name text,
@@ -41,6 +80,212 @@ _CREATE_LIST_ENTRIES_TABLE = \
     );
     '''
 
+_CREATE_IMAGE_HASHES_TABLE = \
+    '''CREATE TABLE IF NOT EXISTS image_hashes (
+        image_id int,
+        algorithm text,
+        hash blob,
+        UNIQUE (image_id, algorithm),
+        FOREIGN KEY (image_id) REFERENCES images
+    );
+    '''
+
+_CREATE_FOLDER_SCANS_TABLE = \
+    '''CREATE TABLE IF NOT EXISTS folder_scans (
+        path text,
+        modified_at int,
+        entries int,
+        UNIQUE (path)
+    );
+    '''
+
+_CREATE_SCAN_SESSIONS_TABLE = \
+    '''CREATE TABLE IF NOT EXISTS scan_sessions (
+        source text,
+        folder_tree text,
+        walked int,
+        stored int,
+        UNIQUE (source)
+    );
+    '''
+
+_CREATE_SCHEMA_VERSION_TABLE = \
+    '''CREATE TABLE IF NOT EXISTS schema_version (
+        version int
+    );
+    '''
+
+_GET_SCHEMA_VERSION = \
+    '''SELECT MAX(version) FROM schema_version;'''
+
+_STORE_SCHEMA_VERSION = \
+    '''INSERT INTO schema_version VALUES (?);'''
+
+# statements migrating the schema to version i + 1, run in order
+# on databases of a lower version (tables created above are the
+# schema of version 0)
+# folders are identified by their path (relative to the image source)
+# up to and including the last slash, the source itself by ''
+_CREATE_FOLDERS_TABLE = \
+    '''CREATE TABLE IF NOT EXISTS folders (
+        folder_id integer PRIMARY KEY,
+        parent_id int,
+        name text,
+        path text,
+        image_count int DEFAULT 0,
+        UNIQUE (path),
+        FOREIGN KEY (parent_id) REFERENCES folders
+    );
+    '''
+
+# SQL expressions for the folder of an image path
+# and the parent of a folder path (format with column)
+_FOLDER_OF = '''rtrim({0}, replace({0}, '/', ''))'''
+_PARENT_OF = _FOLDER_OF.format('substr({0}, 1, length({0}) - 1)')
+
+# trigram index of image paths for substring search (optional as
+# it requires SQLite with FTS5 of version 3.34 or later)
+_CREATE_PATH_SEARCH_TABLE = \
+    '''CREATE VIRTUAL TABLE images_fts USING fts5(
+        path,
+        content = 'images',
+        content_rowid = 'rowid',
+        tokenize = 'trigram'
+    );
+    '''
+
+_CREATE_PATH_SEARCH_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS images_fts_insert
+       AFTER INSERT ON images
+       BEGIN
+         INSERT INTO images_fts (rowid, path) VALUES (NEW.rowid, NEW.path);
+       END;''',
+    '''CREATE TRIGGER IF NOT EXISTS images_fts_delete
+       AFTER DELETE ON images
+       BEGIN
+         INSERT INTO images_fts (images_fts, rowid, path)
+         VALUES ('delete', OLD.rowid, OLD.path);
+       END;''',
+    '''CREATE TRIGGER IF NOT EXISTS images_fts_update
+       AFTER UPDATE OF path ON images
+       BEGIN
+         INSERT INTO images_fts (images_fts, rowid, path)
+         VALUES ('delete', OLD.rowid, OLD.path);
+         INSERT INTO images_fts (rowid, path) VALUES (NEW.rowid, NEW.path);
+       END;''',
+]
+
+_REBUILD_PATH_SEARCH = \
+    '''INSERT INTO images_fts (images_fts) VALUES ('rebuild');'''
+
+_HAS_PATH_SEARCH = \
+    '''SELECT COUNT(*) FROM sqlite_master WHERE name = 'images_fts';'''
+
+_MIGRATIONS = [
+    # 1: indexes for lookups by path and md5 hash, of inactive images
+    # (the majority of active images is read faster without index)
+    # and of list entries in order
+    [
+        '''CREATE INDEX IF NOT EXISTS images_path ON images (path);''',
+        '''CREATE INDEX IF NOT EXISTS images_md5 ON images (md5);''',
+        '''CREATE INDEX IF NOT EXISTS images_inactive ON images (active)
+           WHERE active = 0;''',
+        '''CREATE INDEX IF NOT EXISTS list_entries_list_position
+           ON list_entries (list_id, position);''',
+    ],
+    # 2: indexes for lookups of `LazyImageRecognizer` by dhash
+    # and folder (path up to the last slash)
+    [
+        '''CREATE INDEX IF NOT EXISTS images_dhash ON images (dhash);''',
+        '''CREATE INDEX IF NOT EXISTS images_folder
+           ON images (rtrim(path, replace(path, '/', '')));''',
+    ],
+    # 3: timestamps as nanoseconds since the epoch instead of
+    # strings formatted by `_DT_FMT` (seconds and microseconds
+    # are converted separately to keep full precision)
+    [
+        '''UPDATE {table} SET {column} =
+             CAST(strftime('%s', substr({column}, 1, 19)) AS int)
+             * 1000000000
+             + CAST(substr({column} || '.000000', 21, 6) AS int) * 1000
+           WHERE typeof({column}) = 'text';'''
+        .format(table=table, column=column)
+        for table, column in (('images', 'created_at'),
+                              ('images', 'modified_at'),
+                              ('folder_scans', 'modified_at'))
+    ],
+    # 4: folders table (including all ancestors of image folders)
+    # with counts of active images maintained by triggers,
+    # images refer to their folder and store their file name
+    [
+        _CREATE_FOLDERS_TABLE,
+        '''ALTER TABLE images ADD COLUMN folder_id int;''',
+        '''ALTER TABLE images ADD COLUMN name text;''',
+        '''WITH RECURSIVE ancestors(path) AS (
+             SELECT ''
+             UNION
+             SELECT {} FROM images
+             UNION
+             SELECT {} FROM ancestors WHERE path != ''
+           )
+           INSERT OR IGNORE INTO folders (path)
+           SELECT path FROM ancestors;'''
+        .format(_FOLDER_OF.format('path'), _PARENT_OF.format('path')),
+        '''UPDATE folders
+           SET
+             parent_id = (SELECT parent.folder_id FROM folders AS parent
+                          WHERE parent.path = {parent}),
+             name = substr(path, length({parent}) + 1,
+                           length(path) - length({parent}) - 1)
+           WHERE path != '';'''
+        .format(parent=_PARENT_OF.format('folders.path')),
+        '''UPDATE images
+           SET
+             folder_id = (SELECT folder_id FROM folders
+                          WHERE folders.path = {folder}),
+             name = substr(path, length({folder}) + 1);'''
+        .format(folder=_FOLDER_OF.format('images.path')),
+        '''UPDATE folders
+           SET image_count = (SELECT COUNT(*) FROM images
+                              WHERE images.folder_id = folders.folder_id
+                                AND active = 1);''',
+        '''CREATE INDEX IF NOT EXISTS images_folder_name
+           ON images (folder_id, name);''',
+        '''CREATE INDEX IF NOT EXISTS folders_parent_name
+           ON folders (parent_id, name);''',
+        '''DROP INDEX IF EXISTS images_folder;''',
+        '''CREATE TRIGGER IF NOT EXISTS images_count_insert
+           AFTER INSERT ON images WHEN NEW.active
+           BEGIN
+             UPDATE folders SET image_count = image_count + 1
+             WHERE folder_id = NEW.folder_id;
+           END;''',
+        '''CREATE TRIGGER IF NOT EXISTS images_count_delete
+           AFTER DELETE ON images WHEN OLD.active
+           BEGIN
+             UPDATE folders SET image_count = image_count - 1
+             WHERE folder_id = OLD.folder_id;
+           END;''',
+        '''CREATE TRIGGER IF NOT EXISTS images_count_update
+           AFTER UPDATE OF folder_id, active ON images
+           BEGIN
+             UPDATE folders SET image_count = image_count - OLD.active
+             WHERE folder_id = OLD.folder_id;
+             UPDATE folders SET image_count = image_count + NEW.active
+             WHERE folder_id = NEW.folder_id;
+           END;''',
+    ],
+    # 5: indexes for queries of date ranges
+    [
+        '''CREATE INDEX IF NOT EXISTS images_created_at
+           ON images (created_at);''',
+        '''CREATE INDEX IF NOT EXISTS images_modified_at
+           ON images (modified_at);''',
+    ],
+]  # type: List[List[str]]
+
+SCHEMA_VERSION = len(_MIGRATIONS)
+
 THUMBNAIL_SIZES = ((120, 80), (300, 200))
 
 _CREATE_THUMBNAILS_TABLE = \
@@ -54,9 +299,25 @@ _CREATE_THUMBNAILS_TABLE = \
     '''
 
 _INSERT_IMAGE = \
-    '''INSERT INTO images VALUES (
-        ?, ?, ?, ?, ?, ?
-    );
+    '''INSERT INTO images (
+         path,
+         created_at,
+         modified_at,
+         md5,
+         dhash,
+         active,
+         folder_id,
+         name
+       ) VALUES (
+         ?1, ?2, ?3, ?4, ?5, ?6,
+         (SELECT folder_id FROM folders WHERE path = {folder}),
+         substr(?1, length({folder}) + 1)
+       );
+    '''.format(folder=_FOLDER_OF.format('?1'))
+
+_INSERT_FOLDER = \
+    '''INSERT OR IGNORE INTO folders (parent_id, name, path)
+       SELECT folder_id, ?, ? FROM folders WHERE path = ?;
     '''
 
 _INSERT_LIST = \
@@ -77,17 +338,62 @@ _INSERT_THUMBNAIL = \
     );
     '''
 
+_STORE_IMAGE_HASH = \
+    '''INSERT OR REPLACE INTO image_hashes VALUES (
+        ?, ?, ?
+    );
+    '''
+
+_GET_IMAGE_HASHES = \
+    '''SELECT
+         algorithm,
+         hash
+       FROM image_hashes
+       WHERE
+         image_id = ?;'''
+
+_GET_IMAGES_MISSING_HASH = \
+    '''SELECT
+         rowid,
+         path
+       FROM images
+       WHERE
+         active = 1
+         AND NOT EXISTS (SELECT 1
+                         FROM image_hashes
+                         WHERE image_hashes.image_id = images.rowid
+                           AND image_hashes.algorithm = ?);'''
+
+_STORE_FOLDER_SCAN = \
+    '''INSERT OR REPLACE INTO folder_scans VALUES (
+        ?, ?, ?
+    );
+    '''
+
+_STORE_SCAN_SESSION = \
+    '''INSERT OR REPLACE INTO scan_sessions VALUES (
+        ?, ?, ?, ?
+    );
+    '''
+
+_DELETE_SCAN_SESSION = \
+    '''DELETE FROM scan_sessions
+       WHERE source = ?;
+    '''
+
 _UPDATE_IMAGE = \
     '''UPDATE images
        SET
-         path = ?,
-         created_at = ?,
-         modified_at = ?,
-         md5 = ?,
-         dhash = ?,
-         active = ?
-       WHERE rowid = ?;
-    '''
+         path = ?1,
+         created_at = ?2,
+         modified_at = ?3,
+         md5 = ?4,
+         dhash = ?5,
+         active = ?6,
+         folder_id = (SELECT folder_id FROM folders WHERE path = {folder}),
+         name = substr(?1, length({folder}) + 1)
+       WHERE rowid = ?7;
+    '''.format(folder=_FOLDER_OF.format('?1'))
 
 _UPDATE_LIST = \
     '''UPDATE lists
@@ -97,6 +403,9 @@ _UPDATE_LIST = \
        WHERE rowid = ?;
     '''
 
+_UPDATE_LIST_ENTRY_POSITION = \
+    '''UPDATE list_entries SET position = ? WHERE rowid = ?;'''
+
 _UPDATE_LIST_ENTRY = \
     '''UPDATE list_entries
        SET
@@ -106,6 +415,12 @@ _UPDATE_LIST_ENTRY = \
        WHERE rowid = ?;
     '''
 
+_INSERT_EMPTY_THUMBNAIL = \
+    '''INSERT OR IGNORE INTO thumbnails (image_id) VALUES (
+        ?
+    );
+    '''
+
 _UPDATE_THUMBNAIL = \
     '''UPDATE thumbnails
        SET
@@ -113,6 +428,10 @@ _UPDATE_THUMBNAIL = \
        WHERE image_id = ?;
     '''
 
+# columns of the images table converted by `KnipseDB.descriptor_from_row`
+IMAGE_COLUMNS = ('rowid', 'path', 'created_at', 'modified_at', 'md5',
+                 'dhash', 'active')
+
 _GET_IMAGES = \
     '''SELECT
          rowid,
@@ -126,10 +445,135 @@ _GET_IMAGES = \
        WHERE
          active = 1;'''
 
+# columns of the image index file (see `index.write_index_records`)
+_GET_INDEX_RECORDS = \
+    '''SELECT md5, dhash, rowid, path, created_at, modified_at
+       FROM images
+       WHERE active = 1
+       ORDER BY md5, rowid;'''
+
+_GET_IMAGE_IDS_BY_DHASH = \
+    '''SELECT rowid FROM images WHERE active = 1 ORDER BY dhash, rowid;'''
+
+_GET_IMAGE_IDS_BY_PATH = \
+    '''SELECT rowid FROM images WHERE active = 1 ORDER BY path, rowid;'''
+
+_GET_IMAGE_PATHS = \
+    '''SELECT
+         rowid,
+         path
+       FROM images
+       WHERE
+         active = 1;'''
+
+_GET_IMAGE_DHASHES = \
+    '''SELECT
+         rowid,
+         dhash
+       FROM images
+       WHERE
+         active = 1;'''
+
+_GET_DUPLICATE_MD5S = \
+    '''SELECT
+         rowid,
+         md5,
+         path
+       FROM images
+       WHERE
+         active = 1
+         AND md5 IN (SELECT md5
+                     FROM images
+                     WHERE active = 1
+                     GROUP BY md5
+                     HAVING COUNT(*) > 1)
+       ORDER BY md5, rowid;'''
+
+_DEACTIVATE_IMAGE = \
+    '''UPDATE images
+       SET
+         active = 0
+       WHERE rowid = ?;
+    '''
+
 _GET_IMAGES_BY_ID = \
     _GET_IMAGES[:-1] + \
     ''' AND rowid=?;'''
 
+_GET_IMAGES_BY_PATH = \
+    _GET_IMAGES[:-1] + \
+    ''' AND path=?;'''
+
+_GET_IMAGES_BY_MD5 = \
+    _GET_IMAGES[:-1] + \
+    ''' AND md5=?;'''
+
+# lookups of `LazyImageRecognizer`, restricted to images
+# stored before the recognizer was created
+_GET_MAX_IMAGE_ID = \
+    '''SELECT
+         COALESCE(MAX(rowid), 0)
+       FROM images;'''
+
+_GET_KNOWN_IMAGES_IN_FOLDER = \
+    _GET_IMAGES[:-1] + \
+    ''' AND folder_id = (SELECT folder_id FROM folders WHERE path = ?)
+        AND rowid <= ?;'''
+
+_GET_KNOWN_IMAGES_BY_MD5 = \
+    _GET_IMAGES[:-1] + \
+    ''' AND md5 = ? AND rowid <= ? ORDER BY rowid DESC LIMIT 1;'''
+
+_GET_KNOWN_IMAGES_BY_DHASH = \
+    _GET_IMAGES[:-1] + \
+    ''' AND dhash = ? AND rowid <= ? LIMIT 2;'''
+
+_GET_IMAGES_IN_FOLDER = \
+    _GET_IMAGES[:-1] + \
+    ''' AND folder_id = (SELECT folder_id FROM folders WHERE path = ?)
+        ORDER BY name;'''
+
+_GET_FOLDER = \
+    '''SELECT
+         folder_id,
+         parent_id,
+         path,
+         image_count
+       FROM folders
+       WHERE
+         path = ?;'''
+
+_GET_SUBFOLDERS = \
+    '''SELECT
+         sub.folder_id,
+         sub.parent_id,
+         sub.path,
+         sub.image_count
+       FROM folders AS sub
+       JOIN folders AS parent ON sub.parent_id = parent.folder_id
+       WHERE
+         parent.path = ?
+       ORDER BY sub.name;'''
+
+# trigram queries match substrings of at least three characters
+_MIN_SEARCH_LENGTH = 3
+
+_SEARCH_IMAGES = \
+    _GET_IMAGES[:-1] + \
+    ''' AND rowid IN (SELECT rowid FROM images_fts
+                      WHERE images_fts MATCH ?)'''
+
+_SEARCH_IMAGES_WITHOUT_INDEX = \
+    _GET_IMAGES[:-1] + \
+    ''' AND path LIKE ? ESCAPE '!\''''
+
+_GET_INACTIVE_IMAGE_IDS = \
+    '''SELECT
+         rowid
+       FROM images
+       WHERE
+         active = 0;'''
+
 _GET_IMAGES_IN_LIST = \
     '''SELECT
          images.rowid,
@@ -150,6 +594,41 @@ _GET_IMAGES_IN_LIST = \
          AND list_entries.list_id = ?
        ORDER BY position;'''
 
+_GET_LIST_END = \
+    '''SELECT MAX(position) FROM list_entries WHERE list_id = ?;'''
+
+_GET_LIST_ENTRY = \
+    '''SELECT rowid, list_id, image_id, position
+       FROM list_entries
+       WHERE rowid = ?;
+    '''
+
+# positions of the neighbours of a position (ignoring entry ?3)
+_GET_PREVIOUS_POSITION = \
+    '''SELECT position FROM list_entries
+       WHERE list_id = ?1 AND position < ?2 AND rowid != ?3
+       ORDER BY position DESC LIMIT 1;
+    '''
+
+_GET_NEXT_POSITION = \
+    '''SELECT position FROM list_entries
+       WHERE list_id = ?1 AND position > ?2 AND rowid != ?3
+       ORDER BY position LIMIT 1;
+    '''
+
+# windows of entries up to and from a position (ignoring entry ?3)
+_GET_ENTRIES_UP_TO = \
+    '''SELECT rowid, position FROM list_entries
+       WHERE list_id = ?1 AND position <= ?2 AND rowid != ?3
+       ORDER BY position DESC, rowid DESC LIMIT ?4;
+    '''
+
+_GET_ENTRIES_FROM = \
+    '''SELECT rowid, position FROM list_entries
+       WHERE list_id = ?1 AND position >= ?2 AND rowid != ?3
+       ORDER BY position, rowid LIMIT ?4;
+    '''
+
 _GET_LISTS = \
     '''SELECT
          rowid,
@@ -165,46 +644,338 @@ _GET_THUMBNAIL = \
        WHERE
          image_id = ?;'''
 
+_GET_FOLDER_SCANS = \
+    '''SELECT
+         path,
+         modified_at,
+         entries
+       FROM folder_scans;'''
+
+_GET_SCAN_SESSION = \
+    '''SELECT
+         source,
+         folder_tree,
+         walked,
+         stored
+       FROM scan_sessions
+       WHERE
+         source = ?;'''
+
+# format of timestamps before schema version 3
 _DT_FMT = '''%Y-%m-%d %H:%M:%S.%f'''
 
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+_ENABLE_WAL = '''PRAGMA journal_mode = WAL;'''
+
+# seconds to wait for locks held by other connections
+_BUSY_TIMEOUT = 30.0
+
+# read-only connections kept open for reuse by `KnipseDB`
+DEFAULT_MAX_IDLE_READERS = 4
+
+# images cached by `LazyImageRecognizer` (per kind of lookup)
+DEFAULT_RECOGNIZER_CACHE_SIZE = 10000
+
+# number of rows converted at a time by `KnipseDB.load_image_table`
+DEFAULT_CHUNK_SIZE = 10000
+
+# number of buffered rows written per transaction by `BatchWriter`
+DEFAULT_COMMIT_INTERVAL = 1000
+
+# entries on each side of a gap in a list initially respaced when the
+# positions around it are exhausted (doubled until enough space is found)
+_REBALANCE_WINDOW = 16
+
+
+def to_nanos(dt: Optional[datetime]) -> Optional[int]:
+    '''Convert (naive) `dt` to nanoseconds since the epoch.'''
+    return (dt - _EPOCH) // _MICROSECOND * 1000 if dt is not None else None
+
+
+def from_nanos(nanos: Optional[int]) -> Optional[datetime]:
+    '''Convert nanoseconds since the epoch to a (naive) `datetime`.'''
+    return _datetime_from_nanos(nanos) if nanos is not None else None
+
+
+def _datetime_from_nanos(nanos: int) -> datetime:
+    return _EPOCH + (nanos // 1000) * _MICROSECOND
+
+
+def _folder_key(folder: Path) -> str:
+    '''Path of `folder` (relative to source) as in the folders table.'''
+    folder_str = str(folder)
+    return '' if folder_str in ('', '.') else folder_str + '/'
+
+
+def _folder_of(rel_path: str) -> str:
+    '''Folder of `rel_path` as in the folders table,
+       i.e. up to and including the last slash.
+    '''
+    return rel_path[:rel_path.rfind('/') + 1]
+
+
+def _folder_rows(folder: str) -> Iterable[tuple]:
+    '''Rows for the folders table of `folder` and all its ancestors
+       (parents first), the source folder is always present.
+    '''
+    parent = ''
+    for name in folder.split('/')[:-1]:
+        yield name, parent + name + '/', parent
+        parent += name + '/'
+
+
+def _folder_descriptor(row: tuple) -> FolderDescriptor:
+    folder_id, parent_id, path, image_count = row
+    return FolderDescriptor(folder_id, parent_id, Path(path), image_count)
+
+
+def _spread_positions(lower: Optional[float], upper: Optional[float],
+                      count: int) -> Optional[List[float]]:
+    '''`count` evenly spaced positions strictly between `lower` and
+       `upper` (`None` for no bound), `None` if float precision does
+       not suffice to separate them.
+    '''
+    if lower is None:
+        if upper is None:
+            return [float(i) for i in range(count)]
+        lower = upper - count - 1
+    elif upper is None:
+        upper = lower + count + 1
+    step = (upper - lower) / (count + 1)
+    positions = [lower + step * (i + 1) for i in range(count)]
+    bounds = [lower] + positions + [upper]
+    if all(a < b for a, b in zip(bounds, bounds[1:])):
+        return positions
+    return None
+
+
+def _inserted_id(cursor: sqlite3.Cursor) -> int:
+    '''Row id of the row just inserted by `cursor`.'''
+    assert cursor.lastrowid is not None, 'No row was inserted'
+    return cursor.lastrowid
+
+
+def _image_data(descriptor: ImageDescriptor) -> tuple:
+    '''Convert `descriptor` to a row of the images table (without id).'''
+    return (
+        str(descriptor.path),
+        to_nanos(descriptor.created_at),
+        to_nanos(descriptor.modified_at),
+        descriptor.md5,
+        descriptor.dhash,
+        int(descriptor.active)
+    )
+
+
+def _image_hashes_data(image_id: int, hashes: Dict[str, bytes]) \
+        -> Iterable[tuple]:
+    for algorithm, hsh in hashes.items():
+        yield image_id, algorithm, hsh
+
+
+def _folder_scan_data(folders: Iterable[Tuple[Path, datetime, int]]) \
+        -> Iterable[tuple]:
+    for path, modified_at, entries in folders:
+        yield str(path), to_nanos(modified_at), entries
+
+
+def _scan_session_data(session: ScanSessionDescriptor) -> tuple:
+    '''Convert `session` to a row of the scan sessions table,
+       folders are stored relative to the scan source.
+    '''
+    folder_tree = [[(str(folder.relative_to(session.source)), lower, higher)
+                    for folder, lower, higher in level]
+                   for level in session.folder_tree]
+    return (str(session.source), json.dumps(folder_tree),
+            session.walked, session.stored)
+
+
+def _thumbnail_bytes(thumbnail: Image.Image, size: Tuple[int, int]) \
+        -> Tuple[str, bytes]:
+    '''Encode `thumbnail` of `size` as JPEG,
+       returns thumbnail column and data.
+    '''
+    assert size in THUMBNAIL_SIZES
+    assert thumbnail.size[0] <= size[0] and thumbnail.size[1] <= size[1]
+    size_col = 't{}x{}'.format(*size)
+    with io.BytesIO() as stream:
+        thumbnail.save(stream, format='JPEG')
+        return size_col, stream.getvalue()
+
 
 class KnipseDB:
     '''Wrapper for the SQLite database in which knipse stores all data.'''
 
-    def __init__(self, connection_string: str) -> None:
-        self.db = sqlite3.connect(connection_string)
+    def __init__(self, connection_string: str,
+                 max_idle_readers: int = DEFAULT_MAX_IDLE_READERS) -> None:
+        in_memory = connection_string == ':memory:'
+        # single connection for all writes
+        self.db = sqlite3.connect(connection_string, timeout=_BUSY_TIMEOUT)
+        if not in_memory:
+            # readers see the last commit while a writer is active
+            self.db.execute(_ENABLE_WAL)
+        # read-only connections (none for in-memory db, reads use `db`)
+        self._reader_uri = None if in_memory \
+            else Path(connection_string).resolve().as_uri() + '?mode=ro'
+        self._idle_readers = []  # type: List[sqlite3.Connection]
+        self._max_idle_readers = max_idle_readers
+        self._readers_lock = threading.Lock()
+        self._local = threading.local()
+        # time spent storing images, may be replaced for instrumentation
+        self.stats = NO_STATS  # type: ScanStats
+        # image index file next to database file (none for in-memory db)
+        self.index_path = None if in_memory \
+            else Path(connection_string + '.idx')
+        self._image_index = None  # type: Optional[ImageIndex]
         self._setup_db()
 
+    def close(self) -> None:
+        '''Close all connections to the database.'''
+        with self._readers_lock:
+            for conn in self._idle_readers:
+                conn.close()
+            self._idle_readers.clear()
+        if self._image_index is not None:
+            self._image_index.close()
+            self._image_index = None
+        self.db.close()
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        '''Connection for reads: the connection of the current `snapshot`,
+           a read-only connection from the pool or (for in-memory
+           databases) the writer connection.
+        '''
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            yield snapshot
+            return
+        if self._reader_uri is None:
+            # no context manager here, which would commit a transaction
+            # of the writer connection in progress
+            yield self.db
+            return
+        conn = None  # type: Optional[sqlite3.Connection]
+        with self._readers_lock:
+            if self._idle_readers:
+                conn = self._idle_readers.pop()
+        if conn is None:
+            conn = sqlite3.connect(self._reader_uri, uri=True,
+                                   timeout=_BUSY_TIMEOUT,
+                                   check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            with self._readers_lock:
+                if len(self._idle_readers) < self._max_idle_readers:
+                    self._idle_readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def snapshot(self) -> Iterator[None]:
+        '''All reads of the current thread within this context see the same
+           state of the database, unaffected by concurrent writes.
+           Writes of the own writer connection are not visible either.
+           In-memory databases only have a single connection, so this is
+           no snapshot for them: reads see all writes.
+        '''
+        if self._reader_uri is None or \
+                getattr(self._local, 'snapshot', None) is not None:
+            yield  # single connection or nested snapshot
+            return
+        with self._reader() as conn:
+            conn.execute('BEGIN;')
+            # the snapshot is taken by the first read of the transaction
+            conn.execute(_GET_IMAGES_GENERATION).fetchone()
+            self._local.snapshot = conn
+            try:
+                yield
+            finally:
+                self._local.snapshot = None
+                conn.rollback()
+
     def _setup_db(self):
         with self.db as conn:
             conn.execute(_CREATE_IMAGE_TABLE)
+            conn.execute(_CREATE_IMAGES_GENERATION_TABLE)
+            conn.execute(_INIT_IMAGES_GENERATION)
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(_CREATE_IMAGES_GENERATION_TRIGGER.format(event))
             conn.execute(_CREATE_LISTS_TABLE)
             conn.execute(_CREATE_LIST_ENTRIES_TABLE)
             conn.execute(_CREATE_THUMBNAILS_TABLE)
+            conn.execute(_CREATE_IMAGE_HASHES_TABLE)
+            conn.execute(_CREATE_FOLDER_SCANS_TABLE)
+            conn.execute(_CREATE_SCAN_SESSIONS_TABLE)
+            conn.execute(_CREATE_SCHEMA_VERSION_TABLE)
+        self._migrate()
+        self.path_search = self._setup_path_search()
+
+    def _setup_path_search(self) -> bool:
+        '''Create the trigram index of image paths unless present,
+           returns whether it is available.
+        '''
+        with self.db as conn:
+            if conn.execute(_HAS_PATH_SEARCH).fetchone()[0]:
+                return True
+        try:
+            with self.db as conn:
+                conn.execute(_CREATE_PATH_SEARCH_TABLE)
+                for statement in _CREATE_PATH_SEARCH_TRIGGERS:
+                    conn.execute(statement)
+                conn.execute(_REBUILD_PATH_SEARCH)
+        except sqlite3.OperationalError:
+            return False  # FTS5 or trigram tokenizer not supported
+        return True
+
+    def schema_version(self) -> int:
+        '''Version of the database schema, see `SCHEMA_VERSION`.'''
+        with self.db as conn:
+            return conn.execute(_GET_SCHEMA_VERSION).fetchone()[0] or 0
+
+    def _migrate(self) -> None:
+        '''Migrate database to the current `SCHEMA_VERSION`,
+           each migration in its own transaction.
+        '''
+        version = self.schema_version()
+        if version > SCHEMA_VERSION:
+            raise Exception('Database schema version {} is newer than '
+                            'supported version {}, please update knipse'
+                            .format(version, SCHEMA_VERSION))
+        for version in range(version, SCHEMA_VERSION):
+            with self.db as conn:
+                for statement in _MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(_STORE_SCHEMA_VERSION, (version + 1,))
+
+    def _store_folders(self, conn: sqlite3.Connection,
+                       rows: Iterable[tuple]) -> None:
+        '''Store the folders of all `rows` of the images table
+           (and their ancestors) unless already stored.
+        '''
+        folders = sorted(set(_folder_of(row[0]) for row in rows))
+        conn.executemany(_INSERT_FOLDER, (row for folder in folders
+                                          for row in _folder_rows(folder)))
 
     def store_image(self, descriptor: ImageDescriptor) -> ImageDescriptor:
         '''Store `descriptor` in the database. If `descriptor` contains
            an `image_id`, the corresponding row in the database is updated.
         '''
-        created_at = datetime.strftime(descriptor.created_at, _DT_FMT) \
-            if descriptor.created_at else None
-        modified_at = datetime.strftime(descriptor.modified_at, _DT_FMT) \
-            if descriptor.modified_at else None
-        with self.db as conn:
-            data = (
-                str(descriptor.path),
-                created_at,
-                modified_at,
-                descriptor.md5,
-                descriptor.dhash,
-                int(descriptor.active)
-            )
+        with self.stats.timer('store'), self.db as conn:
+            data = _image_data(descriptor)
+            self._store_folders(conn, [data])
             if descriptor.image_id is None:
-                cursor = conn.execute(_INSERT_IMAGE, data)
+                image_id = _inserted_id(conn.execute(_INSERT_IMAGE, data))
             else:
-                cursor = conn.execute(_UPDATE_IMAGE,
-                                      (*data, descriptor.image_id))
-            return descriptor.with_id(cursor.lastrowid)
+                conn.execute(_UPDATE_IMAGE, (*data, descriptor.image_id))
+                image_id = descriptor.image_id
+            conn.executemany(_STORE_IMAGE_HASH,
+                             _image_hashes_data(image_id, descriptor.hashes))
+            return descriptor.with_id(image_id)
 
     def store_list(self, lst: ListDescriptor,
                    images: Iterable[ImageDescriptor] = []) \
@@ -222,11 +993,15 @@ class KnipseDB:
                 cursor = conn.execute(_UPDATE_LIST, (*data, lst.list_id))
             list_id = cursor.lastrowid
             lst = lst.with_id(list_id)
+            entries = []
             for i, img in enumerate(images):
                 if img.image_id is None:
-                    img = self.store_image(img)
-                conn.execute(_INSERT_LIST_ENTRY,
-                             (lst.list_id, img.image_id, float(i)))
+                    data = _image_data(img)
+                    self._store_folders(conn, [data])
+                    cursor = conn.execute(_INSERT_IMAGE, data)
+                    img = img.with_id(_inserted_id(cursor))
+                entries.append((lst.list_id, img.image_id, float(i)))
+            conn.executemany(_INSERT_LIST_ENTRY, entries)
             return lst
 
     def store_list_entry(self, list_entry: ListEntryDescriptor) \
@@ -244,6 +1019,139 @@ class KnipseDB:
                                       (*data, list_entry.list_entry_id))
             return list_entry.with_id(cursor.lastrowid)
 
+    def store_list_entries(self, entries: Iterable[ListEntryDescriptor]) \
+            -> int:
+        '''Insert all `entries` at their positions in one transaction,
+           e.g. a batch of entries inserted between existing ones. Returns
+           the number of inserted entries.
+        '''
+        with self.db as conn:
+            return conn.executemany(_INSERT_LIST_ENTRY, (
+                (entry.list_id, entry.image_id, entry.position)
+                for entry in entries)).rowcount
+
+    def append_to_list(self, list_id: int, image_ids: Iterable[int]) -> int:
+        '''Append the images `image_ids` to the end of list `list_id` in
+           one transaction (`image_ids` may be a stream, nothing is stored
+           if it raises). Returns the number of appended entries.
+        '''
+        with self.db as conn:
+            end = conn.execute(_GET_LIST_END, (list_id,)).fetchone()[0]
+            start = 1.0 if end is None else end + 1.0
+            return conn.executemany(_INSERT_LIST_ENTRY, (
+                (list_id, image_id, start + i)
+                for i, image_id in enumerate(image_ids))).rowcount
+
+    def insert_into_list(self, image_ids: Iterable[int],
+                         before: Optional[int] = None,
+                         after: Optional[int] = None) \
+            -> List[ListEntryDescriptor]:
+        '''Insert the images `image_ids` into a list directly `before` or
+           `after` one of its entries (list entry id, exactly one of both)
+           in one transaction. Returns the inserted entries.
+        '''
+        image_ids = list(image_ids)
+        with self.db as conn:
+            list_id, lower, upper = self._list_gap(conn, before, after, 0)
+            positions = self._positions_between(conn, list_id, lower, upper,
+                                                len(image_ids), 0)
+            entries = [ListEntryDescriptor(None, list_id, image_id, position)
+                       for image_id, position in zip(image_ids, positions)]
+            return [entry.with_id(_inserted_id(conn.execute(
+                        _INSERT_LIST_ENTRY,
+                        (list_id, entry.image_id, entry.position))))
+                    for entry in entries]
+
+    def move_list_entry(self, list_entry_id: int,
+                        before: Optional[int] = None,
+                        after: Optional[int] = None) -> ListEntryDescriptor:
+        '''Move list entry `list_entry_id` directly `before` or `after`
+           another entry of its list (list entry id, exactly one of both).
+           Only the moved entry is updated, unless there is no position
+           left between its new neighbours (see `_positions_between`).
+        '''
+        with self.db as conn:
+            entry = self._load_list_entry(conn, list_entry_id)
+            if list_entry_id in (before, after):
+                return entry
+            list_id, lower, upper = self._list_gap(conn, before, after,
+                                                   list_entry_id)
+            if list_id != entry.list_id:
+                raise Exception('List entries {} and {} are in different '
+                                'lists!'.format(list_entry_id,
+                                                before or after))
+            entry.position, = self._positions_between(
+                conn, list_id, lower, upper, 1, list_entry_id)
+            conn.execute(_UPDATE_LIST_ENTRY_POSITION,
+                         (entry.position, list_entry_id))
+            return entry
+
+    @staticmethod
+    def _load_list_entry(conn: sqlite3.Connection, list_entry_id: int) \
+            -> ListEntryDescriptor:
+        row = conn.execute(_GET_LIST_ENTRY, (list_entry_id,)).fetchone()
+        if not row:
+            raise Exception('List entry {} does not exist!'
+                            .format(list_entry_id))
+        return ListEntryDescriptor(*row)
+
+    def _list_gap(self, conn: sqlite3.Connection, before: Optional[int],
+                  after: Optional[int], exclude: int) \
+            -> Tuple[int, Optional[float], Optional[float]]:
+        '''List id and positions of the entries enclosing the gap directly
+           `before` or `after` a list entry, ignoring entry `exclude`.
+        '''
+        if after is not None:
+            assert before is None, \
+                'Exactly one of before and after must be given'
+            anchor = self._load_list_entry(conn, after)
+            row = conn.execute(_GET_NEXT_POSITION, (
+                anchor.list_id, anchor.position, exclude)).fetchone()
+            return anchor.list_id, anchor.position, row and row[0]
+        assert before is not None, \
+            'Exactly one of before and after must be given'
+        anchor = self._load_list_entry(conn, before)
+        row = conn.execute(_GET_PREVIOUS_POSITION, (
+            anchor.list_id, anchor.position, exclude)).fetchone()
+        return anchor.list_id, row and row[0], anchor.position
+
+    @staticmethod
+    def _positions_between(conn: sqlite3.Connection, list_id: int,
+                           lower: Optional[float], upper: Optional[float],
+                           count: int, exclude: int) -> List[float]:
+        '''Positions for `count` entries between the neighbouring
+           positions `lower` and `upper` of list `list_id` (`None` at the
+           start or end of the list), ignoring entry `exclude`. Positions
+           are bisected, so repeated insertions into the same gap exhaust
+           the float precision at some point. Then the entries in a window
+           around the gap are respaced evenly (in the current transaction)
+           between the positions just outside of it, which only depends
+           on the size of the window, not of the list.
+        '''
+        positions = _spread_positions(lower, upper, count)
+        window = _REBALANCE_WINDOW
+        while positions is None:
+            below = [] if lower is None else conn.execute(
+                _GET_ENTRIES_UP_TO,
+                (list_id, lower, exclude, window + 1)).fetchall()
+            above = [] if upper is None else conn.execute(
+                _GET_ENTRIES_FROM,
+                (list_id, upper, exclude, window + 1)).fetchall()
+            outer_lower = below.pop()[1] if len(below) > window else None
+            outer_upper = above.pop()[1] if len(above) > window else None
+            entries = [rowid for rowid, _ in reversed(below)] \
+                + [None] * count + [rowid for rowid, _ in above]
+            spread = _spread_positions(outer_lower, outer_upper,
+                                       len(entries))
+            if spread is None:
+                window *= 2
+                continue
+            conn.executemany(_UPDATE_LIST_ENTRY_POSITION, (
+                (position, rowid) for rowid, position
+                in zip(entries, spread) if rowid is not None))
+            positions = spread[len(below):len(below) + count]
+        return positions
+
     @staticmethod
     def _thumbnail_data(descriptor: ImageDescriptor, thumbnail: bytes,
                         size: str):
@@ -251,14 +1159,10 @@ class KnipseDB:
         yield thumbnail if size == 't120x80' else None
         yield thumbnail if size == 't300x200' else None
 
-    def store_thumbnail(self, descriptor: ImageDescriptor, thumbnail: Image,
+    def store_thumbnail(self, descriptor: ImageDescriptor,
+                        thumbnail: Image.Image,
                         size: Tuple[int, int]):
-        assert size in THUMBNAIL_SIZES
-        assert thumbnail.size[0] <= size[0] and thumbnail.size[1] <= size[1]
-        size_col = 't{}x{}'.format(*size)
-        with io.BytesIO() as stream:
-            thumbnail.save(stream, format='JPEG')
-            thumbnail_data = stream.getvalue()
+        size_col, thumbnail_data = _thumbnail_bytes(thumbnail, size)
         with self.db as conn:
             cursor = conn.execute(_GET_THUMBNAIL, (descriptor.image_id, ))
             if cursor.fetchone():
@@ -270,11 +1174,93 @@ class KnipseDB:
                                                       size_col))
                 conn.execute(_INSERT_THUMBNAIL, data)
 
+    def batch(self, commit_interval: int = DEFAULT_COMMIT_INTERVAL,
+              on_insert: Optional[Callable[[ImageDescriptor], None]] = None,
+              stats: Optional[ScanStats] = None) -> 'BatchWriter':
+        '''Create a `BatchWriter` storing images and thumbnails in bulk,
+           to be used as a context manager.
+        '''
+        return BatchWriter(self, commit_interval, on_insert,
+                           stats if stats is not None else self.stats)
+
+    def store_images(self, descriptors: Iterable[ImageDescriptor],
+                     commit_interval: int = DEFAULT_COMMIT_INTERVAL) -> None:
+        '''Store all `descriptors` in the database (inserting new and
+           updating known images), committing every `commit_interval` rows.
+        '''
+        with self.batch(commit_interval) as batch:
+            for descriptor in descriptors:
+                batch.store_image(descriptor)
+
+    def store_image_hashes(self, image_id: int,
+                           hashes: Dict[str, bytes]) -> None:
+        '''Store additional perceptual `hashes` (by algorithm name)
+           of image `image_id`, replacing existing ones.
+        '''
+        with self.db as conn:
+            conn.executemany(_STORE_IMAGE_HASH,
+                             _image_hashes_data(image_id, hashes))
+
+    def load_image_hashes(self, image_id: int) -> Dict[str, bytes]:
+        '''Loads additional perceptual hashes of image `image_id`
+           by algorithm name.
+        '''
+        with self._reader() as conn:
+            return dict(conn.execute(_GET_IMAGE_HASHES, (image_id,)))
+
+    def load_images_missing_hash(self, algorithm: str) \
+            -> Iterable[Tuple[int, str]]:
+        '''Loads ids and paths (relative to source) of all active images
+           without a hash of `algorithm`.
+        '''
+        with self._reader() as conn:
+            yield from conn.execute(_GET_IMAGES_MISSING_HASH, (algorithm,))
+
+    def store_folder_scans(self,
+                           folders: Iterable[Tuple[Path, datetime, int]]) \
+            -> None:
+        '''Store modification time and number of entries of scanned
+           `folders` (relative to the image source) in the database.
+        '''
+        with self.db as conn:
+            conn.executemany(_STORE_FOLDER_SCAN, _folder_scan_data(folders))
+
+    def load_folder_scans(self) -> Iterable[Tuple[Path, datetime, int]]:
+        '''Loads modification time and number of entries
+           of folders seen by previous scans.
+        '''
+        with self._reader() as conn:
+            for path_str, modified_at, entries \
+                    in conn.execute(_GET_FOLDER_SCANS):
+                yield Path(path_str), _datetime_from_nanos(modified_at), \
+                    entries
+
+    def load_scan_session(self, source: Path) \
+            -> Optional[ScanSessionDescriptor]:
+        '''Load the state of the last interrupted scan of `source`
+           as `ScanSessionDescriptor` instance (if any).
+        '''
+        source = Path(source)
+        with self._reader() as conn:
+            row = conn.execute(_GET_SCAN_SESSION, (str(source),)).fetchone()
+        if not row:
+            return None
+        _, folder_tree_str, walked, stored = row
+        folder_tree = [[(source / folder, lower, higher)
+                        for folder, lower, higher in level]
+                       for level in json.loads(folder_tree_str)]
+        return ScanSessionDescriptor(source, folder_tree, walked, stored)
+
+    def delete_scan_session(self, source: Path) -> None:
+        '''Delete the state of the last scan of `source`.'''
+        with self.db as conn:
+            conn.execute(_DELETE_SCAN_SESSION, (str(source),))
+
     def descriptor_from_row(self, row: tuple) -> ImageDescriptor:
         '''Parse, check and convert a database row to an `ImageDescriptor`.'''
         assert len(row) == 7, 'Row length must be 7, got {}'.format(len(row))
-        (image_id, path_str, created_at_str,
-         modified_at_str, md5, dhash, active_int) = row
+        (image_id, path_str, created_at_nanos,
+         modified_at_nanos, md5, dhash, active_int) = row
         assert isinstance(image_id, int), \
             'Image ID must be of type int, got {} of type {}' \
             .format(image_id, type(image_id))
@@ -284,11 +1270,17 @@ class KnipseDB:
             'path must be of type string, got {} of type {}' \
             .format(path_str, type(path_str))
         path = Path(path_str)
-        created_at = datetime.strptime(created_at_str, _DT_FMT) \
-            if created_at_str else None
-        assert modified_at_str is not None, \
+        assert created_at_nanos is None \
+            or isinstance(created_at_nanos, int), \
+            'Creation date must be of type int, got {} of type {}' \
+            .format(created_at_nanos, type(created_at_nanos))
+        created_at = from_nanos(created_at_nanos)
+        assert modified_at_nanos is not None, \
             'Modification date in row {} may not be None'.format(row)
-        modified_at = datetime.strptime(modified_at_str, _DT_FMT)
+        assert isinstance(modified_at_nanos, int), \
+            'Modification date must be of type int, got {} of type {}' \
+            .format(modified_at_nanos, type(modified_at_nanos))
+        modified_at = _datetime_from_nanos(modified_at_nanos)
         assert md5 is not None, \
             'md5 hash in row {} may not be None'.format(row)
         assert isinstance(md5, bytes), \
@@ -323,15 +1315,126 @@ class KnipseDB:
         '''Loads images contained in database
            as `ImageDescriptor` instances.
         '''
-        with self.db as conn:
+        with self._reader() as conn:
             for row in conn.execute(_GET_IMAGES):
                 yield self.descriptor_from_row(row)
 
+    def load_image_table(self, chunk_size: int = DEFAULT_CHUNK_SIZE) \
+            -> ImageTable:
+        '''Loads images contained in database as columns of an `ImageTable`,
+           converting `chunk_size` rows at a time.
+        '''
+        with self._reader() as conn:
+            cursor = conn.execute(_GET_IMAGES)
+            return ImageTable.from_chunks(
+                iter(lambda: cursor.fetchmany(chunk_size), []))
+
+    def load_image_by_path(self, path: Path) -> Optional[ImageDescriptor]:
+        '''Load active image at `path` (relative to source),
+           `None` if not contained in database.
+        '''
+        with self._reader() as conn:
+            row = conn.execute(_GET_IMAGES_BY_PATH, (str(path),)).fetchone()
+            return self.descriptor_from_row(row) if row else None
+
+    def load_images_by_md5(self, md5: bytes) -> List[ImageDescriptor]:
+        '''Load all active images with md5 hash `md5`.'''
+        with self._reader() as conn:
+            return [self.descriptor_from_row(row)
+                    for row in conn.execute(_GET_IMAGES_BY_MD5, (md5,))]
+
+    def load_folder(self, folder: Path) -> Optional[FolderDescriptor]:
+        '''Load `folder` (relative to source, '.' for the source itself),
+           `None` if it contains no (active or inactive) images.
+        '''
+        with self._reader() as conn:
+            row = conn.execute(_GET_FOLDER, (_folder_key(folder),)) \
+                .fetchone()
+            return _folder_descriptor(row) if row else None
+
+    def load_subfolders(self, folder: Path) -> List[FolderDescriptor]:
+        '''Load folders directly contained in `folder`
+           (relative to source) ordered by name.
+        '''
+        with self._reader() as conn:
+            return [_folder_descriptor(row) for row in
+                    conn.execute(_GET_SUBFOLDERS, (_folder_key(folder),))]
+
+    def load_images_in_folder(self, folder: Path) -> List[ImageDescriptor]:
+        '''Load active images directly contained in `folder`
+           (relative to source) ordered by file name.
+        '''
+        with self._reader() as conn:
+            return [self.descriptor_from_row(row) for row in
+                    conn.execute(_GET_IMAGES_IN_FOLDER,
+                                 (_folder_key(folder),))]
+
+    def query_images(self, query: str, params: Iterable = ()) \
+            -> Iterable[ImageDescriptor]:
+        '''Run `query` with `params` selecting the columns of `IMAGE_COLUMNS`
+           from the images table, yields `ImageDescriptor` instances while
+           reading rows from the cursor.
+        '''
+        with self._reader() as conn:
+            for row in conn.execute(query, tuple(params)):
+                yield self.descriptor_from_row(row)
+
+    def search_images(self, text: str, limit: Optional[int] = None) \
+            -> Iterable[ImageDescriptor]:
+        '''Stream active images with paths (relative to source) containing
+           `text` (ignoring case of ASCII letters), at most `limit` images.
+           Uses the trigram index unless not available or `text` is too
+           short, otherwise all paths are compared.
+        '''
+        if self.path_search and len(text) >= _MIN_SEARCH_LENGTH:
+            query, pattern = _SEARCH_IMAGES, '"{}"'.format(
+                text.replace('"', '""'))
+        else:
+            query, pattern = _SEARCH_IMAGES_WITHOUT_INDEX, '%{}%'.format(
+                re.sub(r'([!%_])', r'!\1', text))
+        if limit is not None:
+            yield from self.query_images(query + ' LIMIT ?;',
+                                         (pattern, limit))
+        else:
+            yield from self.query_images(query + ';', (pattern,))
+
+    def load_inactive_image_ids(self) -> List[int]:
+        '''Load ids of all deactivated images.'''
+        with self._reader() as conn:
+            return [row[0] for row in conn.execute(_GET_INACTIVE_IMAGE_IDS)]
+
+    def load_image_paths(self) -> Iterable[Tuple[int, str]]:
+        '''Loads ids and paths (relative to source) of all active images.'''
+        with self._reader() as conn:
+            yield from conn.execute(_GET_IMAGE_PATHS)
+
+    def load_image_dhashes(self) -> Iterable[Tuple[int, bytes]]:
+        '''Loads ids and dhash perceptual image hashes of all active images.
+        '''
+        with self._reader() as conn:
+            yield from conn.execute(_GET_IMAGE_DHASHES)
+
+    def load_duplicate_md5s(self) -> Iterable[Tuple[int, bytes, str]]:
+        '''Loads ids, md5 hashes and paths (relative to source) of all
+           active images sharing their md5 hash with another active image,
+           ordered by md5 hash.
+        '''
+        with self._reader() as conn:
+            yield from conn.execute(_GET_DUPLICATE_MD5S)
+
+    def deactivate_images(self, image_ids: Iterable[int]) -> None:
+        '''Deactivate all images with the given `image_ids`
+           in one transaction.
+        '''
+        with self.db as conn:
+            conn.executemany(_DEACTIVATE_IMAGE,
+                             ((image_id,) for image_id in image_ids))
+
     def load_image(self, image_id: int) -> ImageDescriptor:
         '''Load image contained in database
            as `ImageDescriptor` instance.
         '''
-        with self.db as conn:
+        with self._reader() as conn:
             row = conn.execute(_GET_IMAGES_BY_ID, (image_id,)).fetchone()
             if not row:
                 raise Exception('Image {} does not exist!'.format(image_id))
@@ -340,27 +1443,316 @@ class KnipseDB:
     def load_list_entries(self, lst: ListDescriptor) \
             -> Iterable[Tuple[ListEntryDescriptor, ImageDescriptor]]:
         '''Loads images belonging to `lst` as `ImageDescriptor` instances.'''
-        with self.db as conn:
+        with self._reader() as conn:
             for row in conn.execute(_GET_IMAGES_IN_LIST, (lst.list_id,)):
                 lst_entry = ListEntryDescriptor(*row[7:])
                 yield lst_entry, self.descriptor_from_row(row[:7])
 
+    def load_list_end(self, list_id: int) -> Optional[float]:
+        '''Position of the last entry of list `list_id`
+           (`None` if the list is empty).
+        '''
+        with self._reader() as conn:
+            return conn.execute(_GET_LIST_END, (list_id,)).fetchone()[0]
+
     def load_all_list_descriptors(self) -> Iterable[ListDescriptor]:
         '''Loads lists contained in database as `ListDescriptor` instances'''
-        with self.db as conn:
+        with self._reader() as conn:
             for row in conn.execute(_GET_LISTS):
                 yield ListDescriptor(int(row[0]), row[1], Path(row[2]))
 
-    def get_recognizer(self) -> 'ImageRecognizer':
-        return ImageRecognizer(self.load_all_images())
+    def images_generation(self) -> int:
+        '''Counter of changes to the images table.'''
+        with self._reader() as conn:
+            return conn.execute(_GET_IMAGES_GENERATION).fetchone()[0]
 
+    def image_index(self) -> Optional[ImageIndex]:
+        '''Open the image index file next to the database,
+           (re)building it if it is missing or outdated. Returns `None`
+           if the index can neither be opened nor rebuilt (e.g. in a
+           read-only folder).
+        '''
+        assert self.index_path is not None, \
+            'in-memory databases have no image index'
+        with self.snapshot():
+            generation = self.images_generation()
+            if self._image_index is not None \
+                    and self._image_index.generation == generation:
+                return self._image_index
+            if self._image_index is not None:
+                self._image_index.close()
+                self._image_index = None
+            try:
+                index = ImageIndex(self.index_path)
+                if index.generation == generation:
+                    self._image_index = index
+                    return index
+                index.close()
+            except (OSError, ValueError, struct.error):
+                pass  # index is missing or corrupt and rebuilt below
+            try:
+                self._write_image_index(generation)
+                self._image_index = ImageIndex(self.index_path)
+            except (OSError, ValueError, struct.error):
+                logger.warning('Cannot build image index {}'
+                               .format(self.index_path), exc_info=True)
+            return self._image_index
+
+    def _write_image_index(self, generation: int) -> None:
+        '''Write the index file of all active images (in the current
+           snapshot) from sorted queries, without creating descriptors.
+        '''
+        assert self.index_path is not None
+        image_ids = []  # type: List[int]
 
-class ImageRecognizer:
+        def records() -> Iterator[tuple]:
+            for md5, dhash, image_id, path, created_at, modified_at \
+                    in conn.execute(_GET_INDEX_RECORDS):
+                image_ids.append(image_id)
+                yield (md5, dhash, image_id, path,
+                       micros_from_nanos(created_at),
+                       micros_from_nanos(modified_at))
+
+        def positions(query: str) -> Callable[[], Iterable[int]]:
+            def _positions() -> Iterable[int]:
+                ids = np.array(image_ids, dtype=np.int64)
+                order = np.argsort(ids)
+                sorted_ids = np.fromiter(
+                    (row[0] for row in conn.execute(query)), dtype=np.int64,
+                    count=len(ids))
+                return order[np.searchsorted(ids[order], sorted_ids)]
+            return _positions
+        with self._reader() as conn:
+            write_index_records(self.index_path, generation, records(),
+                                positions(_GET_IMAGE_IDS_BY_DHASH),
+                                positions(_GET_IMAGE_IDS_BY_PATH))
+
+    def get_recognizer(self, mapped: bool = True, lazy: bool = False,
+                       cache_size: int = DEFAULT_RECOGNIZER_CACHE_SIZE) \
+            -> 'BaseImageRecognizer':
+        '''Recognizer for the images currently stored in database.
+           If `lazy` is set, lookups are answered by database queries
+           with at most `cache_size` cached images per kind of lookup.
+           Otherwise, unless `mapped` is unset or the database is in-memory,
+           lookups are answered from the memory-mapped image index file,
+           which is only rebuilt if images changed (lazily from the
+           database if the index cannot be built). Otherwise all images
+           are loaded into a (modifiable) `ImageRecognizer`.
+        '''
+        if lazy:
+            return LazyImageRecognizer(self, self.load_folder_scans(),
+                                       cache_size)
+        if mapped and self.index_path is not None:
+            index = self.image_index()
+            if index is not None:
+                return MappedImageRecognizer(index, self.load_folder_scans())
+            return LazyImageRecognizer(self, self.load_folder_scans(),
+                                       cache_size)
+        return ImageRecognizer(self.load_all_images(),
+                               self.load_folder_scans())
+
+    def _load_known_images(self, query: str, key: Union[str, bytes],
+                           max_image_id: int) -> List[ImageDescriptor]:
+        with self._reader() as conn:
+            return [self.descriptor_from_row(row)
+                    for row in conn.execute(query, (key, max_image_id))]
+
+
+class BatchWriter:
+    '''Buffers writes to a `KnipseDB` and stores them with `executemany`,
+       using one transaction per `commit_interval` buffered rows. Pending
+       rows are written when leaving the context or calling `flush`.
+       If `on_insert` is given, it is called with each inserted image
+       (including its new `image_id`) after the transaction is committed.
+       Time spent writing is recorded in `stats`.
+    '''
+
+    def __init__(self, db: KnipseDB,
+                 commit_interval: int = DEFAULT_COMMIT_INTERVAL,
+                 on_insert: Optional[Callable[[ImageDescriptor], None]]
+                 = None,
+                 stats: ScanStats = NO_STATS) -> None:
+        assert commit_interval > 0, \
+            'Commit interval must be positive, got {}'.format(commit_interval)
+        self.db = db
+        self.commit_interval = commit_interval
+        self.on_insert = on_insert
+        self.stats = stats
+        self._inserted = []  # type: List[ImageDescriptor]
+        self._inserts = []  # type: List[tuple]
+        self._updates = []  # type: List[tuple]
+        self._hashes = []  # type: List[tuple]
+        self._thumbnails = {size: []
+                            for size in THUMBNAIL_SIZES}  # type: dict
+        self._folder_scans = []  # type: List[Tuple[Path, datetime, int]]
+        self._scan_session = None  # type: Optional[ScanSessionDescriptor]
+        self._checkpoints = 0
+
+    def __enter__(self) -> 'BatchWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # buffered rows are complete, hence we write them even on errors
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self._inserts) + len(self._updates) + len(self._hashes) \
+            + sum(len(rows) for rows in self._thumbnails.values()) \
+            + len(self._folder_scans) + self._checkpoints
+
+    def store_image(self, descriptor: ImageDescriptor) -> None:
+        '''Buffer `descriptor` for storage. If `descriptor` contains
+           an `image_id`, the corresponding row in the database is updated.
+        '''
+        data = _image_data(descriptor)
+        if descriptor.image_id is None:
+            self._inserts.append(data)
+            self._inserted.append(descriptor)
+        else:
+            self._updates.append((*data, descriptor.image_id))
+            self._hashes.extend(_image_hashes_data(descriptor.image_id,
+                                                   descriptor.hashes))
+        self._flush_if_full()
+
+    def store_hashes(self, image_id: int, hashes: Dict[str, bytes]) -> None:
+        '''Buffer additional perceptual `hashes` of image `image_id`,
+           see `KnipseDB.store_image_hashes`.
+        '''
+        self._hashes.extend(_image_hashes_data(image_id, hashes))
+        self._flush_if_full()
+
+    def store_thumbnail(self, descriptor: ImageDescriptor,
+                        thumbnail: Image.Image,
+                        size: Tuple[int, int]) -> None:
+        '''Buffer `thumbnail` of `size` of the image `descriptor`.'''
+        _, thumbnail_data = _thumbnail_bytes(thumbnail, size)
+        self._thumbnails[size].append((thumbnail_data, descriptor.image_id))
+        self._flush_if_full()
+
+    def store_folder_scans(self,
+                           folders: Iterable[Tuple[Path, datetime, int]]) \
+            -> None:
+        '''Buffer states of scanned `folders`,
+           see `KnipseDB.store_folder_scans`.
+        '''
+        self._folder_scans.extend(folders)
+        self._flush_if_full()
+
+    def store_scan_session(self, session: ScanSessionDescriptor) -> None:
+        '''Buffer `session` as checkpoint of a running scan, it is written
+           after all rows buffered before (earlier sessions are replaced).
+        '''
+        self._scan_session = session
+        self._checkpoints += 1
+        self._flush_if_full()
+
+    def _flush_if_full(self) -> None:
+        if len(self) >= self.commit_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        '''Write all buffered rows in one transaction.'''
+        if not len(self):
+            return
+        with self.stats.timer('commit'), self.db.db as conn:
+            self.db._store_folders(conn, self._inserts + self._updates)
+            if self.on_insert \
+                    or any(descr.hashes for descr in self._inserted):
+                # row ids are needed, hence insert rows individually
+                inserted = []  # type: List[ImageDescriptor]
+                for descr, data in zip(self._inserted, self._inserts):
+                    image_id = _inserted_id(conn.execute(_INSERT_IMAGE, data))
+                    inserted.append(descr.with_id(image_id))
+                    self._hashes.extend(_image_hashes_data(image_id,
+                                                           descr.hashes))
+                self._inserted = inserted
+            else:
+                conn.executemany(_INSERT_IMAGE, self._inserts)
+            conn.executemany(_UPDATE_IMAGE, self._updates)
+            conn.executemany(_STORE_IMAGE_HASH, self._hashes)
+            for size, rows in self._thumbnails.items():
+                size_col = 't{}x{}'.format(*size)
+                conn.executemany(_INSERT_EMPTY_THUMBNAIL,
+                                 ((image_id,) for _, image_id in rows))
+                conn.executemany(_UPDATE_THUMBNAIL.format(size_col), rows)
+            conn.executemany(_STORE_FOLDER_SCAN,
+                             _folder_scan_data(self._folder_scans))
+            if self._scan_session is not None:
+                conn.execute(_STORE_SCAN_SESSION,
+                             _scan_session_data(self._scan_session))
+        self._folder_scans.clear()
+        self._scan_session = None
+        self._checkpoints = 0
+        self._inserts.clear()
+        self._updates.clear()
+        self._hashes.clear()
+        for rows in self._thumbnails.values():
+            rows.clear()
+        inserted, self._inserted = self._inserted, []
+        if self.on_insert:
+            for descr in inserted:
+                self.on_insert(descr)
+
+
+class BaseImageRecognizer:
+    '''(Abstract) Base class for recognizers of images stored in the
+       database, which also know the folders seen by previous scans.
+    '''
+
+    def __init__(self,
+                 known_folders: Iterable[Tuple[Path, datetime, int]] = ()) \
+            -> None:
+        # modification time and number of entries of scanned folders
+        self.known_folders = {str(path): (modified_at, entries)
+                              for path, modified_at, entries
+                              in known_folders}
+
+    def add(self, descr: ImageDescriptor) -> None:
+        '''Add (or update) `descr` in the lookups.'''
+        raise NotImplementedError('add')
+
+    def remove(self, descr: ImageDescriptor) -> None:
+        '''Remove `descr` from the lookups.'''
+        raise NotImplementedError('remove')
+
+    def filter(self, source: Path, path: Path, mtime: datetime) -> bool:
+        '''Filter images by path and modification date.
+           Returns `True` if the image is new or modified,
+           `False` if the image is already known.
+        '''
+        raise NotImplementedError('filter')
+
+    def filter_folder(self, source: Path, folder: Path,
+                      mtime: datetime, entries: int) -> bool:
+        '''Filter folders by path, modification date and number of entries.
+           Returns `True` if the folder is new or modified,
+           `False` if its entries are unchanged since the last scan.
+        '''
+        rel_path = str(folder.relative_to(source))
+        return self.known_folders.get(rel_path) != (mtime, entries)
+
+    def by_path(self, source: Path, path: Path) -> Optional[ImageDescriptor]:
+        '''Lookup images by path.'''
+        raise NotImplementedError('by_path')
+
+    def by_md5(self, md5: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup images by md5 hash.'''
+        raise NotImplementedError('by_md5')
+
+    def by_dhash(self, dhash: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup images by dhash perceptual image hash.'''
+        raise NotImplementedError('by_dhash')
+
+
+class ImageRecognizer(BaseImageRecognizer):
     '''State of the database at a the moment of creation,
        contains indexes to recognize images by ther hashes, etc.
     '''
 
-    def __init__(self, known_images: Iterable[ImageDescriptor]) -> None:
+    def __init__(self, known_images: Iterable[ImageDescriptor],
+                 known_folders: Iterable[Tuple[Path, datetime, int]] = ()) \
+            -> None:
+        super().__init__(known_folders)
         known_images = list(known_images)
         # path (relative to source) are unique,
         # we can rely on the file system for that
@@ -382,6 +1774,25 @@ class ImageRecognizer:
                             for descr in known_images
                             if descr.dhash not in duplicate_hashes}
 
+    def add(self, descr: ImageDescriptor) -> None:
+        '''Add (or update) `descr` in the path and md5 indexes,
+           a moved image is removed from its previous path.
+           The dhash index is not updated.
+        '''
+        previous = self.index_md5.get(descr.md5)
+        if previous is not None and previous.image_id == descr.image_id \
+                and self.known_files.get(str(previous.path)) is previous:
+            del self.known_files[str(previous.path)]
+        self.known_files[str(descr.path)] = descr
+        self.index_md5[descr.md5] = descr
+
+    def remove(self, descr: ImageDescriptor) -> None:
+        '''Remove `descr` from the path and md5 indexes.'''
+        if self.known_files.get(str(descr.path)) is descr:
+            del self.known_files[str(descr.path)]
+        if self.index_md5.get(descr.md5) is descr:
+            del self.index_md5[descr.md5]
+
     def filter(self, source: Path, path: Path, mtime: datetime) -> bool:
         '''Filter images by path and modification date.
            Returns `True` if the image is new or modified,
@@ -403,3 +1814,153 @@ class ImageRecognizer:
     def by_dhash(self, dhash: bytes) -> Optional[ImageDescriptor]:
         '''Lookup images by dhash perceptual image hash.'''
         return self.index_dhash.get(dhash)
+
+
+class LazyImageRecognizer(BaseImageRecognizer):
+    '''Variant of `ImageRecognizer` answering lookups with indexed
+       queries instead of loading all images. Images of a folder are
+       loaded at once by its first lookup, as files are looked up
+       folder by folder when walking images. Folders, md5 and dhash
+       lookups are cached in least recently used order, at most
+       `cache_size` images each. Images stored after creation of the
+       recognizer are not recognized (like by `ImageRecognizer`).
+    '''
+
+    def __init__(self, db: KnipseDB,
+                 known_folders: Iterable[Tuple[Path, datetime, int]] = (),
+                 cache_size: int = DEFAULT_RECOGNIZER_CACHE_SIZE) -> None:
+        super().__init__(known_folders)
+        self.db = db
+        with db._reader() as conn:
+            self.max_image_id = conn.execute(_GET_MAX_IMAGE_ID).fetchone()[0]
+        self.cache_size = cache_size
+        # images by path (relative to source) by folder
+        self._folders = OrderedDict()  # type: OrderedDict
+        self._n_cached_files = 0
+        # images (or `None` if not found) by md5 and dhash
+        self._md5s = OrderedDict()  # type: OrderedDict
+        self._dhashes = OrderedDict()  # type: OrderedDict
+
+    def _folder(self, rel_path: str) -> Dict[str, ImageDescriptor]:
+        '''Known images in the folder of `rel_path` by path.'''
+        folder = _folder_of(rel_path)
+        files = self._folders.get(folder)
+        if files is not None:
+            self._folders.move_to_end(folder)
+            return files
+        files = {str(descr.path): descr
+                 for descr in self.db._load_known_images(
+                     _GET_KNOWN_IMAGES_IN_FOLDER, folder, self.max_image_id)}
+        self._folders[folder] = files
+        self._n_cached_files += len(files)
+        # evict least recently used folders, but keep the current one
+        while self._n_cached_files > self.cache_size \
+                and len(self._folders) > 1:
+            _, evicted = self._folders.popitem(last=False)
+            self._n_cached_files -= len(evicted)
+        return files
+
+    def _cache(self, cache: OrderedDict, key: bytes,
+               descr: Optional[ImageDescriptor]) -> None:
+        cache[key] = descr
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _lookup(self, cache: OrderedDict, query: str, key: bytes) \
+            -> Optional[ImageDescriptor]:
+        '''Cached image found by `query` for `key`,
+           `None` if not found or not unique.
+        '''
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        found = self.db._load_known_images(query, key, self.max_image_id)
+        descr = found[0] if len(found) == 1 else None
+        self._cache(cache, key, descr)
+        return descr
+
+    def add(self, descr: ImageDescriptor) -> None:
+        '''Add (or update) `descr` in the cached path and md5 lookups,
+           a moved image is removed from its previous path.
+           The dhash lookups are not updated.
+        '''
+        previous = self.by_md5(descr.md5)
+        if previous is not None and previous.image_id == descr.image_id:
+            # path and md5 lookups load distinct descriptors of an image
+            files = self._folder(str(previous.path))
+            known = files.get(str(previous.path))
+            if known is not None and known.image_id == descr.image_id:
+                del files[str(previous.path)]
+                self._n_cached_files -= 1
+        files = self._folder(str(descr.path))
+        if str(descr.path) not in files:
+            self._n_cached_files += 1
+        files[str(descr.path)] = descr
+        self._cache(self._md5s, descr.md5, descr)
+
+    def remove(self, descr: ImageDescriptor) -> None:
+        '''Remove `descr` from the cached path and md5 lookups.'''
+        files = self._folder(str(descr.path))
+        known = files.get(str(descr.path))
+        if known is not None and known.image_id == descr.image_id:
+            del files[str(descr.path)]
+            self._n_cached_files -= 1
+        known = self._md5s.get(descr.md5)
+        if known is not None and known.image_id == descr.image_id:
+            self._cache(self._md5s, descr.md5, None)
+
+    def filter(self, source: Path, path: Path, mtime: datetime) -> bool:
+        '''Filter images by path and modification date.
+           Returns `True` if the image is new or modified,
+           `False` if the image is already known.
+        '''
+        descr = self.by_path(source, path)
+        return descr is None or descr.modified_at != mtime
+
+    def by_path(self, source: Path, path: Path) -> Optional[ImageDescriptor]:
+        '''Lookup images by path.'''
+        rel_path = str(path.relative_to(source))
+        return self._folder(rel_path).get(rel_path)
+
+    def by_md5(self, md5: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup images by md5 hash.'''
+        return self._lookup(self._md5s, _GET_KNOWN_IMAGES_BY_MD5, md5)
+
+    def by_dhash(self, dhash: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup images by dhash perceptual image hash,
+           `None` if not found or not unique.
+        '''
+        return self._lookup(self._dhashes, _GET_KNOWN_IMAGES_BY_DHASH, dhash)
+
+
+class MappedImageRecognizer(BaseImageRecognizer):
+    '''Read-only variant of `ImageRecognizer` answering lookups
+       from an `ImageIndex` instead of in-memory dicts.
+    '''
+
+    def __init__(self, index: ImageIndex,
+                 known_folders: Iterable[Tuple[Path, datetime, int]] = ()) \
+            -> None:
+        super().__init__(known_folders)
+        self.index = index
+
+    def filter(self, source: Path, path: Path, mtime: datetime) -> bool:
+        '''Filter images by path and modification date.
+           Returns `True` if the image is new or modified,
+           `False` if the image is already known.
+        '''
+        return self.index.modification_time(str(path.relative_to(source))) \
+            != mtime
+
+    def by_path(self, source: Path, path: Path) -> Optional[ImageDescriptor]:
+        '''Lookup images by path.'''
+        return self.index.by_path(str(path.relative_to(source)))
+
+    def by_md5(self, md5: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup images by md5 hash.'''
+        return self.index.by_md5(md5)
+
+    def by_dhash(self, dhash: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup images by dhash perceptual image hash.'''
+        return self.index.by_dhash(dhash)
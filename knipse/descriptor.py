@@ -2,12 +2,14 @@
 
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, Iterable, Tuple
+from typing import Optional, Iterable, Tuple, List, Dict
 
 
 class BaseDescriptor:
     '''(Abstract) Base class for descriptors.'''
 
+    __slots__ = ()
+
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return False
@@ -33,8 +35,13 @@ class ImageDescriptor(BaseDescriptor):
     '''Container for image metadata like path or modification date.
        In-memory representation of individual rows of the main
        database table.
+       Additional perceptual `hashes` (by algorithm name) are stored
+       in a separate table, they are not loaded with the image.
     '''
 
+    __slots__ = ('image_id', 'path', 'created_at', 'modified_at', 'md5',
+                 'dhash', 'active', 'hashes')
+
     def __init__(self,
                  image_id: Optional[int],
                  path: Path,
@@ -42,7 +49,8 @@ class ImageDescriptor(BaseDescriptor):
                  modified_at: datetime,
                  md5: bytes,
                  dhash: bytes,
-                 active: bool) -> None:
+                 active: bool,
+                 hashes: Optional[Dict[str, bytes]] = None) -> None:
         self.image_id = image_id
         self.path = Path(path)
         self.created_at = created_at
@@ -50,6 +58,7 @@ class ImageDescriptor(BaseDescriptor):
         self.md5 = md5
         self.dhash = dhash
         self.active = active
+        self.hashes = hashes or {}
 
     def with_id(self, image_id: int) -> 'ImageDescriptor':
         '''Create a copy of this descriptor with the given `image_id`.'''
@@ -59,7 +68,8 @@ class ImageDescriptor(BaseDescriptor):
                                self.modified_at,
                                self.md5,
                                self.dhash,
-                               self.active)
+                               self.active,
+                               self.hashes)
 
     def _fields_iter(self):
         yield 'image_id', self.image_id
@@ -71,12 +81,39 @@ class ImageDescriptor(BaseDescriptor):
         yield 'active', self.active
 
 
+class FolderDescriptor(BaseDescriptor):
+    '''Container for folder metadata like the number of active images
+       directly contained. In-memory representation of individual rows
+       of the folders database table.
+    '''
+
+    __slots__ = ('folder_id', 'parent_id', 'path', 'image_count')
+
+    def __init__(self,
+                 folder_id: int,
+                 parent_id: Optional[int],
+                 path: Path,
+                 image_count: int) -> None:
+        self.folder_id = folder_id
+        self.parent_id = parent_id
+        self.path = Path(path)
+        self.image_count = image_count
+
+    def _fields_iter(self):
+        yield 'folder_id', self.folder_id
+        yield 'parent_id', self.parent_id
+        yield 'path', self.path
+        yield 'image_count', self.image_count
+
+
 class ListDescriptor(BaseDescriptor):
     '''Container for list metadata like name and virtual folder.
        In-memory representation of individual rows of the list
        database table.
     '''
 
+    __slots__ = ('list_id', 'name', 'virtual_folder')
+
     def __init__(self,
                  list_id: Optional[int],
                  name: str,
@@ -102,6 +139,8 @@ class ListEntryDescriptor(BaseDescriptor):
        individual rows of the list entry database table.
     '''
 
+    __slots__ = ('list_entry_id', 'list_id', 'image_id', 'position')
+
     def __init__(self,
                  list_entry_id: Optional[int],
                  list_id: int,
@@ -124,3 +163,36 @@ class ListEntryDescriptor(BaseDescriptor):
         yield 'list_id', self.list_id
         yield 'image_id', self.image_id
         yield 'position', self.position
+
+
+class ScanSessionDescriptor(BaseDescriptor):
+    '''Container for the state of a (possibly interrupted) scan, i.e. the
+       folders below `source` remaining to be walked (as stack of levels of
+       folders with their progress range) and counters of walked files and
+       stored images. In-memory representation of individual rows of the
+       scan session database table.
+    '''
+
+    __slots__ = ('source', 'folder_tree', 'walked', 'stored')
+
+    def __init__(self,
+                 source: Path,
+                 folder_tree: List[List[Tuple[Path, float, float]]],
+                 walked: int,
+                 stored: int) -> None:
+        self.source = Path(source)
+        self.folder_tree = folder_tree
+        self.walked = walked
+        self.stored = stored
+
+    @property
+    def progress(self) -> float:
+        '''Progress of the scan at this state (between 0 and 1).'''
+        return min((lower for level in self.folder_tree
+                    for _, lower, _ in level), default=1.0)
+
+    def _fields_iter(self):
+        yield 'source', self.source
+        yield 'folder_tree', self.folder_tree
+        yield 'walked', self.walked
+        yield 'stored', self.stored
@@ -1,33 +1,68 @@
 # -*- coding: utf-8 -*-
 
+from typing import Iterable, List
+
 import click
+import numpy as np
 from PIL import Image
 
 
-def dhash(img: Image) -> int:
+def dhash_thumbnail(img: Image.Image) -> np.ndarray:
+    '''Grayscale 9x9 thumbnail of `img` as array indexed by [y, x],
+       the input of the difference hash.
+    '''
+    thumbnail = img.convert('L').resize((9, 9), Image.BILINEAR)
+    return np.asarray(thumbnail, dtype=np.uint8)
+
+
+def dhash_array(thumbnails: np.ndarray) -> np.ndarray:
+    '''Compute difference hashes of stacked 9x9 thumbnails
+       (shape n x 9 x 9, indexed by [i, y, x]), returns array
+       of shape n x 16 holding the hashes as little-endian bytes.
+    '''
+    thumbnails = np.asarray(thumbnails)
+    top_left = thumbnails[:, :8, :8]
+    # bits are ordered by x, then y, starting with the most significant one
+    row_diffs = (thumbnails[:, :8, 1:] >= top_left).transpose(0, 2, 1)
+    col_diffs = (thumbnails[:, 1:, :8] >= top_left).transpose(0, 2, 1)
+    bits = np.concatenate([row_diffs.reshape(-1, 64),
+                           col_diffs.reshape(-1, 64)], axis=1)
+    return np.packbits(bits, axis=1)[:, ::-1]
+
+
+def dhash_many(images: Iterable[Image.Image]) -> List[bytes]:
+    '''Compute the perceptual difference hashes (dhash, 128 bit)
+       of all `images` in one batch.
+    '''
+    thumbnails = [dhash_thumbnail(img) for img in images]
+    if not thumbnails:
+        return []
+    return [hsh.tobytes() for hsh in dhash_array(np.stack(thumbnails))]
+
+
+def dhash_bytes(img: Image.Image) -> bytes:
     '''Compute the perceptual difference hash (dhash) of the given image
        with row and column differences (128 bit) as described by
        http://www.hackerfactor.com/blog/?/archives/529-Kind-of-Like-That.html
     '''
-    thumbnail = img.convert('L').resize((9, 9), Image.BILINEAR)
-    pixels = thumbnail.load()
-    row_diffs = []
-    col_diffs = []
-    for row in range(8):
-        for col in range(8):
-            row_diffs.append(pixels[row + 1, col] >= pixels[row, col])
-            col_diffs.append(pixels[row, col + 1] >= pixels[row, col])
-    bits = ''.join(['1' if bit else '0' for bit in row_diffs + col_diffs])
-    return int(bits, 2)
-
-
-def dhash_bytes(img: Image) -> bytes:
+    return dhash_array(dhash_thumbnail(img)[np.newaxis])[0].tobytes()
+
+
+def dhash(img: Image.Image) -> int:
     '''Compute the perceptual difference hash (dhash) of the given image
        with row and column differences (128 bit) as described by
        http://www.hackerfactor.com/blog/?/archives/529-Kind-of-Like-That.html
     '''
-    hash_int = dhash(img)
-    return hash_int.to_bytes(16, 'little')
+    return int.from_bytes(dhash_bytes(img), 'little')
+
+
+def hamming_distance(hash1: bytes, hash2: bytes) -> int:
+    '''Number of differing bits of two hashes of equal length.'''
+    assert len(hash1) == len(hash2), \
+        'hashes must be of equal length, got {} and {}' \
+        .format(len(hash1), len(hash2))
+    diff = int.from_bytes(hash1, 'little') ^ int.from_bytes(hash2, 'little')
+    return bin(diff).count('1')
 
 
 @click.command(name='dhash')
@@ -36,6 +71,6 @@ def dhash_bytes(img: Image) -> bytes:
                                 resolve_path=True), nargs=-1)
 def cli_dhash(file):
     '''Compute the perceptual difference hash of the given file'''
-    for f in file:
-        img = Image.open(f)
-        click.echo('{}\t{}'.format(f, dhash_bytes(img).hex()))
+    hashes = dhash_many(Image.open(f) for f in file)
+    for f, hsh in zip(file, hashes):
+        click.echo('{}\t{}'.format(f, hsh.hex()))
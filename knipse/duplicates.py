@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+'''Grouping of duplicate and near-duplicate images'''
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple, Optional  # noqa: 401
+
+import click
+import numpy as np
+
+from .db import KnipseDB
+from .similar import POPCOUNT, HASH_BYTES, hashes_array
+
+
+_HASH_BITS = 8 * HASH_BYTES
+# rows processed at once when computing band keys
+_KEY_BLOCK_SIZE = 65536
+# buckets of candidates up to this size are processed together
+_SMALL_BUCKET_SIZE = 16
+# maximum number of hash pairs compared at once
+_PAIR_BLOCK_SIZE = 1 << 20
+
+# hashes of all images, shared with worker processes
+_hashes = None  # type: Optional[np.ndarray]
+
+
+def _init_worker(hashes: np.ndarray) -> None:
+    global _hashes
+    _hashes = hashes
+
+
+def band_limits(n_bands: int) -> List[Tuple[int, int]]:
+    '''Split the bits of a hash into `n_bands` bands of (almost) equal
+       width, returns first and last (exclusive) bit of each band.
+    '''
+    assert 1 <= n_bands <= _HASH_BITS, \
+        'number of bands must be between 1 and {}'.format(_HASH_BITS)
+    limits = [i * _HASH_BITS // n_bands for i in range(n_bands + 1)]
+    return list(zip(limits[:-1], limits[1:]))
+
+
+def _band_keys(hashes: np.ndarray, start: int, end: int) -> np.ndarray:
+    '''Integer value of bits `start` to `end` (exclusive) of all hashes.'''
+    assert end - start <= 64, 'bands must not be wider than 64 bits'
+    first_byte, last_byte = start // 8, (end + 7) // 8
+    keys = np.empty(len(hashes), dtype=np.uint64)
+    for i in range(0, len(hashes), _KEY_BLOCK_SIZE):
+        bits = np.unpackbits(hashes[i:i + _KEY_BLOCK_SIZE,
+                                    first_byte:last_byte], axis=1)
+        bits = bits[:, start - 8 * first_byte:end - 8 * first_byte]
+        padded = np.zeros((len(bits), 64), dtype=np.uint8)
+        padded[:, 64 - bits.shape[1]:] = bits
+        keys[i:i + _KEY_BLOCK_SIZE] = \
+            np.packbits(padded, axis=1).view('>u8').ravel()
+    return keys
+
+
+class _UnionFind:
+    '''Disjoint sets of integers 0 to n - 1, merged in bulk.'''
+
+    def __init__(self, n: int) -> None:
+        # parents are never larger than their children
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def _find(self, items: np.ndarray) -> np.ndarray:
+        roots = self.parent[items]
+        while True:
+            parents = self.parent[roots]
+            if np.array_equal(parents, roots):
+                return roots
+            roots = parents
+
+    def union(self, firsts: np.ndarray, seconds: np.ndarray) -> None:
+        '''Merge the sets of `firsts[i]` and `seconds[i]` for all i.'''
+        while len(firsts):
+            roots1, roots2 = self._find(firsts), self._find(seconds)
+            differ = roots1 != roots2
+            firsts, seconds = firsts[differ], seconds[differ]
+            roots1, roots2 = roots1[differ], roots2[differ]
+            np.minimum.at(self.parent, np.maximum(roots1, roots2),
+                          np.minimum(roots1, roots2))
+
+    def roots(self) -> np.ndarray:
+        '''Root of the set of each integer.'''
+        return self._find(np.arange(len(self.parent)))
+
+
+def _bucket_links(members: np.ndarray, max_distance: int) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    '''Compare all pairs of hashes of `members` (indexes into `_hashes`)
+       in blocks and return links of a spanning forest of the groups
+       of hashes within `max_distance`, i.e. at most one link per member.
+    '''
+    assert _hashes is not None, 'Worker is not initialized'
+    member_hashes = _hashes[members]
+    groups = _UnionFind(len(members))
+    rows = max(1, _PAIR_BLOCK_SIZE // len(members))
+    for i in range(0, len(members) - 1, rows):
+        block = member_hashes[i:i + rows]
+        distances = POPCOUNT[np.bitwise_xor(block[:, np.newaxis, :],
+                                            member_hashes[np.newaxis, :, :])] \
+            .sum(axis=2, dtype=np.int32)
+        firsts, seconds = np.nonzero(distances <= max_distance)
+        firsts += i
+        upper = firsts < seconds  # each pair once, no pairs with itself
+        groups.union(firsts[upper], seconds[upper])
+    roots = groups.roots()
+    linked = np.flatnonzero(roots != np.arange(len(members)))
+    return members[linked], members[roots[linked]]
+
+
+def _band_links(start: int, end: int, max_distance: int) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    '''Find all pairs of hashes that are equal in band `start` to `end`
+       (candidates), verify them to be within `max_distance` and
+       return links of a spanning forest of the resulting groups.
+    '''
+    assert _hashes is not None, 'Worker is not initialized'
+    keys = _band_keys(_hashes, start, end)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    # buckets are runs of equal keys, candidates are pairs within buckets
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(keys)]])
+    sizes = ends - starts
+    groups = _UnionFind(len(keys))
+    # pairs in small buckets are compared for all buckets at once,
+    # position i is paired with position i + offset of the same bucket
+    bucket_ends = np.repeat(np.where(sizes <= _SMALL_BUCKET_SIZE, ends, 0),
+                            sizes)
+    positions = np.arange(len(keys))
+    for offset in range(1, _SMALL_BUCKET_SIZE):
+        firsts = positions[positions + offset < bucket_ends]
+        if not len(firsts):
+            break
+        firsts, seconds = order[firsts], order[firsts + offset]
+        distances = POPCOUNT[np.bitwise_xor(_hashes[firsts],
+                                            _hashes[seconds])] \
+            .sum(axis=1, dtype=np.int32)
+        close = distances <= max_distance
+        groups.union(firsts[close], seconds[close])
+    large = sizes > _SMALL_BUCKET_SIZE
+    for lo, hi in zip(starts[large], ends[large]):
+        groups.union(*_bucket_links(order[lo:hi], max_distance))
+    roots = groups.roots()
+    linked = np.flatnonzero(roots != positions)
+    return linked, roots[linked]
+
+
+def near_duplicate_groups(image_ids: Iterable[int], dhashes: Iterable[bytes],
+                          max_distance: int, jobs: int = 1,
+                          n_bands: Optional[int] = None) \
+        -> Iterable[List[int]]:
+    '''Group images with dhashes within Hamming distance `max_distance`
+       (transitively) using locality sensitive hashing: hashes are split
+       into bands, images sharing all bits of one band are candidates,
+       candidates within `max_distance` are merged into groups.
+       With the default of `max_distance + 1` bands, any pair of images
+       within `max_distance` shares one band (pigeonhole principle),
+       fewer bands are faster but may miss pairs.
+       Bands are processed by `jobs` processes in parallel.
+       Yields groups of at least two image ids, ordered by smallest id.
+    '''
+    image_ids = np.fromiter(image_ids, dtype=np.int64)
+    hashes = hashes_array(dhashes)
+    assert hashes.shape == (len(image_ids), HASH_BYTES), \
+        'dhashes must be of {} bytes each'.format(HASH_BYTES)
+    if n_bands is None:
+        n_bands = max(max_distance + 1, 2)
+    bands = band_limits(n_bands)
+    groups = _UnionFind(len(image_ids))
+    if jobs <= 1:
+        _init_worker(hashes)
+        for start, end in bands:
+            groups.union(*_band_links(start, end, max_distance))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(hashes,)) as executor:
+            futures = [executor.submit(_band_links, start, end, max_distance)
+                       for start, end in bands]
+            for future in futures:
+                groups.union(*future.result())
+    roots = groups.roots()
+    order = np.lexsort((image_ids, roots))
+    roots = roots[order]
+    bounds = np.flatnonzero(np.diff(roots)) + 1
+    members = [group for group in np.split(order, bounds) if len(group) > 1]
+    members.sort(key=lambda group: image_ids[group].min())
+    for group in members:
+        yield sorted(image_ids[group].tolist())
+
+
+def exact_duplicate_groups(db: KnipseDB) \
+        -> Iterable[List[Tuple[int, str]]]:
+    '''Group active images by md5 hash, yields groups of at least
+       two images as image id and path (relative to source).
+    '''
+    group = []  # type: List[Tuple[int, str]]
+    group_md5 = None
+    for image_id, md5, path in db.load_duplicate_md5s():
+        if md5 != group_md5 and group:
+            yield group
+            group = []
+        group_md5 = md5
+        group.append((image_id, path))
+    if group:
+        yield group
+
+
+@click.command(name='duplicates')
+@click.option('-n', '--near/--exact', default=False, show_default=True,
+              help='Groups images with similar perceptual hashes '
+                   'instead of equal md5 hashes.')
+@click.option('-k', '--max-distance', type=click.IntRange(0, 63),
+              default=4, show_default=True,
+              help='Maximum number of differing bits of the dhash '
+                   'for near duplicates.')
+@click.option('-b', '--bands', type=click.IntRange(2, 64), default=None,
+              help='Number of bands of the dhash compared for near '
+                   'duplicates, fewer bands are faster but may miss '
+                   'near duplicates (default: max-distance + 1).')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help='Number of processes searching near duplicates.')
+@click.option('--format', 'output_format', type=click.Choice(['tsv', 'json']),
+              default='tsv', show_default=True,
+              help='Writes group number and path per line (tsv) '
+                   'or one JSON object per group and line (json).')
+@click.pass_context
+def cli_duplicates(ctx, near, max_distance, bands, jobs, output_format):
+    '''Find groups of duplicate images in database'''
+    db = ctx.obj['database']
+    if near:
+        with db.snapshot():
+            table = db.load_image_table()
+        paths = dict(zip(table.image_ids.tolist(), table.paths()))
+        groups = ([(image_id, paths[image_id]) for image_id in group]
+                  for group in near_duplicate_groups(
+                      table.image_ids, table.dhash, max_distance, jobs,
+                      bands))
+    else:
+        groups = exact_duplicate_groups(db)
+    for group_number, group in enumerate(groups, start=1):
+        if output_format == 'json':
+            click.echo(json.dumps({'group': group_number,
+                                   'images': [{'id': image_id,
+                                               'path': path}
+                                              for image_id, path in group]}))
+        else:
+            for _, path in group:
+                click.echo('{}\t{}'.format(group_number, path))
@@ -2,7 +2,7 @@
 
 '''GUI experiments with kivy'''
 
-from typing import Iterable
+from typing import Optional
 from pathlib import Path
 
 import kivy
@@ -14,7 +14,6 @@ from kivy.uix.treeview import TreeView, TreeViewLabel
 from kivy.properties import ObjectProperty, StringProperty
 
 from ..db import KnipseDB
-from ..image import ImageDescriptor
 
 
 kivy.require('1.11.0')
@@ -30,9 +29,8 @@ class ImageList(BoxLayout):
     def _populate(self):
         self.clear_widgets()
         folder = Path(self.selected_path)
-        for descr in self.db.load_all_images():
-            if descr.path.parent == folder:
-                self.add_widget(Label(text=str(descr.path)))
+        for descr in self.db.load_images_in_folder(folder):
+            self.add_widget(Label(text=str(descr.path)))
 
     def on_selected_path(self, *args):
         self._populate()
@@ -43,6 +41,8 @@ class SelectableTreeViewLabel(TreeViewLabel):
         super().__init__(*args, **kwargs)
         self.register_event_type('on_path_changed')
         self.path = path
+        # subfolders are added when expanding the node
+        self.subfolders_loaded = False
 
     def on_touch_down(self, *args):
         self.dispatch('on_path_changed', self.path)
@@ -60,23 +60,32 @@ class FolderTreeWidget(FloatLayout):
         super().__init__(**kwargs)
 
     def on_db(self, *args):
-        self._populate(self.root_label, self.db.load_all_images())
+        self._populate(self.root_label)
 
     def on_nodes_path_changed(self, node, path):
         self.selected_path = str(path)
 
-    def _populate(self,
-                  root_label: str,
-                  images: Iterable[ImageDescriptor]):
+    def on_node_expand(self, tree, node):
+        if not node.subfolders_loaded:
+            self._add_subfolders(tree, node)
+
+    def _add_subfolders(self, tree: TreeView,
+                        parent: Optional[SelectableTreeViewLabel]):
+        folder = parent.path if parent is not None else Path('.')
+        for subfolder in self.db.load_subfolders(folder):
+            node = SelectableTreeViewLabel(path=subfolder.path,
+                                           text=subfolder.path.name,
+                                           is_leaf=False)
+            node.bind(on_path_changed=self.on_nodes_path_changed)
+            tree.add_node(node, parent)
+        if parent is not None:
+            parent.subfolders_loaded = True
+            parent.is_leaf = not parent.nodes
+
+    def _populate(self, root_label: str):
         tree = TreeView(root_options=dict(text=root_label))
-        nodes = {Path('.'): None}
-        for img in images:
-            for parent in reversed(img.path.parents):
-                if parent not in nodes:
-                    node = SelectableTreeViewLabel(path=parent,
-                                                   text=parent.name)
-                    node.bind(on_path_changed=self.on_nodes_path_changed)
-                    nodes[parent] = tree.add_node(node, nodes[parent.parent])
+        tree.bind(on_node_expand=self.on_node_expand)
+        self._add_subfolders(tree, None)
         self.add_widget(tree)
 
 
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+'''Pluggable perceptual image hashes computed from a shared
+   downscaled grayscale buffer, complementing the dhash
+'''
+
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable  # noqa: 401
+
+import numpy as np
+from PIL import Image
+
+
+# side length of the grayscale buffer shared by all hash algorithms
+BUFFER_SIZE = 32
+# hashes consist of HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+
+HashFunction = Callable[[np.ndarray], bytes]
+
+# hash algorithms by name, see `register_hash`
+HASH_ALGORITHMS = OrderedDict()  # type: Dict[str, HashFunction]
+
+
+def register_hash(name: str) -> Callable[[HashFunction], HashFunction]:
+    '''Decorator registering a hash function under `name`. Hash functions
+       receive the grayscale buffer (see `grayscale_buffer`) and return
+       the hash as bytes.
+    '''
+    def _register(function: HashFunction) -> HashFunction:
+        HASH_ALGORITHMS[name] = function
+        return function
+    return _register
+
+
+def grayscale_buffer(img: Image.Image) -> np.ndarray:
+    '''Grayscale version of `img` downscaled to
+       `BUFFER_SIZE` x `BUFFER_SIZE` pixels as float array.
+    '''
+    small = img.convert('L').resize((BUFFER_SIZE, BUFFER_SIZE),
+                                    Image.BILINEAR)  # type: ignore
+    return np.asarray(small, dtype=np.float32)
+
+
+def _bits_to_bytes(bits: np.ndarray) -> bytes:
+    return np.packbits(bits.ravel()).tobytes()
+
+
+def _block_means(buffer: np.ndarray, size: int) -> np.ndarray:
+    '''Means of `size` x `size` equal blocks of `buffer`.'''
+    block = buffer.shape[0] // size
+    return buffer.reshape(size, block, size, block).mean(axis=(1, 3))
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    '''Orthonormal DCT-II matrix of size `n`.'''
+    k = np.arange(n)[:, np.newaxis]
+    i = np.arange(n)[np.newaxis, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(BUFFER_SIZE)
+
+
+@register_hash('ahash')
+def ahash(buffer: np.ndarray) -> bytes:
+    '''Average hash: blocks brighter than the mean.'''
+    means = _block_means(buffer, HASH_SIZE)
+    return _bits_to_bytes(means > means.mean())
+
+
+@register_hash('phash')
+def phash(buffer: np.ndarray) -> bytes:
+    '''Perceptual hash: low frequencies of the discrete cosine transform
+       larger than their median (excluding the constant component).
+    '''
+    low = (_DCT @ buffer @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_bytes(low > np.median(low.ravel()[1:]))
+
+
+@register_hash('whash')
+def whash(buffer: np.ndarray) -> bytes:
+    '''Wavelet hash: Haar approximation coefficients (without the
+       constant component) larger than their median.
+    '''
+    approximation = _block_means(buffer - buffer.mean(), HASH_SIZE)
+    return _bits_to_bytes(approximation > np.median(approximation))
+
+
+def compute_hashes(img: Image.Image, algorithms: Iterable[str]) \
+        -> Dict[str, bytes]:
+    '''Compute hashes of `img` with all `algorithms` (names of
+       registered hash functions) from one shared grayscale buffer.
+    '''
+    algorithms = list(algorithms)
+    if not algorithms:
+        return {}
+    buffer = grayscale_buffer(img)
+    return {name: HASH_ALGORITHMS[name](buffer) for name in algorithms}
@@ -3,19 +3,30 @@
 from pathlib import Path
 from datetime import datetime
 import hashlib
+import io
 import logging
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Iterable, Dict  # noqa: 401
 
 from PIL import Image
 
 from .descriptor import ImageDescriptor
 from .dhash import dhash_bytes
+from .hashes import compute_hashes
 from .util import get_modification_time
+from .stats import ScanStats, NO_STATS
 
 
 logger = logging.getLogger(__name__)
 
 
+# read files in large chunks to keep the number of calls low
+_READ_SIZE = 1024 * 1024
+
+# minimum size of draft images, large enough to keep perceptual hashes
+# close to those of fully decoded images
+DRAFT_SIZE = (64, 64)
+
+
 class _EXIF:
     CREATION_DATE = 36867
 
@@ -39,13 +50,41 @@ def _md5sum(path: Path) -> bytes:
     md5 = hashlib.md5()
     with open(str(path), 'rb') as f:
         while True:
-            data = f.read(1024)
+            data = f.read(_READ_SIZE)
             if not data:
                 break
             md5.update(data)
     return md5.digest()
 
 
+def read_image(path: Path, draft: bool = False,
+               stats: ScanStats = NO_STATS) -> Tuple[Image.Image, bytes]:
+    '''Read the file at `path` once and return the image (decoded lazily
+       from the same in-memory bytes) and the md5 hash of the file.
+       Only the header is read from files not recognized as images
+       (raising an `IOError`), which are thus never read completely.
+       If `draft` is set, JPEG images are decoded in grayscale at a reduced
+       resolution (at least `DRAFT_SIZE`), which is sufficient for
+       perceptual hashing and much faster for large images.
+    '''
+    with open(str(path), 'rb') as f:
+        with stats.timer('open'):
+            Image.open(f)  # identifies the format from the header only
+        with stats.timer('read'):
+            f.seek(0)
+            data = f.read()
+    stats.add_bytes('read', len(data))
+    with stats.timer('open'):
+        # BytesIO shares the bytes object instead of copying it
+        img = Image.open(io.BytesIO(data))
+        if draft:
+            img.draft('L', DRAFT_SIZE)  # no-op for formats other than JPEG
+    with stats.timer('md5'):
+        md5 = hashlib.md5(data).digest()
+    stats.add_bytes('md5', len(data))
+    return img, md5
+
+
 def path_and_modification(source: Path, path: Path) -> Tuple[Path, datetime]:
     '''Returns relative path to `source` and modification time of `path`'''
     source = Path(source).resolve()
@@ -56,19 +95,59 @@ def path_and_modification(source: Path, path: Path) -> Tuple[Path, datetime]:
 
 def descriptor_from_image(source: Path,
                           path: Path,
-                          img: Image) -> ImageDescriptor:
-    path = Path(path).resolve()
-    rel_path, modified_at = path_and_modification(source, path)
-    created_at = _get_creation_time(path, img)
-    md5 = _md5sum(path)
-    dhsh = dhash_bytes(img)
+                          img: Image,
+                          md5: Optional[bytes] = None,
+                          stats: ScanStats = NO_STATS,
+                          hash_algorithms: Iterable[str] = ()) \
+        -> ImageDescriptor:
+    '''Create descriptor of image `img` read from `path`. The file is read
+       again to compute its hash unless `md5` is given (see `read_image`).
+       Additional perceptual hashes are computed for all `hash_algorithms`
+       (see `hashes.HASH_ALGORITHMS`).
+    '''
+    with stats.timer('stat'):
+        path = Path(path).resolve()
+        rel_path, modified_at = path_and_modification(source, path)
+    with stats.timer('exif'):
+        created_at = _get_creation_time(path, img)
+    if md5 is None:
+        with stats.timer('md5'):
+            md5 = _md5sum(path)
+    with stats.timer('dhash'):
+        dhsh = dhash_bytes(img)
+    hash_algorithms = tuple(hash_algorithms)
+    hashes = {}  # type: Dict[str, bytes]
+    if hash_algorithms:
+        with stats.timer('hashes'):
+            hashes = compute_hashes(img, hash_algorithms)
     return ImageDescriptor(None,
                            rel_path,
                            created_at,
                            modified_at,
                            md5,
                            dhsh,
-                           True)
+                           True,
+                           hashes)
+
+
+def describe_image(source: Path, path: Path,
+                   draft: bool = False,
+                   stats: ScanStats = NO_STATS,
+                   hash_algorithms: Iterable[str] = ()) \
+        -> Optional[ImageDescriptor]:
+    '''Read and decode the image at `path` and compute its descriptor
+       (including additional perceptual hashes for `hash_algorithms`).
+       Returns `None` if the file is not a supported image.
+       Time spent in the individual stages is recorded in `stats`.
+    '''
+    try:
+        img, md5 = read_image(path, draft, stats)
+        with stats.timer('load'):
+            img.load()
+    except (IOError, AttributeError, ValueError):
+        return None  # image type is not supported => we ignore it
+    return descriptor_from_image(source, path, img, md5, stats,
+                                 hash_algorithms)
 
 
 def open_image_and_rotate(path: Path):
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+'''Compact on-disk index of image hashes and paths, memory-mapped
+   for lookups by md5 hash, dhash and path without loading all images.
+'''
+
+import os
+import mmap
+import shutil
+import struct
+import tempfile
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple, List  # noqa: 401
+
+from .descriptor import ImageDescriptor
+
+
+_MAGIC = b'KNIPSIDX'
+_VERSION = 1
+# magic, version, generation of images table, number of records
+_HEADER = struct.Struct('<8sIQQ')
+# md5, dhash, image id, path offset, path length, created at, modified at
+_RECORD = struct.Struct('<16s16sqQIqq')
+_POSITION = struct.Struct('<I')
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NO_TIME = -2 ** 63
+
+
+def _to_micros(dt: Optional[datetime]) -> int:
+    return (dt - _EPOCH) // _MICROSECOND if dt is not None else _NO_TIME
+
+
+def _from_micros(micros: int) -> Optional[datetime]:
+    return _EPOCH + micros * _MICROSECOND if micros != _NO_TIME else None
+
+
+def micros_from_nanos(nanos: Optional[int]) -> int:
+    '''Timestamp in nanoseconds since the epoch as stored in the index.'''
+    return nanos // 1000 if nanos is not None else _NO_TIME
+
+
+def _encode_path(path: str) -> bytes:
+    return path.encode('utf-8', 'surrogateescape')
+
+
+class _Keys:
+    '''Sequence of the sort keys of an index section for `bisect`.'''
+
+    def __init__(self, index: 'ImageIndex', key: str) -> None:
+        self.index = index
+        self.key = key
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> bytes:
+        return getattr(self.index, self.key)(i)
+
+
+def write_index(path: Path, generation: int,
+                images: Iterable[ImageDescriptor]) -> None:
+    '''Write index of `images` to file `path` (atomically replacing
+       an existing index). `generation` identifies the state of the
+       images table the index was created from.
+    '''
+    images = sorted(images, key=lambda descr: descr.md5)
+    paths = [str(descr.path) for descr in images]
+    write_index_records(
+        path, generation,
+        ((descr.md5, descr.dhash, descr.image_id, rel_path,
+          _to_micros(descr.created_at), _to_micros(descr.modified_at))
+         for descr, rel_path in zip(images, paths)),
+        lambda: sorted(range(len(images)), key=lambda i: images[i].dhash),
+        lambda: sorted(range(len(images)),
+                       key=lambda i: _encode_path(paths[i])))
+
+
+def write_index_records(path: Path, generation: int,
+                        records: Iterable[tuple],
+                        by_dhash: Callable[[], Iterable[int]],
+                        by_path: Callable[[], Iterable[int]]) -> None:
+    '''Write index file `path` (see `write_index`) from a stream of
+       `records` of md5, dhash, image id, path (relative to source) and
+       creation and modification date (microseconds since the epoch,
+       see `micros_from_nanos`) sorted by md5 hash. `by_dhash` and
+       `by_path` are called after all records are written and return
+       the positions of the records sorted by dhash and path. Only the
+       paths are buffered in a temporary file, so the index can be
+       written from a database cursor without loading all images.
+    '''
+    fd, tmp_path = tempfile.mkstemp(prefix=path.name + '.', suffix='.tmp',
+                                    dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'wb') as f, tempfile.TemporaryFile() as paths:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, generation, 0))
+            n = 0
+            offset = 0
+            for md5, dhash, image_id, rel_path, created_at, modified_at \
+                    in records:
+                path_bytes = _encode_path(rel_path)
+                f.write(_RECORD.pack(md5, dhash, image_id,
+                                     offset, len(path_bytes),
+                                     created_at, modified_at))
+                paths.write(path_bytes)
+                offset += len(path_bytes)
+                n += 1
+            for positions in (by_dhash(), by_path()):
+                for i in positions:
+                    f.write(_POSITION.pack(i))
+            paths.seek(0)
+            shutil.copyfileobj(paths, f)
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, _VERSION, generation, n))
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ImageIndex:
+    '''Read-only view of an index file written by `write_index`.
+       Records are sorted by md5 hash, positions of records sorted
+       by dhash and path allow binary search for these as well.
+       As the file is memory-mapped, opening is instant and pages
+       are shared by all processes using the index.
+    '''
+
+    def __init__(self, path: Path) -> None:
+        with open(str(path), 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.generation, self._n = \
+            _HEADER.unpack_from(self._map, 0) \
+            if len(self._map) >= _HEADER.size else (None, None, 0, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError('{} is not a knipse index of version {}'
+                             .format(path, _VERSION))
+        self._records = _HEADER.size
+        self._by_dhash = self._records + self._n * _RECORD.size
+        self._by_path = self._by_dhash + self._n * _POSITION.size
+        self._paths = self._by_path + self._n * _POSITION.size
+        # the paths of the last record end the file
+        end = self._paths + sum(self._record(self._n - 1)[3:5]) \
+            if self._n and len(self._map) >= self._paths else self._paths
+        if len(self._map) < end:
+            self.close()
+            raise ValueError('{} is truncated'.format(path))
+
+    def __enter__(self) -> 'ImageIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _record(self, i: int) -> tuple:
+        return _RECORD.unpack_from(self._map,
+                                   self._records + i * _RECORD.size)
+
+    def _path(self, record: tuple) -> bytes:
+        offset = self._paths + record[3]
+        return self._map[offset:offset + record[4]]
+
+    def _md5_key(self, i: int) -> bytes:
+        offset = self._records + i * _RECORD.size
+        return self._map[offset:offset + 16]
+
+    def _position(self, section: int, i: int) -> int:
+        return _POSITION.unpack_from(self._map,
+                                     section + i * _POSITION.size)[0]
+
+    def _dhash_key(self, i: int) -> bytes:
+        offset = self._records + \
+            self._position(self._by_dhash, i) * _RECORD.size + 16
+        return self._map[offset:offset + 16]
+
+    def _path_key(self, i: int) -> bytes:
+        return self._path(self._record(self._position(self._by_path, i)))
+
+    def _descriptor(self, record: tuple) -> ImageDescriptor:
+        md5, dhash, image_id, _, _, created_at, modified_at = record
+        return ImageDescriptor(image_id,
+                               Path(self._path(record)
+                                    .decode('utf-8', 'surrogateescape')),
+                               _from_micros(created_at),
+                               _EPOCH + modified_at * _MICROSECOND,
+                               md5, dhash, True)
+
+    def descriptor(self, i: int) -> ImageDescriptor:
+        '''Descriptor of the (active) image of record `i`.'''
+        return self._descriptor(self._record(i))
+
+    def by_md5(self, md5: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup image by md5 hash.'''
+        i = bisect_left(_Keys(self, '_md5_key'), md5)
+        if i < self._n and self._md5_key(i) == md5:
+            return self.descriptor(i)
+        return None
+
+    def by_dhash(self, dhash: bytes) -> Optional[ImageDescriptor]:
+        '''Lookup image by dhash perceptual image hash,
+           `None` if not found or not unique.
+        '''
+        i = bisect_left(_Keys(self, '_dhash_key'), dhash)
+        if i < self._n and self._dhash_key(i) == dhash \
+                and (i + 1 == self._n or self._dhash_key(i + 1) != dhash):
+            return self.descriptor(self._position(self._by_dhash, i))
+        return None
+
+    def _find_path(self, rel_path: str) -> Optional[tuple]:
+        path_bytes = _encode_path(rel_path)
+        i = bisect_left(_Keys(self, '_path_key'), path_bytes)
+        if i < self._n:
+            record = self._record(self._position(self._by_path, i))
+            if self._path(record) == path_bytes:
+                return record
+        return None
+
+    def by_path(self, rel_path: str) -> Optional[ImageDescriptor]:
+        '''Lookup image by path (relative to source).'''
+        record = self._find_path(rel_path)
+        return self._descriptor(record) if record is not None else None
+
+    def modification_time(self, rel_path: str) -> Optional[datetime]:
+        '''Modification time of the image at `rel_path`,
+           `None` if not contained in index.
+        '''
+        record = self._find_path(rel_path)
+        return _from_micros(record[6]) if record is not None else None
@@ -1,17 +1,19 @@
 # -*- coding: utf-8 -*-
 
+from itertools import chain
 from pathlib import Path
+from typing import Iterable, Optional
 
 import click
 
-from .descriptor import ListDescriptor, ListEntryDescriptor
-from .db import ImageRecognizer
+from .descriptor import ListDescriptor
+from .db import BaseImageRecognizer
 from .util import FIELDS
 
 
 def image_id_from_string(image_str: str,
                          base_folder: Path,
-                         recgn: ImageRecognizer) -> int:
+                         recgn: BaseImageRecognizer) -> int:
     if image_str.upper().startswith('I'):
         try:
             return int(image_str[1:])
@@ -23,6 +25,23 @@ def image_id_from_string(image_str: str,
     return image_descr.image_id
 
 
+def _with_stdin(images: Iterable[str], from_stdin: bool) -> Iterable[str]:
+    '''`images` followed by the non-empty lines of standard input
+       if `from_stdin` is set.
+    '''
+    if not from_stdin:
+        return images
+    lines = (line.strip() for line in click.get_text_stream('stdin'))
+    return chain(images, (line for line in lines if line))
+
+
+def _check_before_or_after(before: Optional[int],
+                           after: Optional[int]) -> None:
+    if (before is None) == (after is None):
+        raise click.UsageError('Exactly one of --before and --after '
+                               'must be given.')
+
+
 @click.group(name='list')
 @click.pass_context
 def cli_list(ctx):
@@ -52,21 +71,52 @@ def cli_create_list(ctx, name, virtual_folder):
               type=click.STRING,
               required=True,
               help='List to append image(s) to.')
+@click.option('-s', '--stdin', 'from_stdin', is_flag=True, default=False,
+              help='Also append images (ids or paths) read from standard '
+                   'input, one per line.')
 @click.pass_context
-def cli_append_to_list(ctx, images, list_id):
+def cli_append_to_list(ctx, images, list_id, from_stdin):
     '''Append image(s) to list.'''
     db = ctx.obj['database']
     base_folder = ctx.obj['source']
-    recgn = db.get_recognizer()
+    recgn = db.get_recognizer(lazy=True)
     lid = int(list_id[1:]) if list_id.upper().startswith('L') else int(list_id)
-    lst = ListDescriptor(lid, '', '')
-    entries = list(db.load_list_entries(lst))
-    current_last_position = entries[-1][0].position if entries else 0
-    for i, image in enumerate(images):
-        image_id = image_id_from_string(image, base_folder, recgn)
-        entry_descr = ListEntryDescriptor(None, lid, image_id,
-                                          current_last_position + i + 1)
-        db.store_list_entry(entry_descr)
+    db.append_to_list(lid, (image_id_from_string(image, base_folder, recgn)
+                            for image in _with_stdin(images, from_stdin)))
+
+
+@click.command(name='insert')
+@click.argument('images', type=click.STRING, nargs=-1)
+@click.option('-b', '--before', type=click.INT, default=None,
+              help='List entry to insert image(s) before.')
+@click.option('-a', '--after', type=click.INT, default=None,
+              help='List entry to insert image(s) after.')
+@click.option('-s', '--stdin', 'from_stdin', is_flag=True, default=False,
+              help='Also insert images (ids or paths) read from standard '
+                   'input, one per line.')
+@click.pass_context
+def cli_insert_into_list(ctx, images, before, after, from_stdin):
+    '''Insert image(s) before or after an entry of a list.'''
+    _check_before_or_after(before, after)
+    db = ctx.obj['database']
+    base_folder = ctx.obj['source']
+    recgn = db.get_recognizer(lazy=True)
+    db.insert_into_list((image_id_from_string(image, base_folder, recgn)
+                         for image in _with_stdin(images, from_stdin)),
+                        before, after)
+
+
+@click.command(name='move')
+@click.argument('list-entry-id', type=click.INT)
+@click.option('-b', '--before', type=click.INT, default=None,
+              help='List entry to move the entry before.')
+@click.option('-a', '--after', type=click.INT, default=None,
+              help='List entry to move the entry after.')
+@click.pass_context
+def cli_move_list_entry(ctx, list_entry_id, before, after):
+    '''Move an entry of a list before or after another one.'''
+    _check_before_or_after(before, after)
+    ctx.obj['database'].move_list_entry(list_entry_id, before, after)
 
 
 @click.command(name='show')
@@ -115,5 +165,7 @@ def cli_list_list(ctx, fields, header):
 
 cli_list.add_command(cli_create_list)
 cli_list.add_command(cli_append_to_list)
+cli_list.add_command(cli_insert_into_list)
+cli_list.add_command(cli_move_list_entry)
 cli_list.add_command(cli_show_list)
 cli_list.add_command(cli_list_list)
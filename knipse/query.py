@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+'''Filtering images by path, dates, hashes, lists and state
+   with parameterized SQL queries
+'''
+
+from pathlib import Path
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple  # noqa: 401
+
+import click
+
+from .db import KnipseDB, IMAGE_COLUMNS, to_nanos
+from .descriptor import ImageDescriptor
+from .show import echo_fields
+from .util import FIELDS
+
+
+# columns images can be ordered by (by option value)
+ORDER_COLUMNS = {'id': 'rowid', 'path': 'path',
+                 'created_at': 'created_at', 'modified_at': 'modified_at'}
+
+_IMAGES_IN_LIST = \
+    '''rowid IN (SELECT image_id FROM list_entries
+                 JOIN lists ON list_entries.list_id = lists.rowid
+                 WHERE lists.name = ?)'''
+
+
+def _folder_range(folder: Path) -> Tuple[str, str]:
+    '''Range of paths below `folder` (relative to source): all
+       paths starting with the folder and a slash sort between
+       the folder followed by a slash and by its successor.
+    '''
+    prefix = str(folder) + '/'
+    return prefix, prefix[:-1] + chr(ord('/') + 1)
+
+
+class ImageQuery:
+    '''Filters on images, each one is optional: images below `folder`
+       (relative to source, including subfolders), created or modified
+       in a range of dates (`*_after` inclusive, `*_before` exclusive),
+       with hashes `md5` or `dhash`, contained in the list `list_name` and
+       with state `active` (`None` for all images). Results are ordered
+       by one of `ORDER_COLUMNS` (or in order of the used index) and
+       limited to `limit` images.
+    '''
+
+    def __init__(self,
+                 folder: Optional[Path] = None,
+                 created_after: Optional[datetime] = None,
+                 created_before: Optional[datetime] = None,
+                 modified_after: Optional[datetime] = None,
+                 modified_before: Optional[datetime] = None,
+                 md5: Optional[bytes] = None,
+                 dhash: Optional[bytes] = None,
+                 list_name: Optional[str] = None,
+                 active: Optional[bool] = True,
+                 order_by: Optional[str] = None,
+                 limit: Optional[int] = None) -> None:
+        assert order_by is None or order_by in ORDER_COLUMNS, \
+            'Cannot order by {}'.format(order_by)
+        self.folder = folder
+        self.created_after = created_after
+        self.created_before = created_before
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+        self.md5 = md5
+        self.dhash = dhash
+        self.list_name = list_name
+        self.active = active
+        self.order_by = order_by
+        self.limit = limit
+
+    def conditions(self) -> Iterable[Tuple[str, tuple]]:
+        '''SQL conditions of all set filters with their parameters.'''
+        if self.folder is not None and str(self.folder) not in ('', '.'):
+            yield 'path >= ? AND path < ?', _folder_range(self.folder)
+        for column, after, before in (
+                ('created_at', self.created_after, self.created_before),
+                ('modified_at', self.modified_after, self.modified_before)):
+            if after is not None:
+                yield '{} >= ?'.format(column), (to_nanos(after),)
+            if before is not None:
+                yield '{} < ?'.format(column), (to_nanos(before),)
+        if self.md5 is not None:
+            yield 'md5 = ?', (self.md5,)
+        if self.dhash is not None:
+            yield 'dhash = ?', (self.dhash,)
+        if self.list_name is not None:
+            yield _IMAGES_IN_LIST, (self.list_name,)
+        if self.active is not None:
+            yield 'active = ?', (int(self.active),)
+
+    def sql(self) -> Tuple[str, tuple]:
+        '''Parameterized query selecting the `IMAGE_COLUMNS` of all
+           matching images and its parameters.
+        '''
+        conditions = list(self.conditions())
+        query = 'SELECT {} FROM images'.format(', '.join(IMAGE_COLUMNS))
+        params = tuple(param for _, params in conditions for param in params)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(condition
+                                              for condition, _ in conditions)
+        if self.order_by is not None:
+            query += ' ORDER BY {}'.format(ORDER_COLUMNS[self.order_by])
+        if self.limit is not None:
+            query += ' LIMIT ?'
+            params += (self.limit,)
+        return query + ';', params
+
+
+def query_images(db: KnipseDB, query: ImageQuery) \
+        -> Iterable[ImageDescriptor]:
+    '''Stream all images in `db` matching `query`.'''
+    return db.query_images(*query.sql())
+
+
+class _HexBytes(click.ParamType):
+    '''Parameter type for hashes given as hexadecimal string'''
+    name = 'hex'
+
+    def convert(self, value, param, ctx):
+        try:
+            hsh = bytes.fromhex(value)
+        except ValueError:
+            self.fail('{} is not a hexadecimal string'.format(value),
+                      param, ctx)
+        if len(hsh) != 16:
+            self.fail('{} is not a hash of 16 bytes'.format(value),
+                      param, ctx)
+        return hsh
+
+
+_HASH = _HexBytes()
+
+
+@click.command(name='query')
+@click.option('-f', '--fields', type=FIELDS,
+              default='image_id;active;created_at;path',
+              show_default=True,
+              help='fields of knipse object to output')
+@click.option('-h', '--header/--no-header', default=False,
+              show_default=True,
+              help='print column headers')
+@click.option('--folder', type=click.Path(), default=None,
+              help='Images below this folder (relative to source, '
+                   'including subfolders).')
+@click.option('--created-after', type=click.DateTime(), default=None,
+              help='Images created at or after this date.')
+@click.option('--created-before', type=click.DateTime(), default=None,
+              help='Images created before this date.')
+@click.option('--modified-after', type=click.DateTime(), default=None,
+              help='Images modified at or after this date.')
+@click.option('--modified-before', type=click.DateTime(), default=None,
+              help='Images modified before this date.')
+@click.option('--md5', type=_HASH, default=None,
+              help='Images with this md5 hash (hexadecimal).')
+@click.option('--dhash', type=_HASH, default=None,
+              help='Images with this perceptual hash (hexadecimal).')
+@click.option('-l', '--list', 'list_name', default=None,
+              help='Images contained in the list with this name.')
+@click.option('--state', type=click.Choice(['active', 'inactive', 'all']),
+              default='active', show_default=True,
+              help='Images with this state.')
+@click.option('-o', '--order-by', type=click.Choice(list(ORDER_COLUMNS)),
+              default=None, help='Order of images (default: any order).')
+@click.option('-n', '--limit', type=click.IntRange(min=0), default=None,
+              help='Maximum number of images.')
+@click.pass_context
+def cli_query(ctx, fields, header, folder, created_after, created_before,
+              modified_after, modified_before, md5, dhash, list_name, state,
+              order_by, limit):
+    '''Show images matching all given filters'''
+    db = ctx.obj['database']
+    active = {'active': True, 'inactive': False, 'all': None}[state]
+    query = ImageQuery(Path(folder) if folder else None,
+                       created_after, created_before,
+                       modified_after, modified_before, md5, dhash,
+                       list_name, active, order_by, limit)
+    echo_fields(fields, header, query_images(db, query))
+
+
+@click.command(name='search')
+@click.option('-f', '--fields', type=FIELDS,
+              default='image_id;active;created_at;path',
+              show_default=True,
+              help='fields of knipse object to output')
+@click.option('-h', '--header/--no-header', default=False,
+              show_default=True,
+              help='print column headers')
+@click.option('-n', '--limit', type=click.IntRange(min=0), default=None,
+              help='Maximum number of images.')
+@click.argument('text')
+@click.pass_context
+def cli_search(ctx, fields, header, limit, text):
+    '''Show images with paths containing TEXT (ignoring case)'''
+    db = ctx.obj['database']
+    echo_fields(fields, header, db.search_images(text, limit))
@@ -1,43 +1,264 @@
 # -*- coding: utf-8 -*-
 
+import os
+import json
 from pathlib import Path
 from datetime import datetime
-from typing import List, Callable, Optional, Iterable, Tuple  # noqa: 401
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Callable, Optional, Iterable, Tuple, Set, \
+    Dict, Any, Generator  # noqa: 401
 
 import click
+from PIL import Image
 
-from .db import KnipseDB
-from .walk import walk_images
-from .image import descriptor_from_image
-from .descriptor import ImageDescriptor
+from .db import KnipseDB, BatchWriter
+from .walk import walk_images, FolderTree
+from .image import describe_image, read_image
+from .hashes import HASH_ALGORITHMS, compute_hashes
+from .descriptor import ImageDescriptor, ScanSessionDescriptor
+from .stats import ScanStats, NO_STATS
+
+
+# number of images queued per worker process in parallel scans
+_PENDING_PER_JOB = 4
+
+
+def _map_ordered(function: Callable, items: Iterable[Tuple[Any, tuple]],
+                 jobs: int) -> Iterable[Tuple[Any, Any]]:
+    '''Call `function` with the arguments of all `items` (pairs of key
+       and arguments) using `jobs` processes, yields pairs of key and
+       result in the order of `items`.
+    '''
+    if jobs <= 1:
+        for key, args in items:
+            yield key, function(*args)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()  # type: deque
+        try:
+            for key, args in items:
+                pending.append((key, executor.submit(function, *args)))
+                if len(pending) >= jobs * _PENDING_PER_JOB:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+            while pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _describe_image_with_stats(base_folder: Path, file_path: Path,
+                               draft: bool, hash_algorithms: Tuple[str, ...]) \
+        -> Tuple[Optional[ImageDescriptor], ScanStats]:
+    '''Variant of `describe_image` returning the stats of the
+       (worker) process with the descriptor.
+    '''
+    stats = ScanStats()
+    return describe_image(base_folder, file_path, draft, stats,
+                          hash_algorithms), stats
+
+
+def _describe_images(base_folder: Path,
+                     walk: Iterable[Tuple[Path, Optional[Image.Image], float]],
+                     jobs: int,
+                     draft: bool = False,
+                     stats: ScanStats = NO_STATS,
+                     hash_algorithms: Tuple[str, ...] = ()) \
+        -> Iterable[Tuple[Path, float, Optional[ImageDescriptor]]]:
+    '''Compute descriptors for all walked images using `jobs` processes.
+       Results are yielded in walking order.
+    '''
+    if jobs <= 1:
+        for file_path, _, progress in walk:
+            yield file_path, progress, \
+                describe_image(base_folder, file_path, draft, stats,
+                               hash_algorithms)
+        return
+    items = (((file_path, progress),
+              (base_folder, file_path, draft, hash_algorithms))
+             for file_path, _, progress in walk)
+    for (file_path, progress), (descr, worker_stats) \
+            in _map_ordered(_describe_image_with_stats, items, jobs):
+        stats.merge(worker_stats)
+        yield file_path, progress, descr
+
+
+class _ScanCheckpoints:
+    '''Collects checkpoints and folder states of a walk and stages them
+       for storage once all files walked before them are processed.
+    '''
+
+    def __init__(self, session: ScanSessionDescriptor) -> None:
+        self.source = session.source
+        self.walked_before = session.walked
+        self.walked = 0
+        self.processed = 0
+        self.stored = session.stored
+        self._folders = deque()  # type: deque
+        self._n_folders = 0
+        self._n_staged_folders = 0
+        self._checkpoints = deque()  # type: deque
+
+    def count(self, walk: Iterable) -> Iterable:
+        '''Count files passed on by `walk`.'''
+        for item in walk:
+            self.walked += 1
+            yield item
+
+    def add_folder(self, folder: Tuple[Path, datetime, int]) -> None:
+        self._folders.append(folder)
+        self._n_folders += 1
+
+    def checkpoint(self, folder_tree: FolderTree) -> None:
+        self._checkpoints.append((self.walked, self._n_folders, folder_tree))
+
+    def stage(self, batch: BatchWriter) -> None:
+        '''Stage folder states and the latest scan session
+           whose files are all processed in `batch`.
+        '''
+        while self._checkpoints and self._checkpoints[0][0] <= self.processed:
+            walked, n_folders, folder_tree = self._checkpoints.popleft()
+            batch.store_folder_scans(
+                [self._folders.popleft()
+                 for _ in range(n_folders - self._n_staged_folders)])
+            self._n_staged_folders = n_folders
+            batch.store_scan_session(ScanSessionDescriptor(
+                self.source, folder_tree, self.walked_before + walked,
+                self.stored))
 
 
 def scan_images(db: KnipseDB, base_folder: Path,
-                skip_thumbnail_folders: bool = True) \
-        -> Iterable[Tuple[Path, float]]:
+                skip_thumbnail_folders: bool = True,
+                jobs: int = 1,
+                skip_unchanged_folders: bool = False,
+                fast: bool = False,
+                seen: Optional[Set[str]] = None,
+                resume: bool = False,
+                stats: ScanStats = NO_STATS,
+                hash_algorithms: Iterable[str] = (),
+                lazy: bool = False) \
+        -> Generator[Tuple[Path, float], None, None]:
     '''Walk all folders below `base_folder`
-       and store contained images in database
+       and store contained images in database.
+       Images are decoded and hashed by `jobs` worker processes,
+       all database writes happen in the calling process.
+       If `skip_unchanged_folders` is set, files in folders whose
+       modification time and number of entries did not change since
+       the last scan are not checked (files modified in place
+       without touching their folder are missed in that case).
+       If `fast` is set, JPEG images are decoded at reduced resolution,
+       their perceptual hashes may deviate in a few bits.
+       If a `seen` set is given, the paths (relative to `base_folder`) of
+       all walked files and of skipped unchanged folders are added to it,
+       see `reconcile_images`.
+       The scan state is stored in the database regularly, if `resume` is
+       set, the last interrupted scan of `base_folder` is continued (`seen`
+       then misses the files walked before the interruption).
+       Time and bytes processed per stage are recorded in `stats` (stages
+       running in worker processes are summed over all processes).
+       Additional perceptual hashes are computed and stored for all
+       `hash_algorithms` (see `hashes.HASH_ALGORITHMS`).
+       If `lazy` is set, known images are looked up with database queries
+       folder by folder instead of loading all of them.
     '''
-    recgn = db.get_recognizer()
-    for file_path, img, progress in walk_images(base_folder,
-                                                recgn.filter,
-                                                skip_thumbnail_folders):
-        # at this point we know that either the file path is not known
-        # or the modification date has changed
-        # ToDo: check if file is still there
-        try:
-            img.load()
-        except (IOError, AttributeError):
-            continue  # image type is not supported => we ignore it
-        descr = descriptor_from_image(base_folder, file_path, img)
-        # next we check if we can find an indentical file in the md5 index
-        looked_up_by_md5 = recgn.by_md5(descr.md5)
-        if looked_up_by_md5:  # image was moved
-            descr.image_id = looked_up_by_md5.image_id
-            db.store_image(descr)
-        else:  # new image
-            db.store_image(descr)
-            yield file_path, progress
+    hash_algorithms = tuple(hash_algorithms)
+    recgn = db.get_recognizer(lazy=lazy)
+    base_folder = Path(base_folder).resolve()
+    session = db.load_scan_session(base_folder) if resume else None
+    checkpoints = _ScanCheckpoints(
+        session or ScanSessionDescriptor(base_folder, [], 0, 0))
+
+    def _filter(source: Path, path: Path, mtime: datetime) -> bool:
+        if seen is not None:
+            seen.add(str(path.relative_to(source)))
+        return recgn.filter(source, path, mtime)
+
+    def _folder_filter(source: Path, folder: Path,
+                       mtime: datetime, entries: int) -> bool:
+        rel_folder = folder.relative_to(source)
+        checkpoints.add_folder((rel_folder, mtime, entries))
+        if not skip_unchanged_folders \
+                or recgn.filter_folder(source, folder, mtime, entries):
+            return True
+        if seen is not None:
+            seen.add(str(rel_folder))
+        return False
+
+    walk = walk_images(base_folder, _filter, skip_thumbnail_folders,
+                       open_images=False, folder_filter=_folder_filter,
+                       folder_tree=session.folder_tree if session else None,
+                       checkpoint=checkpoints.checkpoint, stats=stats)
+    with db.batch(stats=stats) as batch:
+        for file_path, progress, descr in \
+                _describe_images(base_folder, checkpoints.count(walk),
+                                 jobs, fast, stats, hash_algorithms):
+            # folder states and scan sessions are only stored
+            # after all images walked before are stored
+            checkpoints.stage(batch)
+            checkpoints.processed += 1
+            # at this point we know that either the file path is not known
+            # or the modification date has changed
+            if descr is None:
+                continue
+            # next we check if we can find an indentical file in the md5 index
+            looked_up_by_md5 = recgn.by_md5(descr.md5)
+            if looked_up_by_md5:  # image was moved
+                descr.image_id = looked_up_by_md5.image_id
+                batch.store_image(descr)
+            else:  # new image
+                batch.store_image(descr)
+                checkpoints.stored += 1
+                yield file_path, progress
+        checkpoints.stage(batch)
+    db.delete_scan_session(base_folder)
+
+
+def reconcile_images(db: KnipseDB, seen: Set[str]) -> List[Path]:
+    '''Deactivate all images in database that were not `seen` by
+       `scan_images`, i.e. neither their path nor their folder is contained
+       in `seen`. Unlike `purge_images` this requires no file system access.
+       Returns the paths of the deactivated images.
+    '''
+    missing = [(image_id, path) for image_id, path in db.load_image_paths()
+               if path not in seen
+               and (os.path.dirname(path) or '.') not in seen]
+    db.deactivate_images(image_id for image_id, _ in missing)
+    return [Path(path) for _, path in missing]
+
+
+def _hash_image(file_path: Path, hash_algorithms: Tuple[str, ...]) \
+        -> Optional[Dict[str, bytes]]:
+    try:
+        img, _ = read_image(file_path)
+        img.load()
+    except (IOError, AttributeError, ValueError):
+        return None  # image was removed or cannot be decoded anymore
+    return compute_hashes(img, hash_algorithms)
+
+
+def backfill_hashes(db: KnipseDB, base_folder: Path,
+                    hash_algorithms: Iterable[str], jobs: int = 1) \
+        -> Iterable[Tuple[Path, bool]]:
+    '''Compute and store all `hash_algorithms` for active images missing
+       any of them, decoding each image once using `jobs` processes.
+       Yields path (relative to `base_folder`) of each processed image
+       and whether hashing succeeded.
+    '''
+    hash_algorithms = tuple(hash_algorithms)
+    base_folder = Path(base_folder).resolve()
+    missing = {}  # type: Dict[int, str]
+    for algorithm in hash_algorithms:
+        missing.update(db.load_images_missing_hash(algorithm))
+    items = ((image_id, (base_folder / path, hash_algorithms))
+             for image_id, path in sorted(missing.items()))
+    with db.batch() as batch:
+        for image_id, hashes in _map_ordered(_hash_image, items, jobs):
+            if hashes is not None:
+                batch.store_hashes(image_id, hashes)
+            yield Path(missing[image_id]), hashes is not None
 
 
 def purge_images(db: KnipseDB, base_folder: Path) \
@@ -45,11 +266,12 @@ def purge_images(db: KnipseDB, base_folder: Path) \
     '''Check all images in database if they are still present
        and deactivate them otherwise.
     '''
-    for descr in db.load_all_images():
-        if not (base_folder / descr.path).exists():
-            descr.active = False
-            db.store_image(descr)
-            yield descr
+    with db.batch() as batch:
+        for descr in db.load_all_images():
+            if not (base_folder / descr.path).exists():
+                descr.active = False
+                batch.store_image(descr)
+                yield descr
 
 
 def _format_timedelta(dt):
@@ -74,19 +296,64 @@ def _format_timedelta(dt):
 @click.option('-t', '--skip-thumbnails/--no-skip-thumbnails', default=True,
               show_default=True,
               help='Skips all folders containing the word "thumbnail".')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help='Number of processes decoding images in parallel.')
+@click.option('-u', '--skip-unchanged-folders/--no-skip-unchanged-folders',
+              default=False, show_default=True,
+              help='Skips files in folders unchanged since the last scan '
+                   '(misses files modified in place).')
+@click.option('-f', '--fast/--no-fast', default=False, show_default=True,
+              help='Decodes JPEG images at reduced resolution '
+                   '(perceptual hashes may deviate slightly).')
+@click.option('-p', '--purge/--no-purge', default=False, show_default=True,
+              help='Deactivates images not found during the scan '
+                   '(including images in skipped thumbnail folders).')
+@click.option('-r', '--resume/--no-resume', default=False, show_default=True,
+              help='Continues the last interrupted scan of `source`.')
+@click.option('-H', '--hash', 'hash_algorithms', multiple=True,
+              type=click.Choice(list(HASH_ALGORITHMS)),
+              help='Additional perceptual hash to compute '
+                   '(may be given multiple times).')
+@click.option('-l', '--lazy/--no-lazy', default=False, show_default=True,
+              help='Looks up known images with database queries instead '
+                   'of loading all of them (less memory for large '
+                   'catalogs).')
+@click.option('-s', '--stats/--no-stats', default=False, show_default=True,
+              help='Prints time spent and bytes processed per scan stage.')
+@click.option('--stats-json', type=click.File('w'), default=None,
+              help='Writes time spent and bytes processed per scan stage '
+                   'to this file as JSON.')
 @click.pass_context
-def cli_scan(ctx, skip_thumbnails):
+def cli_scan(ctx, skip_thumbnails, jobs, skip_unchanged_folders, fast, purge,
+             resume, hash_algorithms, lazy, stats, stats_json):
     '''Walk all folders below global knipse `source`
        and store contained images in database
     '''
     db = ctx.obj['database']
     base_folder = ctx.obj['source']
-    click.echo('Scanning images in {}...'.format(base_folder))
+    session = db.load_scan_session(Path(base_folder).resolve()) \
+        if resume else None
+    if session and purge:
+        raise click.UsageError('Resumed scans cannot be purged, '
+                               'please scan again without --resume.')
+    if session:
+        click.echo('Resuming scan of images in {} at {:.1f}%...'
+                   .format(base_folder, session.progress * 100))
+    else:
+        click.echo('Scanning images in {}...'.format(base_folder))
     start = datetime.now()
+    start_progress = session.progress if session else 0.0
     line_length = 1
-    for file_path, progress in scan_images(db, base_folder, skip_thumbnails):
+    seen = set() if purge else None  # type: Optional[Set[str]]
+    scan_stats = ScanStats() if stats or stats_json else NO_STATS
+    scan = scan_images(db, base_folder, skip_thumbnails, jobs,
+                       skip_unchanged_folders, fast, seen, resume, scan_stats,
+                       hash_algorithms, lazy)
+    for file_path, progress in scan:
         rel_path = file_path.relative_to(base_folder)
-        remaining = (datetime.now() - start) * (1 - progress)
+        remaining = (datetime.now() - start) * (1 - progress) \
+            / max(progress - start_progress, 1e-6)
         click.echo('\r' + ' ' * line_length, nl=False)
         line = '\r{:5.1f}% |{:<40s}| ETA {}  Scanning {}...' \
                .format(progress * 100,
@@ -98,6 +365,17 @@ def cli_scan(ctx, skip_thumbnails):
         line_length = len(line)
         click.echo(line, nl=False)
     click.echo()
+    if seen is not None:
+        for path in reconcile_images(db, seen):
+            click.echo('Deactivating {}'.format(path))
+    elapsed = (datetime.now() - start).total_seconds()
+    if stats:
+        click.echo(scan_stats.summary())
+        click.echo('Total {:.3f} seconds (stages of parallel jobs are summed '
+                   'over all processes)'.format(elapsed))
+    if stats_json:
+        json.dump({'total_seconds': elapsed, 'jobs': jobs,
+                   'stages': scan_stats.as_dict()}, stats_json, indent=2)
     click.echo('Scan completed')
 
 
@@ -112,3 +390,30 @@ def cli_purge(ctx):
     for descr in purge_images(db, base_folder):
         click.echo('Deactivating {}'.format(descr.path))
     click.echo('Purge completed')
+
+
+@click.command(name='backfill-hashes')
+@click.option('-H', '--hash', 'hash_algorithms', multiple=True,
+              type=click.Choice(list(HASH_ALGORITHMS)),
+              default=list(HASH_ALGORITHMS), show_default=True,
+              help='Perceptual hash to compute (may be given multiple times).')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help='Number of processes decoding images in parallel.')
+@click.pass_context
+def cli_backfill_hashes(ctx, hash_algorithms, jobs):
+    '''Compute additional perceptual hashes for images in database
+       that are missing them.
+    '''
+    db = ctx.obj['database']
+    base_folder = ctx.obj['source']
+    click.echo('Computing {} hashes of images in {}...'
+               .format(', '.join(hash_algorithms), base_folder))
+    n_hashed = 0
+    for path, hashed in backfill_hashes(db, base_folder, hash_algorithms,
+                                        jobs):
+        if hashed:
+            n_hashed += 1
+        else:
+            click.echo('Cannot read {}'.format(path))
+    click.echo('Hashed {} images'.format(n_hashed))
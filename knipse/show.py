@@ -1,8 +1,26 @@
 # -*- coding: utf-8 -*-
 
+from itertools import chain
+from typing import Iterable
+
 import click
 
-from .util import FIELDS
+from .util import FIELDS, KnipseFieldsReader
+
+
+def echo_fields(fields: KnipseFieldsReader, header: bool,
+                objects: Iterable) -> None:
+    '''Print `fields` of all `objects` as they are read (and their
+       headers if `header` is set).
+    '''
+    objects = iter(objects)
+    if header:
+        first = next(objects, None)
+        click.echo(fields.headers_tab(first))
+        if first is not None:
+            objects = chain([first], objects)
+    for obj in objects:
+        click.echo(fields.tab(obj))
 
 
 @click.command(name='show-image')
@@ -19,14 +37,11 @@ def cli_show_image(ctx, fields, header, image_id):
     '''Show images corresponding to `image_id`(s).'''
     db = ctx.obj['database']
     if not image_id:
-        images = list(db.load_all_images())
+        images = db.load_all_images()
     else:
         image_ids = [int(obj[1:])
                      if obj.upper().startswith('I')
                      else int(obj)
                      for obj in image_id]
-        images = [db.load_image(img_id) for img_id in image_ids]
-    if header:
-        click.echo(fields.headers_tab(images[0] if images else None))
-    for image in images:
-        click.echo(fields.tab(image))
+        images = (db.load_image(img_id) for img_id in image_ids)
+    echo_fields(fields, header, images)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+'''Search for near-duplicate images by Hamming distance of their dhash'''
+
+import os
+import struct
+import tempfile
+import logging
+from array import array
+from itertools import combinations
+from math import factorial
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple  # noqa: 401
+
+import click
+import numpy as np
+
+from .db import KnipseDB
+from .dhash import dhash_bytes
+from .image import read_image
+
+
+logger = logging.getLogger(__name__)
+
+
+HASH_BYTES = 16
+CHUNK_BITS = 16
+N_CHUNKS = 8 * HASH_BYTES // CHUNK_BITS
+
+_MAGIC = b'KNIPSDHX'
+_VERSION = 1
+# magic, version, generation of images table, number of hashes
+_HEADER = struct.Struct('<8sQQQ')
+
+# number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hashes_array(dhashes: Iterable[bytes]) -> np.ndarray:
+    '''`dhashes` (bytes or rows of an array) as contiguous array
+       of shape n x 16 and dtype uint8.
+    '''
+    if isinstance(dhashes, np.ndarray):
+        return np.ascontiguousarray(dhashes, dtype=np.uint8) \
+            .reshape(-1, HASH_BYTES)
+    joined = b''.join(dhashes)
+    assert len(joined) % HASH_BYTES == 0, \
+        'dhashes must be of {} bytes each'.format(HASH_BYTES)
+    return np.frombuffer(joined, dtype=np.uint8).reshape(-1, HASH_BYTES)
+
+
+def hamming_distances(hashes: np.ndarray, dhash: bytes) -> np.ndarray:
+    '''Hamming distances of all `hashes` (shape n x 16, dtype uint8)
+       to a single `dhash`.
+    '''
+    query = np.frombuffer(dhash, dtype=np.uint8)
+    return POPCOUNT[np.bitwise_xor(hashes, query)].sum(axis=1, dtype=np.int32)
+
+
+def _chunk_variants(chunk: int, radius: int) -> Iterable[int]:
+    '''All values of a chunk within Hamming distance `radius` of `chunk`.'''
+    for r in range(radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            variant = chunk
+            for bit in bits:
+                variant ^= 1 << bit
+            yield variant
+
+
+def _n_chunk_variants(radius: int) -> int:
+    return sum(factorial(CHUNK_BITS) // factorial(r)
+               // factorial(CHUNK_BITS - r) for r in range(radius + 1))
+
+
+class DhashIndex:
+    '''Multi-index hashing of 128 bit dhashes for search by Hamming
+       distance: hashes are split into 16 bit chunks, each sorted
+       in a separate index. By the pigeonhole principle, any hash within
+       distance k of a query hash differs by at most k // 8 bits in one
+       of the chunks, hence only hashes near the query in one chunk
+       index need to be compared.
+    '''
+
+    def __init__(self, image_ids: Iterable[int],
+                 dhashes: Iterable[bytes]) -> None:
+        self.image_ids = np.fromiter(image_ids, dtype=np.int64)
+        self.hashes = hashes_array(dhashes)
+        assert len(self.hashes) == len(self.image_ids), \
+            'dhashes must be of {} bytes each'.format(HASH_BYTES)
+        chunks = self.hashes.view('<u2')
+        self._order = []  # type: List[np.ndarray]
+        self._sorted_chunks = []  # type: List[np.ndarray]
+        for i in range(N_CHUNKS):
+            order = np.argsort(chunks[:, i], kind='stable')
+            self._order.append(order.astype(np.int32))
+            self._sorted_chunks.append(chunks[order, i])
+
+    @classmethod
+    def _from_arrays(cls, image_ids: np.ndarray, hashes: np.ndarray,
+                     order: List[np.ndarray],
+                     sorted_chunks: List[np.ndarray]) -> 'DhashIndex':
+        index = cls.__new__(cls)
+        index.image_ids = image_ids
+        index.hashes = hashes
+        index._order = order
+        index._sorted_chunks = sorted_chunks
+        return index
+
+    def _sections(self) -> List[np.ndarray]:
+        # sorted by size of their items to keep all sections aligned
+        return [self.image_ids, self.hashes] + self._order \
+            + self._sorted_chunks
+
+    def save(self, path: Path, generation: int) -> None:
+        '''Write the index to file `path` (atomically replacing an
+           existing file), `generation` identifies the state of the
+           images table the index was created from (see `load`).
+        '''
+        fd, tmp_path = tempfile.mkstemp(prefix=path.name + '.',
+                                        suffix='.tmp', dir=str(path.parent))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, generation, len(self)))
+                for section in self._sections():
+                    f.write(np.ascontiguousarray(section).tobytes())
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> Tuple[int, 'DhashIndex']:
+        '''Memory-map an index file written by `save`, opening is instant
+           and only pages needed by queries are read. Returns the
+           generation of the images table and the index.
+        '''
+        data = np.memmap(str(path), dtype=np.uint8, mode='r')
+        magic, version, generation, n = \
+            _HEADER.unpack(data[:_HEADER.size].tobytes()) \
+            if len(data) >= _HEADER.size else (None, None, 0, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('{} is not a knipse dhash index of version {}'
+                             .format(path, _VERSION))
+        sizes = [(np.int64, n), (np.uint8, n * HASH_BYTES)] \
+            + [(np.int32, n)] * N_CHUNKS + [(np.uint16, n)] * N_CHUNKS
+        offset = _HEADER.size
+        sections = []
+        for dtype, size in sizes:
+            end = offset + size * np.dtype(dtype).itemsize
+            if end > len(data):
+                raise ValueError('{} is truncated'.format(path))
+            sections.append(data[offset:end].view(dtype))
+            offset = end
+        return generation, cls._from_arrays(
+            sections[0], sections[1].reshape(-1, HASH_BYTES),
+            sections[2:2 + N_CHUNKS], sections[2 + N_CHUNKS:])
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[int, bytes]]) -> 'DhashIndex':
+        '''Create index from pairs of image id and dhash,
+           e.g. as returned by `KnipseDB.load_image_dhashes`.
+        '''
+        pairs = list(pairs)
+        return cls((image_id for image_id, _ in pairs),
+                   (dhash for _, dhash in pairs))
+
+    def __len__(self) -> int:
+        return len(self.image_ids)
+
+    def _candidates(self, dhash: bytes, max_distance: int) -> np.ndarray:
+        radius = max_distance // N_CHUNKS
+        if N_CHUNKS * _n_chunk_variants(radius) >= len(self):
+            # enumerating chunk variants is slower than a linear scan
+            return np.arange(len(self), dtype=np.int32)
+        query_chunks = np.frombuffer(dhash, dtype='<u2')
+        found = []  # type: List[np.ndarray]
+        for i in range(N_CHUNKS):
+            sorted_chunks = self._sorted_chunks[i]
+            variants = np.fromiter(_chunk_variants(int(query_chunks[i]),
+                                                   radius), dtype=np.uint16)
+            lower = np.searchsorted(sorted_chunks, variants, 'left')
+            upper = np.searchsorted(sorted_chunks, variants, 'right')
+            found.extend(self._order[i][lo:hi]
+                         for lo, hi in zip(lower, upper) if hi > lo)
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(found))
+
+    def query(self, dhash: bytes, max_distance: int) \
+            -> List[Tuple[int, int]]:
+        '''Find all images within Hamming distance `max_distance`
+           of `dhash`, returns pairs of distance and image id
+           ordered by distance.
+        '''
+        assert len(dhash) == HASH_BYTES, \
+            'dhash must be of {} bytes'.format(HASH_BYTES)
+        candidates = self._candidates(dhash, max_distance)
+        distances = hamming_distances(self.hashes[candidates], dhash)
+        within = distances <= max_distance
+        candidates = candidates[within]
+        distances = distances[within]
+        order = np.lexsort((self.image_ids[candidates], distances))
+        return [(int(distances[i]), int(self.image_ids[candidates[i]]))
+                for i in order]
+
+
+def load_dhash_index(db: KnipseDB) -> DhashIndex:
+    '''`DhashIndex` of all active images in `db`. For databases stored
+       in a file, it is memory-mapped from a file next to the database
+       and only rebuilt if images changed.
+    '''
+    with db.snapshot():
+        generation = db.images_generation()
+        path = db.index_path.with_suffix('.dhx') \
+            if db.index_path is not None else None
+        if path is not None:
+            try:
+                index_generation, index = DhashIndex.load(path)
+                if index_generation == generation:
+                    return index
+            except (OSError, ValueError):
+                pass  # index is missing or corrupt and rebuilt below
+        image_ids = array('q')
+        dhashes = bytearray()
+        for image_id, dhash in db.load_image_dhashes():
+            image_ids.append(image_id)
+            dhashes += dhash
+        index = DhashIndex(np.frombuffer(image_ids, dtype=np.int64),
+                           np.frombuffer(bytes(dhashes), dtype=np.uint8))
+    if path is not None:
+        try:
+            index.save(path, generation)
+        except OSError:
+            logger.warning('Cannot write dhash index {}'.format(path),
+                           exc_info=True)
+    return index
+
+
+@click.command(name='similar')
+@click.argument('file',
+                type=click.Path(exists=True, file_okay=True, dir_okay=False,
+                                resolve_path=True))
+@click.option('-k', '--max-distance', type=click.IntRange(0, 128),
+              default=8, show_default=True,
+              help='Maximum number of differing bits of the dhash.')
+@click.pass_context
+def cli_similar(ctx, file, max_distance):
+    '''Find images in database similar to FILE
+       by Hamming distance of the perceptual difference hash
+    '''
+    db = ctx.obj['database']
+    try:
+        img, _ = read_image(file)
+        dhash = dhash_bytes(img)
+    except (IOError, ValueError) as e:
+        raise click.ClickException('Cannot read image {}: {}'.format(file, e))
+    index = load_dhash_index(db)
+    for distance, image_id in index.query(dhash, max_distance):
+        click.echo('{}\t{}'.format(distance, db.load_image(image_id).path))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+'''Timers and counters for the stages of scans'''
+
+from time import perf_counter
+from collections import defaultdict
+from typing import Dict  # noqa: 401
+
+
+class _Timer:
+    '''Context manager adding the time spent within to a stage.'''
+
+    def __init__(self, stats: 'ScanStats', stage: str) -> None:
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stats.add_time(self.stage, perf_counter() - self.start)
+
+
+class _NoTimer:
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+class ScanStats:
+    '''Accumulates time, number of calls and bytes processed
+       per stage of a scan (e.g. listing folders or decoding images).
+    '''
+
+    def __init__(self) -> None:
+        self.seconds = defaultdict(float)  # type: Dict[str, float]
+        self.calls = defaultdict(int)  # type: Dict[str, int]
+        self.bytes = defaultdict(int)  # type: Dict[str, int]
+
+    def timer(self, stage: str) -> _Timer:
+        '''Context manager measuring the time spent in `stage`.'''
+        return _Timer(self, stage)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+
+    def add_bytes(self, stage: str, n_bytes: int) -> None:
+        self.bytes[stage] += n_bytes
+
+    def merge(self, other: 'ScanStats') -> None:
+        '''Add all timers and counters of `other`,
+           e.g. of a worker process.
+        '''
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+        for stage, calls in other.calls.items():
+            self.calls[stage] += calls
+        for stage, n_bytes in other.bytes.items():
+            self.bytes[stage] += n_bytes
+
+    def stages(self):
+        return sorted(set(self.seconds) | set(self.bytes),
+                      key=lambda stage: -self.seconds.get(stage, 0.0))
+
+    def as_dict(self) -> dict:
+        '''Timers and counters per stage, suitable for JSON reports.'''
+        return {stage: {'seconds': self.seconds.get(stage, 0.0),
+                        'calls': self.calls.get(stage, 0),
+                        'bytes': self.bytes.get(stage, 0)}
+                for stage in self.stages()}
+
+    def summary(self) -> str:
+        '''Human-readable table of timers and counters per stage.'''
+        lines = ['{:<12s} {:>10s} {:>10s} {:>12s} {:>10s}'
+                 .format('stage', 'seconds', 'calls', 'ms/call', 'MiB')]
+        for stage in self.stages():
+            seconds = self.seconds.get(stage, 0.0)
+            calls = self.calls.get(stage, 0)
+            n_bytes = self.bytes.get(stage, 0)
+            lines.append('{:<12s} {:>10.3f} {:>10d} {:>12.3f} {:>10.1f}'
+                         .format(stage, seconds, calls,
+                                 1000 * seconds / calls if calls else 0.0,
+                                 n_bytes / (1024 * 1024)))
+        return '\n'.join(lines)
+
+
+class _NoStats(ScanStats):
+    '''Stats discarding all measurements.'''
+
+    _no_timer = _NoTimer()
+
+    def timer(self, stage: str) -> _NoTimer:  # type: ignore
+        return self._no_timer
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        pass
+
+    def add_bytes(self, stage: str, n_bytes: int) -> None:
+        pass
+
+    def merge(self, other: ScanStats) -> None:
+        pass
+
+
+# default for functions with optional stats
+NO_STATS = _NoStats()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+'''Columnar in-memory representation of many images for bulk
+   processing of whole catalogs
+'''
+
+import sys
+from pathlib import Path
+from datetime import datetime
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple  # noqa: 401
+
+import numpy as np
+
+from .descriptor import ImageDescriptor
+
+
+HASH_BYTES = 16
+
+# resolution of the timestamp columns
+_TIME_UNIT = 'datetime64[ns]'
+# integer representation of `NaT`
+_NAT = np.iinfo(np.int64).min
+
+
+def _split_path(path: str) -> Tuple[str, str]:
+    '''Folder (possibly empty) and name of a relative path.'''
+    folder, _, name = path.rpartition('/')
+    return folder, name
+
+
+def _to_datetime64(nanos: Iterable[Optional[int]]) -> np.ndarray:
+    return np.array([_NAT if value is None else value for value in nanos],
+                    dtype=np.int64).view(_TIME_UNIT)
+
+
+def _to_datetime(value: np.datetime64) -> Optional[datetime]:
+    return None if np.isnat(value) \
+        else value.astype('datetime64[us]').astype(object)
+
+
+class ImageTable:
+    '''Images as columns instead of `ImageDescriptor` instances:
+       `image_ids` (int64), `created_at` and `modified_at` (datetime64,
+       `NaT` for unknown dates), `md5` and `dhash` (uint8 arrays with one
+       row of 16 bytes per image) and `active` (bool). Paths are split
+       into the index of their (interned) folder in `folders`
+       (`folder_ids`, uint32) and their file `names`.
+    '''
+
+    def __init__(self, image_ids: np.ndarray, folders: List[str],
+                 folder_ids: np.ndarray, names: List[str],
+                 created_at: np.ndarray, modified_at: np.ndarray,
+                 md5: np.ndarray, dhash: np.ndarray,
+                 active: np.ndarray) -> None:
+        n = len(image_ids)
+        assert len(folder_ids) == len(names) == len(created_at) \
+            == len(modified_at) == len(md5) == len(dhash) == len(active) \
+            == n, 'All columns must be of length {}'.format(n)
+        assert md5.shape[1:] == dhash.shape[1:] == (HASH_BYTES,), \
+            'Hashes must be of {} bytes each'.format(HASH_BYTES)
+        self.image_ids = image_ids
+        self.folders = folders
+        self.folder_ids = folder_ids
+        self.names = names
+        self.created_at = created_at
+        self.modified_at = modified_at
+        self.md5 = md5
+        self.dhash = dhash
+        self.active = active
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[List[tuple]]) -> 'ImageTable':
+        '''Create table from chunks of rows of image id, path, creation
+           and modification date (as nanoseconds since the epoch or
+           `None`), md5 hash, dhash and active flag, e.g. as returned by
+           `fetchmany` of a database cursor. Only one chunk of rows is
+           converted at a time.
+        '''
+        folder_index = {}  # type: Dict[str, int]
+        columns = [[] for _ in range(7)]  # type: List[List[np.ndarray]]
+        names = []  # type: List[str]
+        for rows in chunks:
+            row_ids, paths, row_created_at, row_modified_at, md5s, dhashes, \
+                row_active = zip(*rows)
+            row_folder_ids = []  # type: List[int]
+            for path in paths:
+                folder, name = _split_path(path)
+                row_folder_ids.append(folder_index.setdefault(
+                    sys.intern(folder), len(folder_index)))
+                names.append(name)
+            chunk = [
+                np.array(row_ids, dtype=np.int64),
+                np.array(row_folder_ids, dtype=np.uint32),
+                _to_datetime64(row_created_at),
+                _to_datetime64(row_modified_at),
+                np.frombuffer(b''.join(md5s), dtype=np.uint8),
+                np.frombuffer(b''.join(dhashes), dtype=np.uint8),
+                np.array(row_active, dtype=bool)]  # type: List[np.ndarray]
+            for column, values in zip(columns, chunk):
+                column.append(values)
+        dtypes = (np.int64, np.uint32, _TIME_UNIT, _TIME_UNIT, np.uint8,
+                  np.uint8, bool)  # type: Tuple[np.typing.DTypeLike, ...]
+        image_ids, folder_ids, created_at, modified_at, md5, dhash, active = \
+            (np.concatenate(column) if column else np.array([], dtype)
+             for column, dtype in zip(columns, dtypes))
+        return cls(image_ids, list(folder_index), folder_ids, names,
+                   created_at, modified_at,
+                   md5.reshape(-1, HASH_BYTES), dhash.reshape(-1, HASH_BYTES),
+                   active)
+
+    def __len__(self) -> int:
+        return len(self.image_ids)
+
+    def path(self, i: int) -> str:
+        '''Path (relative to source) of image `i`.'''
+        folder = self.folders[self.folder_ids[i]]
+        return folder + '/' + self.names[i] if folder else self.names[i]
+
+    def paths(self) -> Iterator[str]:
+        '''Paths (relative to source) of all images.'''
+        for i in range(len(self)):
+            yield self.path(i)
+
+    def in_folder(self, folder: str) -> np.ndarray:
+        '''Indexes of all images directly contained in `folder`
+           (relative to source, '' for the source itself).
+        '''
+        try:
+            folder_id = self.folders.index(folder)
+        except ValueError:
+            return np.array([], dtype=np.intp)
+        return np.flatnonzero(self.folder_ids == folder_id)
+
+    def descriptor(self, i: int) -> ImageDescriptor:
+        '''`ImageDescriptor` of image `i`.'''
+        modified_at = _to_datetime(self.modified_at[i])
+        assert modified_at is not None, \
+            'Modification date of image {} may not be NaT'.format(i)
+        return ImageDescriptor(int(self.image_ids[i]),
+                               Path(self.path(i)),
+                               _to_datetime(self.created_at[i]),
+                               modified_at,
+                               self.md5[i].tobytes(),
+                               self.dhash[i].tobytes(),
+                               bool(self.active[i]))
+
+    def __iter__(self) -> Iterator[ImageDescriptor]:
+        for i in range(len(self)):
+            yield self.descriptor(i)
@@ -1,15 +1,17 @@
 # -*- coding: utf-8 -*-
 
 from pathlib import Path
+from typing import Union
 
 import click
 
 from .image import open_image_and_rotate
 from .descriptor import ImageDescriptor
-from .db import KnipseDB, THUMBNAIL_SIZES
+from .db import KnipseDB, BatchWriter, THUMBNAIL_SIZES
 
 
-def update_thumbnails(db: KnipseDB, base_folder: Path, descr: ImageDescriptor):
+def update_thumbnails(db: Union[KnipseDB, BatchWriter], base_folder: Path,
+                      descr: ImageDescriptor):
     img_path = base_folder / descr.path
     for size in THUMBNAIL_SIZES:
         thumb = open_image_and_rotate(img_path)
@@ -19,8 +21,9 @@ def update_thumbnails(db: KnipseDB, base_folder: Path, descr: ImageDescriptor):
 
 def update_all_thumbnails(db: KnipseDB, base_folder: Path):
     images = list(db.load_all_images())
-    for descr in images:
-        update_thumbnails(db, base_folder, descr)
+    with db.batch() as batch:
+        for descr in images:
+            update_thumbnails(batch, base_folder, descr)
 
 
 @click.command(name='update-thumbnails')
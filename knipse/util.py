@@ -13,6 +13,13 @@ def get_modification_time(path: Path) -> datetime:
     return datetime.fromtimestamp(os.path.getmtime(str(path)))
 
 
+def modification_time_from_stat(stat: os.stat_result) -> datetime:
+    '''Modification time of a `stat` result, e.g. of a cached
+       `os.DirEntry.stat()`, consistent with `get_modification_time`.
+    '''
+    return datetime.fromtimestamp(stat.st_mtime)
+
+
 def getattr_multiple(field, *obj):
     for o in obj:
         v = getattr(o, field, None)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import os
 from pathlib import Path
 from datetime import datetime
 import logging
@@ -7,7 +8,8 @@ from typing import List, Callable, Optional, Iterable, Tuple  # noqa: 401
 
 from PIL import Image
 
-from .util import get_modification_time
+from .util import get_modification_time, modification_time_from_stat
+from .stats import ScanStats, NO_STATS
 
 
 logger = logging.getLogger(__name__)
@@ -15,36 +17,71 @@ logger = logging.getLogger(__name__)
 
 _files_to_folders_heuristic = 0.1
 
+# stack of levels of folders remaining to be walked
+# with the progress range covered by each folder
+FolderTree = List[List[Tuple[Path, float, float]]]
+
 
 def walk_images(base_folder: Path,
                 filter: Optional[Callable[[Path, Path, datetime], bool]]
                 = None,
-                skip_thumbnail_folders: bool = True) \
-        -> Iterable[Tuple[Path, Image.Image, float]]:
+                skip_thumbnail_folders: bool = True,
+                open_images: bool = True,
+                folder_filter: Optional[Callable[[Path, Path, datetime, int],
+                                                 bool]] = None,
+                folder_tree: Optional[FolderTree] = None,
+                checkpoint: Optional[Callable[[FolderTree], None]] = None,
+                stats: ScanStats = NO_STATS) \
+        -> Iterable[Tuple[Path, Optional[Image.Image], float]]:
     '''Walk all folders below `base_folder` and yield contained images.
        The `filter` function can be used to skip images, it should return
        `True` for unknown images (which should be walked) and `False` for
        known images (which should be ignored).
+       If `open_images` is `False`, files are not opened and `None` is
+       yielded instead of an image, leaving decoding to the caller.
+       The `folder_filter` function receives each folder with its
+       modification time and number of entries, it should return `False`
+       for unchanged folders whose files should be skipped (sub folders
+       are walked nevertheless).
+       The walk can be resumed from a `folder_tree` state that was passed
+       to the `checkpoint` function after the files of a folder were walked.
+       Time spent listing folders, reading modification times and
+       filtering files is recorded in `stats`.
     '''
-    folder_tree = [[(Path(base_folder).resolve(), 0.0, 1.0)]]
+    if folder_tree is None:
+        folder_tree = [[(Path(base_folder).resolve(), 0.0, 1.0)]]
+    else:
+        folder_tree = [list(level) for level in folder_tree]
     while folder_tree:
         level = folder_tree.pop()
         folder, lower, higher = level.pop()
-        files = []
+        files = []  # type: List[os.DirEntry]
         sub_folders = []  # type: List[Path]
-        for entry in folder.iterdir():
-            if entry.is_file():
-                files.append(entry)
-            elif entry.is_dir():
-                if not skip_thumbnail_folders or \
-                   'thumbnail' not in str(entry).lower():
-                    sub_folders.append(entry)
-            elif entry.is_symlink():
-                pass
-            else:
-                raise Exception('Unexpected folder entry {}'.format(entry))
+        # stat the folder before listing it, such that entries added
+        # during the walk change the modification time seen next time
+        folder_mtime = None
+        if folder_filter:
+            with stats.timer('stat'):
+                folder_mtime = get_modification_time(folder)
+        n_entries = 0
+        # entry types are taken from the directory listing (no stat calls
+        # except for symlinks, which need to be followed)
+        with stats.timer('list'):
+            for entry in os.scandir(str(folder)):
+                n_entries += 1
+                if entry.is_file():
+                    files.append(entry)
+                elif entry.is_dir():
+                    if not skip_thumbnail_folders or \
+                       'thumbnail' not in entry.path.lower():
+                        sub_folders.append(Path(entry.path))
+                elif entry.is_symlink():
+                    pass
+                else:
+                    raise Exception('Unexpected folder entry {}'
+                                    .format(entry.path))
         # sort files and sub_folders for lexically ordered walking
-        files.sort()
+        files.sort(key=lambda entry: entry.name)
         sub_folders.sort()
         n_sub_folders = len(sub_folders)
         file_ratio = _files_to_folders_heuristic \
@@ -54,16 +91,28 @@ def walk_images(base_folder: Path,
             files_increase = 0
         local_higher = lower + files_increase
         local_progress = 0.0
-        for file_path in files:
+        # the modification time is known iff there is a folder filter
+        if folder_filter is not None and folder_mtime is not None \
+                and not folder_filter(base_folder, folder,
+                                      folder_mtime, n_entries):
+            logger.debug('Skip files of unchanged folder {}'.format(folder))
+            files = []
+        for entry in files:
             local_progress += 1 / len(files)
             try:
                 progress = lower + (local_higher - lower) * local_progress
-                if file_path.is_symlink():
+                if entry.is_symlink():
                     continue
-                mtime = get_modification_time(file_path)
-                if not filter or filter(base_folder, file_path, mtime):
+                file_path = Path(entry.path)
+                # stat result is cached by the directory entry
+                with stats.timer('stat'):
+                    mtime = modification_time_from_stat(entry.stat())
+                with stats.timer('filter'):
+                    unfiltered = not filter \
+                        or filter(base_folder, file_path, mtime)
+                if unfiltered:
                     logger.debug('Walk unfiltered image {}'.format(file_path))
-                    img = Image.open(file_path)
+                    img = Image.open(file_path) if open_images else None
                     yield file_path, img, progress
                 else:
                     logger.debug('Filtered out image {}'.format(file_path))
@@ -81,3 +130,5 @@ def walk_images(base_folder: Path,
                             for i, folder in enumerate(sub_folders)]
             folder_progr.reverse()  # by popping the list we walk backwards
             folder_tree.append(folder_progr)
+        if checkpoint:
+            checkpoint([list(level) for level in folder_tree])
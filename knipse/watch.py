@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+'''Incremental indexing of images based on Linux inotify events'''
+
+import os
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
+import time
+import logging
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Iterable, Optional  # noqa: 401
+
+import click
+
+from .db import KnipseDB, BaseImageRecognizer
+from .image import describe_image
+from .scan import scan_images, reconcile_images
+from .util import get_modification_time
+
+
+logger = logging.getLogger(__name__)
+
+
+class _IN:
+    '''Event flags of inotify(7)'''
+    CLOSE_WRITE = 0x00000008
+    MOVED_FROM = 0x00000040
+    MOVED_TO = 0x00000080
+    CREATE = 0x00000100
+    DELETE = 0x00000200
+    Q_OVERFLOW = 0x00004000
+    IGNORED = 0x00008000
+    ONLYDIR = 0x01000000
+    ISDIR = 0x40000000
+
+
+_WATCH_MASK = _IN.CLOSE_WRITE | _IN.MOVED_FROM | _IN.MOVED_TO \
+    | _IN.CREATE | _IN.DELETE | _IN.ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    '''Minimal ctypes binding to the inotify API of the Linux kernel.'''
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno('inotify_init1')
+
+    def __enter__(self) -> 'Inotify':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _raise_errno(function: str, path: Optional[Path] = None) -> None:
+        err = ctypes.get_errno()
+        raise OSError(err, '{} failed: {}'.format(function, os.strerror(err)),
+                      str(path) if path else None)
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        '''Watch `path` for events in `mask`, returns the watch descriptor.'''
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)),
+                                          ctypes.c_uint32(mask))
+        if wd < 0:
+            self._raise_errno('inotify_add_watch', path)
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        '''Stop watching watch descriptor `wd`.'''
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: Optional[float] = None) \
+            -> List[Tuple[int, int, str]]:
+        '''Wait up to `timeout` seconds (forever if `None`) for events,
+           returns list of watch descriptor, event mask and name.
+        '''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class ImageWatcher:
+    '''Watches all folders below `base_folder` and collects paths
+       of created, modified, moved and deleted files.
+    '''
+
+    def __init__(self, base_folder: Path,
+                 skip_thumbnail_folders: bool = True) -> None:
+        self.base_folder = Path(base_folder).resolve()
+        self.skip_thumbnail_folders = skip_thumbnail_folders
+        self.inotify = Inotify()
+        self.watches = {}  # type: Dict[int, Path]
+        self.overflowed = False
+        self._watch_tree(self.base_folder)
+
+    def __enter__(self) -> 'ImageWatcher':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.inotify.close()
+
+    def _is_skipped(self, folder: Path) -> bool:
+        return self.skip_thumbnail_folders \
+            and 'thumbnail' in str(folder).lower()
+
+    def _watch_tree(self, folder: Path) -> List[Path]:
+        '''Watch `folder` and all its sub folders,
+           returns all files contained.
+        '''
+        files = []
+        folders = [folder]
+        while folders:
+            folder = folders.pop()
+            if self._is_skipped(folder):
+                continue
+            try:
+                wd = self.inotify.add_watch(folder, _WATCH_MASK)
+                self.watches[wd] = folder
+                for entry in os.scandir(str(folder)):
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(Path(entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(Path(entry.path))
+            except FileNotFoundError:
+                pass  # folder was removed in the meantime
+        return files
+
+    def _unwatch_tree(self, folder: Path) -> None:
+        for wd, path in list(self.watches.items()):
+            if path == folder or folder in path.parents:
+                self.inotify.remove_watch(wd)
+                del self.watches[wd]
+
+    def _handle(self, events: Iterable[Tuple[int, int, str]],
+                changed: Set[Path], removed: Set[Path],
+                removed_folders: Set[Path]) -> None:
+        for wd, mask, name in events:
+            if mask & _IN.Q_OVERFLOW:
+                logger.warning('Lost inotify events due to queue overflow')
+                self.overflowed = True
+                continue
+            if mask & _IN.IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue  # event of a watch removed in the meantime
+            path = self.watches[wd] / name
+            if mask & _IN.ISDIR:
+                if mask & (_IN.CREATE | _IN.MOVED_TO):
+                    files = self._watch_tree(path)
+                    changed.update(files)
+                    removed.difference_update(files)
+                    removed_folders.discard(path)
+                elif mask & (_IN.DELETE | _IN.MOVED_FROM):
+                    self._unwatch_tree(path)
+                    removed_folders.add(path)
+            elif mask & (_IN.CLOSE_WRITE | _IN.MOVED_TO):
+                changed.add(path)
+                removed.discard(path)
+            elif mask & (_IN.DELETE | _IN.MOVED_FROM):
+                removed.add(path)
+                changed.discard(path)
+
+    def poll(self, timeout: Optional[float] = None,
+             debounce: float = 1.0,
+             max_delay: float = 10.0) \
+            -> Tuple[Set[Path], Set[Path], Set[Path]]:
+        '''Wait up to `timeout` seconds for file events, then collect
+           further events until none arrived for `debounce` seconds (or
+           `max_delay` seconds passed). Returns changed and removed files
+           as well as removed folders.
+        '''
+        changed = set()  # type: Set[Path]
+        removed = set()  # type: Set[Path]
+        removed_folders = set()  # type: Set[Path]
+        events = self.inotify.read_events(timeout)
+        start = time.monotonic()
+        while events:
+            self._handle(events, changed, removed, removed_folders)
+            if time.monotonic() - start >= max_delay:
+                break
+            events = self.inotify.read_events(debounce)
+        return changed, removed, removed_folders
+
+
+def apply_changes(db: KnipseDB, recgn: BaseImageRecognizer,
+                  base_folder: Path, changed: Iterable[Path],
+                  removed: Iterable[Path],
+                  removed_folders: Iterable[Path] = ()) \
+        -> Iterable[Tuple[str, Path]]:
+    '''Store `changed` images (detecting moves by md5 hash) and deactivate
+       `removed` images as well as all images in `removed_folders`.
+       `recgn` (which must support `add` and `remove`) is updated
+       accordingly.
+       Yields action and path of affected images.
+    '''
+    base_folder = Path(base_folder).resolve()
+    actions = []  # type: List[Tuple[str, Path]]
+    with db.batch(on_insert=recgn.add) as batch:
+        for path in sorted(changed):
+            if path.is_symlink() or not path.is_file():
+                continue
+            if not recgn.filter(base_folder, path,
+                                get_modification_time(path)):
+                continue
+            descr = describe_image(base_folder, path)
+            if descr is None:
+                continue
+            looked_up_by_md5 = recgn.by_md5(descr.md5)
+            if looked_up_by_md5:  # image was moved
+                descr.image_id = looked_up_by_md5.image_id
+                batch.store_image(descr)
+                recgn.add(descr)
+                actions.append(('Moved', descr.path))
+            else:  # new image
+                batch.store_image(descr)
+                actions.append(('Added', descr.path))
+    deactivated = []
+    for path in sorted(removed):
+        known = recgn.by_path(base_folder, path)
+        if known is not None and not path.exists():
+            deactivated.append(known)
+    prefixes = tuple(str(folder.relative_to(base_folder)) + os.sep
+                     for folder in removed_folders if not folder.exists())
+    if prefixes:
+        known_paths = [known_path for _, known_path in db.load_image_paths()
+                       if known_path.startswith(prefixes)]
+        for known_path in known_paths:
+            known = recgn.by_path(base_folder, base_folder / known_path)
+            if known is not None:
+                deactivated.append(known)
+    db.deactivate_images([descr.image_id for descr in deactivated
+                          if descr.image_id is not None])
+    for descr in deactivated:
+        recgn.remove(descr)
+        actions.append(('Deactivated', descr.path))
+    yield from actions
+
+
+def rescan_images(db: KnipseDB, base_folder: Path,
+                  skip_thumbnail_folders: bool = True) \
+        -> Iterable[Tuple[str, Path]]:
+    '''Scan all images below `base_folder` again (e.g. after file events
+       were missed), storing new, moved and modified images and
+       deactivating images that do not exist anymore.
+       Yields action and path of deactivated images.
+    '''
+    seen = set()  # type: Set[str]
+    for _ in scan_images(db, base_folder, skip_thumbnail_folders, seen=seen):
+        pass
+    for path in reconcile_images(db, seen):
+        yield 'Deactivated', path
+
+
+@click.command(name='watch')
+@click.option('-t', '--skip-thumbnails/--no-skip-thumbnails', default=True,
+              show_default=True,
+              help='Skips all folders containing the word "thumbnail".')
+@click.option('-w', '--debounce', type=click.FloatRange(min=0), default=1.0,
+              show_default=True,
+              help='Seconds without file events before changes are stored.')
+@click.pass_context
+def cli_watch(ctx, skip_thumbnails, debounce):
+    '''Watch all folders below global knipse `source` and store new,
+       moved and deleted images in database as they change.
+    '''
+    db = ctx.obj['database']
+    base_folder = ctx.obj['source']
+    try:
+        watcher = ImageWatcher(base_folder, skip_thumbnails)
+    except OSError as e:
+        raise click.ClickException('Cannot watch {}: {}'
+                                   .format(base_folder, e))
+    with watcher:
+        click.echo('Watching images in {}...'.format(base_folder))
+        recgn = db.get_recognizer(mapped=False)
+        while True:
+            changed, removed, removed_folders = watcher.poll(None, debounce)
+            if watcher.overflowed:
+                click.echo('Missed file events, scanning {}...'
+                           .format(base_folder))
+                for action, path in rescan_images(db, base_folder,
+                                                  skip_thumbnails):
+                    click.echo('{} {}'.format(action, path))
+                watcher.overflowed = False
+                recgn = db.get_recognizer(mapped=False)
+            for action, path in apply_changes(db, recgn, base_folder,
+                                              changed, removed,
+                                              removed_folders):
+                click.echo('{} {}'.format(action, path))
@@ -11,7 +11,8 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['Click>=6.0', 'Pillow>=5.0', 'kivy>=1.11']
+requirements = ['Click>=6.0', 'Pillow>=5.0', 'numpy>=1.13',
+                'kivy>=1.11']
 
 setup_requirements = []
 
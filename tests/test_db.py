@@ -1,17 +1,32 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import copy
 from pathlib import Path
 from datetime import datetime
 import re
+import sqlite3
+import shutil
+import tempfile
+from typing import List
 
-from knipse.db import KnipseDB, ImageRecognizer, _INSERT_IMAGE, _DT_FMT
+from PIL import Image
+
+from knipse.db import KnipseDB, ImageRecognizer, LazyImageRecognizer, \
+    _INSERT_IMAGE, _DT_FMT, _GET_IMAGES_IN_LIST, _GET_IMAGES_BY_PATH, \
+    _GET_IMAGES_BY_MD5, _GET_INACTIVE_IMAGE_IDS, \
+    _GET_KNOWN_IMAGES_IN_FOLDER, _GET_KNOWN_IMAGES_BY_DHASH, \
+    _GET_IMAGES_IN_FOLDER, _GET_SUBFOLDERS, _GET_LIST_END, \
+    _GET_PREVIOUS_POSITION, _GET_NEXT_POSITION, _GET_ENTRIES_UP_TO, \
+    _GET_ENTRIES_FROM, SCHEMA_VERSION
 from knipse.descriptor import ImageDescriptor, ListDescriptor, \
-                              ListEntryDescriptor
+                              ListEntryDescriptor, ScanSessionDescriptor, \
+                              FolderDescriptor
 from knipse.image import descriptor_from_image
 from knipse.walk import walk_images
-from knipse.scan import scan_images, purge_images
+from knipse.scan import scan_images, purge_images, reconcile_images
 from knipse.thumbnail import update_all_thumbnails
+from knipse.stats import ScanStats
 
 from .test_walk import EXPECTED_IMAGES
 
@@ -26,6 +41,40 @@ def store_images(db, base_folder: Path) -> None:
         db.store_image(descr)
 
 
+def stored_folder(db: KnipseDB, folder: Path) -> FolderDescriptor:
+    '''Load `folder`, which must be stored in database.'''
+    descr = db.load_folder(folder)
+    assert isinstance(descr, FolderDescriptor)
+    return descr
+
+
+def unstored_copy(descr: ImageDescriptor) -> ImageDescriptor:
+    '''Copy of `descr` without `image_id`, stored as a new image.'''
+    new = copy.copy(descr)
+    new.image_id = None
+    return new
+
+
+def _create_legacy_db(db_path: str, image_rows: list,
+                      folder_scan_rows: list = []) -> None:
+    '''Create a database with the schema before schema versions
+       containing rows of images and scanned folders.
+    '''
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute('''CREATE TABLE images (path text,
+                        created_at timestamp, modified_at timestamp,
+                        md5 blob, dhash blob, active bool);''')
+        conn.execute('''CREATE TABLE folder_scans (path text,
+                        modified_at timestamp, entries int,
+                        UNIQUE (path));''')
+        conn.executemany('INSERT INTO images VALUES (?, ?, ?, ?, ?, ?);',
+                         image_rows)
+        conn.executemany('INSERT INTO folder_scans VALUES (?, ?, ?);',
+                         folder_scan_rows)
+    conn.close()
+
+
 class TestKnipseDatabase(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -56,6 +105,165 @@ class TestKnipseDatabase(unittest.TestCase):
         self.assertIn('lists', tables)
         self.assertIn('list_entries', tables)
 
+    def test_schema_migration(self) -> None:
+        '''Migrate a database created without schema version
+           and check if indexes have been created.'''
+        self.assertEqual(SCHEMA_VERSION, self.db.schema_version())
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / 'knipse.sqlite')
+            descr = self.example_descriptor
+            _create_legacy_db(db_path, [(
+                str(descr.path), None, descr.modified_at.strftime(_DT_FMT),
+                descr.md5, descr.dhash, 1)])
+            db = KnipseDB(db_path)
+            self.assertEqual(SCHEMA_VERSION, db.schema_version())
+            with db.db as conn:
+                indexes = set(row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index';"))
+            self.assertLessEqual({'images_path', 'images_md5',
+                                  'images_inactive', 'images_dhash',
+                                  'images_folder_name', 'folders_parent_name',
+                                  'list_entries_list_position'}, indexes)
+            self.assertEqual([descr.with_id(1)],
+                             list(db.load_all_images()))
+            # opening again does not migrate again
+            db.close()
+            db = KnipseDB(db_path)
+            with db.db as conn:
+                self.assertEqual(SCHEMA_VERSION, conn.execute(
+                    'SELECT COUNT(*) FROM schema_version;').fetchone()[0])
+            db.close()
+
+    def test_timestamp_migration(self) -> None:
+        '''Convert timestamps stored as strings before
+           schema version 3 to nanoseconds.'''
+        dates = [datetime(2019, 1, 1, 11, 11, 11, 123456),
+                 datetime(1969, 12, 31, 23, 59, 59, 500000),
+                 datetime(2020, 2, 29)]
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / 'knipse.sqlite')
+            _create_legacy_db(
+                db_path,
+                [('img{}.jpg'.format(i), dt.strftime(_DT_FMT) if i else None,
+                  dt.strftime(_DT_FMT), bytes(16), bytes(16), 1)
+                 for i, dt in enumerate(dates)],
+                [('.', dates[0].strftime(_DT_FMT), 3)])
+            db = KnipseDB(db_path)
+            self.assertEqual(SCHEMA_VERSION, db.schema_version())
+            descrs = list(db.load_all_images())
+            self.assertEqual(dates, [descr.modified_at for descr in descrs])
+            self.assertEqual([None] + dates[1:],
+                             [descr.created_at for descr in descrs])
+            self.assertEqual([(Path('.'), dates[0], 3)],
+                             list(db.load_folder_scans()))
+            with db.db as conn:
+                self.assertEqual(1546341071123456000, conn.execute(
+                    'SELECT modified_at FROM images WHERE rowid = 1;'
+                ).fetchone()[0])
+            db.close()
+
+    def test_folder_migration(self) -> None:
+        '''Create folders (and their ancestors) of images stored
+           before schema version 4.'''
+        dt = datetime(2019, 1, 1).strftime(_DT_FMT)
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / 'knipse.sqlite')
+            _create_legacy_db(db_path, [
+                (path, None, dt, bytes([i]) * 16, bytes(16), active)
+                for i, (path, active) in enumerate([
+                    ('a.jpg', 1), ('x/y/z/b.jpg', 1), ('x/y/z/c.jpg', 0),
+                    ('x/d.jpg', 1), ('x/w/e.jpg', 1)])])
+            db = KnipseDB(db_path)
+            self.assertEqual([(Path('x'), 1)],
+                             [(folder.path, folder.image_count)
+                              for folder in db.load_subfolders(Path('.'))])
+            self.assertEqual([(Path('x/w'), 1), (Path('x/y'), 0)],
+                             [(folder.path, folder.image_count)
+                              for folder in db.load_subfolders(Path('x'))])
+            folder = stored_folder(db, Path('x/y/z'))
+            self.assertEqual(1, folder.image_count)
+            self.assertEqual(stored_folder(db, Path('x/y')).folder_id,
+                             folder.parent_id)
+            self.assertIsNone(stored_folder(db, Path('.')).parent_id)
+            self.assertEqual(['x/y/z/b.jpg'],
+                             [str(descr.path) for descr in
+                              db.load_images_in_folder(Path('x/y/z'))])
+            with db.db as conn:
+                self.assertEqual([('a.jpg',), ('b.jpg',), ('c.jpg',),
+                                  ('d.jpg',), ('e.jpg',)], conn.execute(
+                    'SELECT name FROM images ORDER BY rowid;').fetchall())
+            db.close()
+
+    def test_newer_schema_version(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / 'knipse.sqlite')
+            db = KnipseDB(db_path)
+            with db.db as conn:
+                conn.execute('INSERT INTO schema_version VALUES (?);',
+                             (SCHEMA_VERSION + 1,))
+            db.db.close()
+            with self.assertRaises(Exception):
+                KnipseDB(db_path)
+
+    def _query_plan(self, query: str, args: tuple) -> str:
+        with self.db.db as conn:
+            return '\n'.join(row[-1] for row in conn.execute(
+                'EXPLAIN QUERY PLAN ' + query, args))
+
+    def test_query_plans_use_indexes(self) -> None:
+        plan = self._query_plan(_GET_IMAGES_BY_PATH, ('photo01.jpg',))
+        self.assertIn('USING INDEX images_path', plan)
+        plan = self._query_plan(_GET_IMAGES_BY_MD5, (bytes(16),))
+        self.assertIn('USING INDEX images_md5', plan)
+        plan = self._query_plan(_GET_KNOWN_IMAGES_IN_FOLDER, ('folder1/', 1))
+        self.assertIn('USING INDEX images_folder_name', plan)
+        plan = self._query_plan(_GET_IMAGES_IN_FOLDER, ('folder1/',))
+        self.assertIn('USING INDEX images_folder_name', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        plan = self._query_plan(_GET_SUBFOLDERS, ('folder1/',))
+        self.assertIn('USING INDEX folders_parent_name', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        plan = self._query_plan(_GET_KNOWN_IMAGES_BY_DHASH, (bytes(16), 1))
+        self.assertIn('USING INDEX images_dhash', plan)
+        plan = self._query_plan(_GET_INACTIVE_IMAGE_IDS, ())
+        self.assertIn('USING COVERING INDEX images_inactive', plan)
+        plan = self._query_plan(_GET_IMAGES_IN_LIST, (1,))
+        self.assertIn('USING INDEX list_entries_list_position', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        plan = self._query_plan(_GET_LIST_END, (1,))
+        self.assertIn('USING COVERING INDEX list_entries_list_position', plan)
+        for query, args in ((_GET_PREVIOUS_POSITION, (1, 1.0, 1)),
+                            (_GET_NEXT_POSITION, (1, 1.0, 1)),
+                            (_GET_ENTRIES_UP_TO, (1, 1.0, 1, 16)),
+                            (_GET_ENTRIES_FROM, (1, 1.0, 1, 16))):
+            plan = self._query_plan(query, args)
+            self.assertIn('USING COVERING INDEX list_entries_list_position',
+                          plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_reads_keep_write_transaction(self) -> None:
+        '''Reads of in-memory databases use the writer connection without
+           committing its transaction in progress.'''
+        descr = self.db.store_image(self.example_descriptor)
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.db as conn:
+                conn.execute('UPDATE images SET active = 0;')
+                self.assertEqual([descr.image_id],
+                                 self.db.load_inactive_image_ids())
+                1 / 0
+        self.assertEqual([], self.db.load_inactive_image_ids())
+
+    def test_lookups_by_path_and_md5(self) -> None:
+        descr = self.db.store_image(self.example_descriptor)
+        self.assertEqual(descr, self.db.load_image_by_path(descr.path))
+        self.assertIsNone(self.db.load_image_by_path(Path('unknown.jpg')))
+        self.assertEqual([descr], self.db.load_images_by_md5(descr.md5))
+        self.assertEqual([], self.db.load_inactive_image_ids())
+        assert isinstance(descr.image_id, int)
+        self.db.deactivate_images([descr.image_id])
+        self.assertIsNone(self.db.load_image_by_path(descr.path))
+        self.assertEqual([descr.image_id], self.db.load_inactive_image_ids())
+
     def test_storing_image_descriptors(self) -> None:
         '''Store images in database and check their count.'''
         store_images(self.db, self.src)
@@ -87,7 +295,7 @@ class TestKnipseDatabase(unittest.TestCase):
         row_length = re.compile('.*row length.*', re.IGNORECASE)
         with self.assertRaisesRegex(AssertionError, row_length):
             self.db.descriptor_from_row(())
-        dt = datetime.strftime(self.example_descriptor.modified_at, _DT_FMT)
+        dt = 1546341071000000000  # 2019-01-01 11:11:11
         img_id = re.compile('.*image id.*', re.IGNORECASE)
         with self.assertRaisesRegex(AssertionError, img_id):
             row = (None, '/', None, dt, b'0'*16, b'0'*16, 1)  # type: tuple
@@ -103,13 +311,17 @@ class TestKnipseDatabase(unittest.TestCase):
         with self.assertRaisesRegex(AssertionError, mod_date):
             row = (0, '/', None, None, b'0'*16, b'0'*16, 1)
             self.db.descriptor_from_row(row)
-        bad_format = re.compile('.*not match format.*', re.IGNORECASE)
-        with self.assertRaisesRegex(ValueError, bad_format):
+        with self.assertRaisesRegex(AssertionError, mod_date):
             row = (0, '/', None, 'bad date', b'0'*16, b'0'*16, 1)
             self.db.descriptor_from_row(row)
-        with self.assertRaisesRegex(ValueError, bad_format):
+        creation_date = re.compile('.*creation date.*', re.IGNORECASE)
+        with self.assertRaisesRegex(AssertionError, creation_date):
             row = (0, '/', 'bad date', dt, b'0'*16, b'0'*16, 1)
             self.db.descriptor_from_row(row)
+        self.assertEqual(datetime(2019, 1, 1, 11, 11, 11),
+                         self.db.descriptor_from_row(
+                             (0, '/', None, dt, b'0'*16, b'0'*16, 1))
+                         .modified_at)
         md5 = re.compile('.*md5.*', re.IGNORECASE)
         with self.assertRaisesRegex(AssertionError, md5):
             row = (0, '/', None, dt, None, b'0'*16, 1)
@@ -149,6 +361,28 @@ class TestKnipseDatabase(unittest.TestCase):
         self.db.store_image(retrieved_descr)  # should only update, not insert
         self.assertEqual(1, len(list(self.db.load_all_images())))
 
+    def test_batch_writer(self) -> None:
+        '''Store images with a batch writer and test that rows are
+           written every `commit_interval` rows and on exit.'''
+        def _count():
+            with self.db.db as conn:
+                return conn.execute('SELECT count(*) FROM images;') \
+                           .fetchone()[0]
+        with self.db.batch(commit_interval=3) as batch:
+            batch.store_image(self.example_descriptor)
+            batch.store_image(self.example_descriptor)
+            self.assertEqual(0, _count())
+            batch.store_image(self.example_descriptor)
+            self.assertEqual(3, _count())
+            batch.store_image(self.example_descriptor)
+        self.assertEqual(4, _count())
+        images = list(self.db.load_all_images())
+        for descr in images:
+            descr.active = False
+        self.db.store_images(images, commit_interval=3)
+        self.assertEqual(4, _count())
+        self.assertEqual(0, len(list(self.db.load_all_images())))
+
     def test_walking_known_images_in_db(self) -> None:
         '''Walk a folder structure, store all images, then
            walk again and test they are all known.'''
@@ -187,6 +421,78 @@ class TestKnipseDatabase(unittest.TestCase):
                                                skip_thumbnail_folders=True):
             raise Exception('should not happen')
 
+    def test_parallel_scan(self) -> None:
+        '''Scan a folder structure with multiple processes and test
+           if images and progress are yielded as in a sequential scan.'''
+        sequential = list(scan_images(self.db, self.src,
+                                      skip_thumbnail_folders=True))
+        parallel_db = KnipseDB(':memory:')
+        parallel = list(scan_images(parallel_db, self.src,
+                                    skip_thumbnail_folders=True, jobs=2))
+        self.assertEqual(len(EXPECTED_IMAGES), len(parallel))
+        self.assertEqual(sequential, parallel)
+        self.assertEqual(list(self.db.load_all_images()),
+                         list(parallel_db.load_all_images()))
+
+    def test_scan_stats(self) -> None:
+        '''Scan a folder structure sequentially and in parallel
+           and test if time is recorded for all stages.'''
+        for jobs in (1, 2):
+            stats = ScanStats()
+            db = KnipseDB(':memory:')
+            cnt = len(list(scan_images(db, self.src, jobs=jobs,
+                                       stats=stats)))
+            self.assertEqual(len(EXPECTED_IMAGES), cnt)
+            for stage in ('list', 'read', 'open', 'md5', 'load', 'dhash',
+                          'commit'):
+                self.assertGreater(stats.calls[stage], 0, stage)
+            self.assertEqual(cnt, stats.calls['dhash'])
+            self.assertGreater(stats.bytes['read'], 0)
+            report = stats.as_dict()
+            self.assertEqual(stats.calls['read'], report['read']['calls'])
+            self.assertIn('dhash', stats.summary())
+
+    def test_scan_skipping_unchanged_folders(self) -> None:
+        '''Scan a folder structure, add an image to one folder and
+           scan again skipping unchanged folders.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            src = Path(tmp) / 'various'
+            shutil.copytree(str(self.src), str(src), symlinks=True)
+            cnt = len(list(scan_images(self.db, src)))
+            self.assertEqual(len(EXPECTED_IMAGES), cnt)
+            folders = set(str(path)
+                          for path, _, _ in self.db.load_folder_scans())
+            self.assertEqual({'.', 'folder1', 'folder2', 'folder2/folder3',
+                              'folder2/folder4'}, folders)
+            self.assertEqual([], list(scan_images(
+                self.db, src, skip_unchanged_folders=True)))
+            new_image = src / 'folder2' / 'folder3' / 'img_new.jpg'
+            Image.new('RGB', (30, 20), 'red').save(str(new_image))
+            new_images = [file_path for file_path, progress in
+                          scan_images(self.db, src,
+                                      skip_unchanged_folders=True)]
+            self.assertEqual([new_image], new_images)
+
+    def test_interrupted_and_resumed_scan(self) -> None:
+        '''Interrupt a scan, then resume it and test if all images
+           are stored and progress continues.'''
+        scan = scan_images(self.db, self.src)
+        first = [next(scan) for _ in range(5)]
+        scan.close()
+        session = self.db.load_scan_session(self.src)
+        assert isinstance(session, ScanSessionDescriptor)
+        self.assertGreater(session.progress, 0.0)
+        self.assertLessEqual(session.progress, first[-1][1])
+        self.assertLessEqual(session.stored, 5)
+        self.assertEqual(session.stored, session.walked)
+        rest = list(scan_images(self.db, self.src, resume=True))
+        self.assertIsNone(self.db.load_scan_session(self.src))
+        # images stored after the last checkpoint are filtered as known
+        self.assertEqual(len(EXPECTED_IMAGES) - len(first), len(rest))
+        self.assertGreaterEqual(rest[0][1], session.progress)
+        self.assertEqual(len(EXPECTED_IMAGES),
+                         len(list(self.db.load_all_images())))
+
     def test_purge(self) -> None:
         '''Scan a folder structure to store images,
            then chose other folder as base and purge.'''
@@ -201,6 +507,28 @@ class TestKnipseDatabase(unittest.TestCase):
         self.assertEqual(cnt, cnt_purged)
         self.assertEqual(0, len(list(self.db.load_all_images())))
 
+    def test_scan_and_reconcile(self) -> None:
+        '''Scan a folder structure, delete and move images, then scan
+           again and deactivate images that were not seen.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            src = Path(tmp) / 'various'
+            shutil.copytree(str(self.src), str(src), symlinks=True)
+            seen = set()  # type: set
+            list(scan_images(self.db, src, seen=seen))
+            self.assertEqual([], reconcile_images(self.db, seen))
+            (src / 'folder1' / 'img_0000.jpg').unlink()
+            (src / 'folder2' / 'img_0010.jpg').rename(src / 'img_0010.jpg')
+            seen = set()
+            self.assertEqual([], list(scan_images(
+                self.db, src, skip_unchanged_folders=True, seen=seen)))
+            self.assertIn('folder2/folder3', seen)  # unchanged folder
+            self.assertEqual([Path('folder1/img_0000.jpg')],
+                             reconcile_images(self.db, seen))
+            paths = set(str(descr.path)
+                        for descr in self.db.load_all_images())
+            self.assertEqual(len(EXPECTED_IMAGES) - 1, len(paths))
+            self.assertIn('img_0010.jpg', paths)
+
     def test_scan_and_scan_subfolder_again(self) -> None:
         '''Scan a folder structure to store images,
            then scan a subfolder of it again and test if
@@ -227,6 +555,109 @@ class TestKnipseDatabase(unittest.TestCase):
         # same dhash -> removed from index
         self.assertEqual(0, len(recgn.index_dhash))
 
+    def test_folders(self) -> None:
+        '''Folders and their image counts follow stored, moved
+           and deactivated images.'''
+        list(scan_images(self.db, self.src))
+
+        def counts(folder: Path) -> dict:
+            return {str(sub.path): sub.image_count
+                    for sub in self.db.load_subfolders(folder)}
+
+        self.assertEqual({'folder1': 2, 'folder2': 1}, counts(Path('.')))
+        self.assertEqual({'folder2/folder3': 4, 'folder2/folder4': 3},
+                         counts(Path('folder2')))
+        self.assertEqual(1, stored_folder(self.db, Path('.')).image_count)
+        self.assertIsNone(self.db.load_folder(Path('unknown')))
+        self.assertEqual([], self.db.load_images_in_folder(Path('unknown')))
+        images = self.db.load_images_in_folder(Path('folder1'))
+        self.assertEqual(sorted(str(descr.path) for descr in images),
+                         [str(descr.path) for descr in images])
+        self.assertEqual(sorted(str(descr.path)
+                                for descr in self.db.load_all_images()
+                                if str(descr.path.parent) == 'folder1'),
+                         [str(descr.path) for descr in images])
+        # move an image to a new folder
+        moved = images[0]
+        moved.path = Path('folder2/new/moved.jpg')
+        self.db.store_image(moved)
+        self.assertEqual({'folder1': 1, 'folder2': 1}, counts(Path('.')))
+        self.assertEqual({'folder2/folder3': 4, 'folder2/folder4': 3,
+                          'folder2/new': 1}, counts(Path('folder2')))
+        self.assertEqual([moved],
+                         self.db.load_images_in_folder(Path('folder2/new')))
+        # deactivated images are not counted
+        assert isinstance(moved.image_id, int)
+        self.db.deactivate_images([moved.image_id])
+        self.assertEqual(0, counts(Path('folder2'))['folder2/new'])
+        self.assertEqual([], self.db.load_images_in_folder(
+            Path('folder2/new')))
+        with self.db.batch() as batch:
+            batch.store_image(unstored_copy(moved))
+        self.assertEqual(1, counts(Path('folder2'))['folder2/new'])
+
+    def test_lazy_recognizer(self) -> None:
+        '''Lookups of a `LazyImageRecognizer` equal those of an
+           `ImageRecognizer` and load each folder once.'''
+        store_images(self.db, self.src)
+        self.db.store_image(self.example_descriptor)
+        self.db.store_image(unstored_copy(self.example_descriptor))
+        recgn = self.db.get_recognizer(mapped=False)
+        lazy = self.db.get_recognizer(lazy=True)
+        assert isinstance(lazy, LazyImageRecognizer)
+        descrs = list(self.db.load_all_images())
+        for descr in descrs:
+            path = self.src / descr.path
+            self.assertEqual(recgn.by_path(self.src, path),
+                             lazy.by_path(self.src, path))
+            self.assertEqual(recgn.by_md5(descr.md5), lazy.by_md5(descr.md5))
+            self.assertEqual(recgn.by_dhash(descr.dhash),
+                             lazy.by_dhash(descr.dhash))
+            self.assertFalse(lazy.filter(self.src, path, descr.modified_at))
+        self.assertIsNone(lazy.by_dhash(self.example_descriptor.dhash))
+        self.assertTrue(lazy.filter(self.src, self.src / 'unknown.jpg',
+                                    descr.modified_at))
+        self.assertIsNone(lazy.by_md5(bytes(16)))
+        folders = set(str(descr.path.parent) for descr in descrs)
+        self.assertEqual(len(folders), len(lazy._folders))
+        # images stored later are not recognized
+        self.db.store_image(ImageDescriptor(None, Path('new/x.jpg'),
+                                            None, datetime(2020, 1, 1),
+                                            bytes(16), bytes(16), True))
+        self.assertIsNone(lazy.by_md5(bytes(16)))
+        self.assertIsNone(lazy.by_path(self.src, self.src / 'new' / 'x.jpg'))
+
+    def test_lazy_recognizer_cache_size(self) -> None:
+        store_images(self.db, self.src)
+        lazy = self.db.get_recognizer(lazy=True, cache_size=2)
+        assert isinstance(lazy, LazyImageRecognizer)
+        for descr in self.db.load_all_images():
+            self.assertEqual(descr, lazy.by_path(self.src,
+                                                 self.src / descr.path))
+            self.assertEqual(descr, lazy.by_md5(descr.md5))
+            self.assertLessEqual(len(lazy._md5s), 2)
+            self.assertLessEqual(lazy._n_cached_files,
+                                 max(2, len(lazy._folders[
+                                     next(reversed(lazy._folders))])))
+        self.assertEqual(lazy._n_cached_files,
+                         sum(map(len, lazy._folders.values())))
+
+    def test_lazy_scan(self) -> None:
+        '''Scan with a `LazyImageRecognizer`, moving an image
+           in between, then scan again.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp) / 'various'
+            shutil.copytree(str(self.src), str(base), symlinks=True)
+            self.assertEqual(len(EXPECTED_IMAGES),
+                             len(list(scan_images(self.db, base, lazy=True))))
+            shutil.move(str(base / 'img_0002.jpg'),
+                        str(base / 'folder1' / 'moved.jpg'))
+            self.assertEqual([], list(scan_images(self.db, base, lazy=True)))
+            self.assertEqual(len(EXPECTED_IMAGES),
+                             len(list(self.db.load_all_images())))
+            self.assertIsNotNone(self.db.load_image_by_path(
+                Path('folder1/moved.jpg')))
+
     def test_storing_list_descriptors(self) -> None:
         '''Store list in database and check the table count.'''
         images = [self.example_descriptor] * 3
@@ -268,6 +699,104 @@ class TestKnipseDatabase(unittest.TestCase):
             self.assertEqual(len(images) + 1, cnt)  # not increased
             self.assertEqual(11.0, descr2.position)
 
+    def test_appending_to_list(self) -> None:
+        '''Append entries to the end of a list in one transaction.'''
+        images = [self.example_descriptor] * 3
+        lst = self.db.store_list(self.example_list, images)
+        assert isinstance(lst.list_id, int)
+        self.assertEqual(2.0, self.db.load_list_end(lst.list_id))
+        self.assertEqual(2, self.db.append_to_list(lst.list_id, iter([3, 1])))
+        self.assertEqual(4.0, self.db.load_list_end(lst.list_id))
+        self.assertEqual([1, 2, 3, 3, 1],
+                         [entry.image_id for entry, _
+                          in self.db.load_list_entries(lst)])
+
+        def failing_ids():
+            yield 2
+            raise Exception('Image not found')
+        with self.assertRaises(Exception):
+            self.db.append_to_list(lst.list_id, failing_ids())
+        self.assertEqual(5, len(list(self.db.load_list_entries(lst))))
+        empty = self.db.store_list(self.example_list)
+        assert isinstance(empty.list_id, int)
+        self.assertIsNone(self.db.load_list_end(empty.list_id))
+        # positions of appended entries start at 1 like by `list append`
+        self.assertEqual(1, self.db.append_to_list(empty.list_id, [2]))
+        self.assertEqual(1.0, self.db.load_list_end(empty.list_id))
+        self.assertEqual(2, self.db.store_list_entries(
+            [ListEntryDescriptor(None, empty.list_id, 3, -1.0),
+             ListEntryDescriptor(None, empty.list_id, 1, 1.5)]))
+        self.assertEqual([(3, -1.0), (2, 1.0), (1, 1.5)],
+                         [(entry.image_id, entry.position) for entry, _
+                          in self.db.load_list_entries(empty)])
+
+    def _list_order(self, lst: ListDescriptor) -> list:
+        return [entry.image_id for entry, _
+                in self.db.load_list_entries(lst)]
+
+    def _list_entry_ids(self, lst: ListDescriptor) -> List[int]:
+        entry_ids = []  # type: List[int]
+        for entry, _ in self.db.load_list_entries(lst):
+            assert isinstance(entry.list_entry_id, int)
+            entry_ids.append(entry.list_entry_id)
+        return entry_ids
+
+    def test_reordering_list(self) -> None:
+        '''Insert and move entries between others.'''
+        images = [self.example_descriptor] * 3
+        lst = self.db.store_list(self.example_list, images)
+        first, second, third = self._list_entry_ids(lst)
+        inserted = self.db.insert_into_list([3, 2], after=first)
+        self.assertEqual([1, 3, 2, 2, 3], self._list_order(lst))
+        self.assertEqual([0.0 + 1 / 3, 0.0 + 2 / 3],
+                         [entry.position for entry in inserted])
+        self.db.insert_into_list([1], before=first)
+        self.db.insert_into_list([2], after=third)
+        self.assertEqual([1, 1, 3, 2, 2, 3, 2], self._list_order(lst))
+        moved = self.db.move_list_entry(third,
+                                        before=inserted[0].list_entry_id)
+        self.assertEqual((third, 3), (moved.list_entry_id, moved.image_id))
+        self.assertEqual([1, 1, 3, 3, 2, 2, 2], self._list_order(lst))
+        self.db.move_list_entry(first, after=second)
+        self.assertEqual([1, 3, 3, 2, 2, 1, 2], self._list_order(lst))
+        self.assertEqual(moved, self.db.move_list_entry(third, after=third))
+        other = self.db.store_list(self.example_list, images)
+        other_entry, _ = next(iter(self.db.load_list_entries(other)))
+        with self.assertRaises(Exception):
+            self.db.move_list_entry(first, before=other_entry.list_entry_id)
+        with self.assertRaises(Exception):
+            self.db.insert_into_list([1], after=1000)
+        with self.assertRaises(AssertionError):
+            self.db.insert_into_list([1])
+
+    def test_rebalancing_list(self) -> None:
+        '''Repeated insertions into the same gap exhaust the float
+           precision, then only a window around the gap is respaced:
+           the number of changed rows does not depend on the list size.
+        '''
+        for _ in range(2):
+            self.db.store_image(self.example_descriptor)
+        changes = []
+        for size in (1000, 20000):
+            lst = self.db.store_list(self.example_list)
+            assert isinstance(lst.list_id, int)
+            self.db.append_to_list(lst.list_id, [1] * size)
+            entry_ids = self._list_entry_ids(lst)
+            anchor = entry_ids[50]
+            total_changes = self.db.db.total_changes
+            for _ in range(200):
+                self.db.insert_into_list([2], after=anchor)
+            for entry_id in entry_ids[-200:]:
+                self.db.move_list_entry(entry_id, after=anchor)
+            changes.append(self.db.db.total_changes - total_changes)
+            self.assertEqual([1] * 251 + [2] * 200 + [1] * (size - 251),
+                             self._list_order(lst))
+            positions = [entry.position for entry, _
+                         in self.db.load_list_entries(lst)]
+            self.assertEqual(len(positions), len(set(positions)))
+        self.assertGreater(changes[0], 400)  # rebalanced at least once
+        self.assertEqual(changes[0], changes[1])
+
     def test_loading_all_list_descriptors(self) -> None:
         '''Store list in database and load again.'''
         images = [self.example_descriptor] * 3
@@ -292,3 +821,70 @@ class TestKnipseDatabase(unittest.TestCase):
             for row in conn.execute('SELECT * FROM thumbnails;'):
                 for field in row:
                     self.assertIsNotNone(field)
+
+
+class TestConcurrentAccess(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.src = Path(__file__).resolve().parent / 'images' / 'various'
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self.tmp.name) / 'knipse.sqlite')
+        self.db = KnipseDB(self.db_path)
+
+    def tearDown(self) -> None:
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_wal_journal_mode(self) -> None:
+        with self.db.db as conn:
+            mode = conn.execute('PRAGMA journal_mode;').fetchone()[0]
+        self.assertEqual('wal', mode)
+
+    def test_reading_while_writing(self) -> None:
+        '''Readers see the last commit while another connection
+           holds the write lock.'''
+        store_images(self.db, self.src)
+        writer_db = KnipseDB(self.db_path)
+        try:
+            writer_db.db.execute('BEGIN IMMEDIATE;')
+            writer_db.db.execute('UPDATE images SET active = 0;')
+            self.assertEqual([], list(self.db.load_inactive_image_ids()))
+            self.assertEqual(len(EXPECTED_IMAGES),
+                             len(list(self.db.load_all_images())))
+            writer_db.db.commit()
+            self.assertEqual(len(EXPECTED_IMAGES),
+                             len(list(self.db.load_inactive_image_ids())))
+        finally:
+            writer_db.close()
+
+    def test_snapshot(self) -> None:
+        store_images(self.db, self.src)
+        descr = next(iter(self.db.load_all_images()))
+        with self.db.snapshot():
+            self.assertEqual(len(EXPECTED_IMAGES),
+                             len(list(self.db.load_all_images())))
+            self.db.store_image(unstored_copy(descr))
+            self.assertEqual(len(EXPECTED_IMAGES),
+                             len(list(self.db.load_all_images())))
+            self.assertEqual([descr.image_id],
+                             [d.image_id for d in
+                              self.db.load_images_by_md5(descr.md5)])
+        self.assertEqual(len(EXPECTED_IMAGES) + 1,
+                         len(list(self.db.load_all_images())))
+
+    def test_read_only_connection_pool(self) -> None:
+        store_images(self.db, self.src)
+        with self.db._reader() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute('DELETE FROM images;')
+        # nested reads use separate connections, idle ones are reused
+        for _ in self.db.load_all_images():
+            for _ in self.db.load_image_paths():
+                pass
+        self.assertEqual(2, len(self.db._idle_readers))
+        images = [iter(self.db.load_all_images()) for _ in range(6)]
+        for loaded in images:
+            next(loaded)
+        for loaded in images:
+            self.assertEqual(len(EXPECTED_IMAGES) - 1, len(list(loaded)))
+        self.assertEqual(4, len(self.db._idle_readers))
@@ -1,16 +1,41 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import io
+import pickle
+import tempfile
+from unittest import mock
 from pathlib import Path
 from datetime import datetime
 
 from PIL import Image
 
 from knipse.descriptor import ImageDescriptor
-from knipse.image import descriptor_from_image, path_and_modification
+from knipse.image import descriptor_from_image, path_and_modification, \
+                         read_image, _md5sum
 from knipse.walk import walk_images
 
 
+class _CountingReader(io.BufferedReader):
+    '''Buffered file counting the bytes read from it'''
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read1(self, size=-1):
+        data = super().read1(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        n = super().readinto(buffer)
+        self.bytes_read += n or 0
+        return n
+
+
 def _does_not_contain_forest(source: Path, path: Path, _: datetime) -> bool:
     rel_path, modified_at = path_and_modification(source, path)
     return 'forest' not in str(rel_path).lower()
@@ -75,6 +100,33 @@ class TestImageDescriptor(unittest.TestCase):
                 break
         self.assertTrue(found)
 
+    def test_single_read_descriptor(self) -> None:
+        '''Test that reading an image once yields the same descriptor'''
+        for path in (self.path, self.path2):
+            img, md5 = read_image(path)
+            self.assertEqual(_md5sum(path), md5)
+            img.load()
+            self.assertEqual(descriptor_from_image(self.src, path,
+                                                   Image.open(path)),
+                             descriptor_from_image(self.src, path, img, md5))
+
+    def test_non_image_is_not_read(self) -> None:
+        '''Test that only the header of files other than images is read'''
+        readers = []
+
+        def counting_open(path, mode):
+            readers.append(_CountingReader(io.FileIO(path, mode)))
+            return readers[-1]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'video.mp4'
+            path.write_bytes(bytes(range(256)) * 40000)
+            with mock.patch('knipse.image.open', create=True,
+                            side_effect=counting_open):
+                with self.assertRaises(IOError):
+                    read_image(path)
+        self.assertEqual(1, len(readers))
+        self.assertLess(readers[0].bytes_read, 100000)
+
     def test_descriptor_equality(self):
         descr1 = descriptor_from_image(self.src, self.path2,
                                        Image.open(self.path2))
@@ -86,3 +138,11 @@ class TestImageDescriptor(unittest.TestCase):
         descr = descriptor_from_image(self.src, self.path2,
                                       Image.open(self.path2))
         self.assertIn('ImageDescriptor(', repr(descr))
+
+    def test_descriptor_slots(self):
+        descr = descriptor_from_image(self.src, self.path2,
+                                      Image.open(self.path2))
+        self.assertFalse(hasattr(descr, '__dict__'))
+        with self.assertRaises(AttributeError):
+            descr.unknown = 1
+        self.assertEqual(descr, pickle.loads(pickle.dumps(descr)))
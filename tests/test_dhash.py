@@ -2,21 +2,41 @@
 
 import unittest
 from pathlib import Path
+from typing import List  # noqa: 401
 
+import numpy as np
 from PIL import Image
 
-from knipse.dhash import dhash_bytes
+from knipse.dhash import dhash_bytes, dhash_many, dhash_array, \
+    hamming_distance
+from knipse.image import read_image
 
 
 _expected_hash = \
     b'\xf1\xf8\xf8\xf1\xfc\xfc\xf4\xf5\x08\xf1\xec\x00\x19\xff\xfe\xfc'
 
 
+def _reference_dhash_bytes(img: Image.Image) -> bytes:
+    '''Pixel by pixel implementation of dhash for comparison.'''
+    thumbnail = img.convert('L').resize(
+        (9, 9), Image.BILINEAR)  # type: ignore
+    # indexed by [x, y] like the pixel access of PIL
+    pixels = np.asarray(thumbnail).T.tolist()  # type: List[List[int]]
+    row_diffs = []
+    col_diffs = []
+    for row in range(8):
+        for col in range(8):
+            row_diffs.append(pixels[row + 1][col] >= pixels[row][col])
+            col_diffs.append(pixels[row][col + 1] >= pixels[row][col])
+    bits = ''.join(['1' if bit else '0' for bit in row_diffs + col_diffs])
+    return int(bits, 2).to_bytes(16, 'little')
+
+
 class TestDifferenceHash(unittest.TestCase):
 
     def setUp(self) -> None:
-        img_path = Path(__file__).resolve().parent \
-                   / 'images' / 'photo01.jpg'
+        self.images = Path(__file__).resolve().parent / 'images'
+        img_path = self.images / 'photo01.jpg'
         self.photo = Image.open(str(img_path))
 
     def test_dhash_regression(self) -> None:
@@ -32,3 +52,37 @@ class TestDifferenceHash(unittest.TestCase):
         self.assertEqual(dhsh, dhash_bytes(photo))
         photo = self.photo.resize((90, 90), Image.BILINEAR)
         self.assertEqual(dhsh, dhash_bytes(photo))
+
+    def test_hamming_distance(self) -> None:
+        self.assertEqual(0, hamming_distance(_expected_hash, _expected_hash))
+        self.assertEqual(128, hamming_distance(b'\x00' * 16, b'\xff' * 16))
+        self.assertEqual(2, hamming_distance(b'\x01\x80', b'\x00\x00'))
+
+    def test_draft_dhash_drift(self) -> None:
+        '''Regression test for the deviation of dhashes of images decoded
+           at reduced resolution from those of fully decoded images.'''
+        distances = []
+        for path in sorted(self.images.glob('**/*.jpg')):
+            full_img, _ = read_image(path)
+            draft_img, _ = read_image(path, draft=True)
+            distances.append(hamming_distance(dhash_bytes(full_img),
+                                              dhash_bytes(draft_img)))
+        self.assertLessEqual(max(distances), 4)
+        self.assertLessEqual(sum(distances) / len(distances), 1.0)
+
+    def test_identical_to_reference(self) -> None:
+        imgs = [Image.open(str(path))
+                for path in sorted(self.images.glob('**/*.jpg'))]
+        expected = [_reference_dhash_bytes(img) for img in imgs]
+        self.assertEqual(expected, [dhash_bytes(img) for img in imgs])
+        self.assertEqual(expected, dhash_many(imgs))
+        self.assertEqual([], dhash_many([]))
+
+    def test_identical_to_reference_random(self) -> None:
+        rnd = np.random.RandomState(42)
+        thumbnails = rnd.randint(0, 4, size=(200, 9, 9)).astype(np.uint8)
+        hashes = dhash_array(thumbnails)
+        self.assertEqual((200, 16), hashes.shape)
+        for thumbnail, hsh in zip(thumbnails, hashes):
+            img = Image.fromarray(thumbnail, 'L')
+            self.assertEqual(_reference_dhash_bytes(img), hsh.tobytes())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+import shutil
+import tempfile
+from unittest import mock
+from pathlib import Path
+
+import numpy as np
+from click.testing import CliRunner
+
+from knipse.db import KnipseDB
+from knipse.dhash import hamming_distance
+from knipse.scan import scan_images
+from knipse.duplicates import near_duplicate_groups, band_limits, \
+    exact_duplicate_groups, cli_duplicates
+
+
+def _random_hashes(n: int, seed: int = 42) -> list:
+    '''Random hashes in clusters of slightly modified copies.'''
+    rnd = np.random.RandomState(seed)
+    hashes = rnd.randint(0, 256, size=(n // 4, 16)).astype(np.uint8)
+    copies = [hashes]
+    for _ in range(3):
+        flips = np.packbits(rnd.random_sample(hashes.shape[:1] + (128,))
+                            < 0.03, axis=1)
+        copies.append(hashes ^ flips)
+    return [bytes(hsh) for hsh in np.concatenate(copies)]
+
+
+def _linear_groups(image_ids: list, hashes: list, max_distance: int) -> list:
+    '''Groups by transitive closure of comparing all pairs.'''
+    group_of = {image_id: {image_id} for image_id in image_ids}
+    for i, (id1, hash1) in enumerate(zip(image_ids, hashes)):
+        for id2, hash2 in zip(image_ids[i + 1:], hashes[i + 1:]):
+            if hamming_distance(hash1, hash2) <= max_distance \
+                    and group_of[id1] is not group_of[id2]:
+                merged = group_of[id1] | group_of[id2]
+                for image_id in merged:
+                    group_of[image_id] = merged
+    groups = set(tuple(sorted(group)) for group in group_of.values()
+                 if len(group) > 1)
+    return sorted(list(group) for group in groups)
+
+
+class TestDuplicates(unittest.TestCase):
+
+    def test_band_limits(self) -> None:
+        self.assertEqual([(0, 64), (64, 128)], band_limits(2))
+        limits = band_limits(9)
+        self.assertEqual(9, len(limits))
+        self.assertEqual(0, limits[0][0])
+        self.assertEqual(128, limits[-1][1])
+        for (_, end), (start, _) in zip(limits[:-1], limits[1:]):
+            self.assertEqual(end, start)
+
+    def test_near_duplicates_equal_linear_search(self) -> None:
+        hashes = _random_hashes(400)
+        image_ids = list(range(1000, 1000 + len(hashes)))
+        for max_distance in (0, 2, 5, 10):
+            expected = _linear_groups(image_ids, hashes, max_distance)
+            self.assertEqual(expected, list(near_duplicate_groups(
+                image_ids, hashes, max_distance)))
+        self.assertEqual(expected, list(near_duplicate_groups(
+            image_ids, hashes, 10, jobs=2)))
+
+    def test_fewer_bands(self) -> None:
+        '''Fewer bands than required may miss pairs, but never
+           merge images beyond `max_distance`.'''
+        hashes = _random_hashes(400)
+        image_ids = list(range(len(hashes)))
+        expected = _linear_groups(image_ids, hashes, 10)
+        groups = list(near_duplicate_groups(image_ids, hashes, 10,
+                                            n_bands=4))
+        self.assertTrue(groups)
+        for group in groups:
+            self.assertTrue(any(set(group) <= set(expected_group)
+                                for expected_group in expected))
+
+    def test_large_bucket(self) -> None:
+        '''Many identical hashes are linked without comparing
+           all pairs at once.'''
+        hashes = [bytes(16)] * 3000 + [b'\xff' * 16]
+        self.assertEqual([list(range(3000))],
+                         list(near_duplicate_groups(range(len(hashes)),
+                                                    hashes, 3)))
+
+    def test_duplicates_command(self) -> None:
+        '''Find exact and near duplicates of a copied image.'''
+        src = Path(__file__).resolve().parent / 'images' / 'various'
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp) / 'various'
+            shutil.copytree(str(src), str(base), symlinks=True)
+            shutil.copy(str(base / 'img_0002.jpg'),
+                        str(base / 'folder1' / 'copy.jpg'))
+            db = KnipseDB(':memory:')
+            list(scan_images(db, base))
+            copies = [db.load_image_by_path(Path(path))
+                      for path in ('img_0002.jpg', 'folder1/copy.jpg')]
+            self.assertEqual([[(descr.image_id, str(descr.path))
+                               for descr in copies if descr is not None]],
+                             list(exact_duplicate_groups(db)))
+            runner = CliRunner()
+            obj = {'database': db, 'source': str(base)}
+            # exact duplicates are found without loading all images
+            with mock.patch.object(db, 'load_image_table') as load_table:
+                result = runner.invoke(cli_duplicates, [], obj=obj)
+            load_table.assert_not_called()
+            self.assertEqual(0, result.exit_code, result.output)
+            self.assertEqual(['1\timg_0002.jpg', '1\tfolder1/copy.jpg'],
+                             result.output.splitlines())
+            result = runner.invoke(cli_duplicates,
+                                   ['--near', '-k', '0', '--format', 'json'],
+                                   obj=obj)
+            self.assertEqual(0, result.exit_code, result.output)
+            groups = [json.loads(line) for line in result.output.splitlines()]
+            paths = [set(image['path'] for image in group['images'])
+                     for group in groups]
+            self.assertIn({'img_0002.jpg', 'folder1/copy.jpg'}, paths)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from knipse import hashes
+from knipse.hashes import HASH_ALGORITHMS, compute_hashes, register_hash
+from knipse.dhash import hamming_distance
+from knipse.db import KnipseDB
+from knipse.scan import scan_images, backfill_hashes
+from .test_walk import EXPECTED_IMAGES
+
+
+class TestPerceptualHashes(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.images = Path(__file__).resolve().parent / 'images'
+        self.photo = Image.open(str(self.images / 'photo01.jpg'))
+        self.src = self.images / 'various'
+
+    def test_hashes(self) -> None:
+        self.assertEqual(['ahash', 'phash', 'whash'], list(HASH_ALGORITHMS))
+        hshs = compute_hashes(self.photo, HASH_ALGORITHMS)
+        self.assertEqual(set(HASH_ALGORITHMS), set(hshs))
+        for hsh in hshs.values():
+            self.assertEqual(8, len(hsh))
+        self.assertEqual({}, compute_hashes(self.photo, []))
+        # hashes are robust to scaling
+        resized = self.photo.resize((400, 300),
+                                    Image.BILINEAR)  # type: ignore
+        for name, hsh in compute_hashes(resized, HASH_ALGORITHMS).items():
+            self.assertLessEqual(hamming_distance(hshs[name], hsh), 4, name)
+
+    def test_shared_buffer(self) -> None:
+        with mock.patch.object(hashes, 'grayscale_buffer',
+                               wraps=hashes.grayscale_buffer) as buffer:
+            compute_hashes(self.photo, HASH_ALGORITHMS)
+        self.assertEqual(1, buffer.call_count)
+
+    def test_register_hash(self) -> None:
+        @register_hash('brightness')
+        def brightness(buffer: np.ndarray) -> bytes:
+            return bytes([int(buffer.mean())])
+        try:
+            self.assertIn('brightness', compute_hashes(self.photo,
+                                                       ['brightness']))
+        finally:
+            del HASH_ALGORITHMS['brightness']
+
+    def test_dct_matrix_is_orthonormal(self) -> None:
+        dct = hashes._dct_matrix(hashes.BUFFER_SIZE)
+        np.testing.assert_allclose(np.eye(hashes.BUFFER_SIZE), dct @ dct.T,
+                                   atol=1e-10)
+
+    def test_scan_with_hashes(self) -> None:
+        algorithms = ['ahash', 'phash']
+        db = KnipseDB(':memory:')
+        list(scan_images(db, self.src, hash_algorithms=algorithms))
+        parallel_db = KnipseDB(':memory:')
+        list(scan_images(parallel_db, self.src, jobs=2,
+                         hash_algorithms=algorithms))
+        for descr in db.load_all_images():
+            assert isinstance(descr.image_id, int)
+            hshs = db.load_image_hashes(descr.image_id)
+            self.assertEqual(set(algorithms), set(hshs))
+            self.assertEqual(hshs,
+                             parallel_db.load_image_hashes(descr.image_id))
+            img = Image.open(str(self.src / descr.path))
+            self.assertEqual(compute_hashes(img, algorithms), hshs)
+
+    def test_backfill_hashes(self) -> None:
+        db = KnipseDB(':memory:')
+        list(scan_images(db, self.src, hash_algorithms=['ahash']))
+        self.assertEqual([], list(db.load_images_missing_hash('ahash')))
+        self.assertEqual(len(EXPECTED_IMAGES),
+                         len(list(db.load_images_missing_hash('phash'))))
+        processed = list(backfill_hashes(db, self.src, HASH_ALGORITHMS,
+                                         jobs=2))
+        self.assertEqual(len(EXPECTED_IMAGES), len(processed))
+        self.assertTrue(all(hashed for _, hashed in processed))
+        for algorithm in HASH_ALGORITHMS:
+            self.assertEqual([],
+                             list(db.load_images_missing_hash(algorithm)))
+        self.assertEqual([], list(backfill_hashes(db, self.src,
+                                                  HASH_ALGORITHMS)))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+import tempfile
+from unittest import mock
+from pathlib import Path
+
+from knipse.db import KnipseDB, ImageRecognizer, LazyImageRecognizer, \
+    MappedImageRecognizer
+from knipse.index import ImageIndex, write_index, write_index_records
+from knipse.scan import scan_images
+from .test_walk import EXPECTED_IMAGES
+
+
+class TestImageIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.src = Path(__file__).resolve().parent / 'images' / 'various'
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = KnipseDB(str(Path(self.tmp.name) / 'knipse.sqlite'))
+        assert self.db.index_path is not None
+        self.index_path = self.db.index_path
+
+    def tearDown(self) -> None:
+        self.db.db.close()
+        self.tmp.cleanup()
+
+    def _image_index(self, db: KnipseDB) -> ImageIndex:
+        index = db.image_index()
+        assert isinstance(index, ImageIndex)
+        return index
+
+    def test_lookups_equal_in_memory_recognizer(self) -> None:
+        list(scan_images(self.db, self.src))
+        mapped = self.db.get_recognizer()
+        assert isinstance(mapped, MappedImageRecognizer)
+        self.assertTrue(self.index_path.exists())
+        in_memory = self.db.get_recognizer(mapped=False)
+        self.assertIsInstance(in_memory, ImageRecognizer)
+        self.assertEqual(len(EXPECTED_IMAGES), len(mapped.index))
+        for descr in self.db.load_all_images():
+            path = self.src / descr.path
+            self.assertEqual(in_memory.by_path(self.src, path),
+                             mapped.by_path(self.src, path))
+            self.assertEqual(in_memory.by_md5(descr.md5),
+                             mapped.by_md5(descr.md5))
+            self.assertEqual(in_memory.by_dhash(descr.dhash),
+                             mapped.by_dhash(descr.dhash))
+            self.assertFalse(mapped.filter(self.src, path,
+                                           descr.modified_at))
+        self.assertIsNone(mapped.by_md5(bytes(16)))
+        self.assertIsNone(mapped.by_dhash(bytes(16)))
+        self.assertIsNone(mapped.by_path(self.src, self.src / 'unknown.jpg'))
+        self.assertTrue(mapped.filter(self.src, self.src / 'unknown.jpg',
+                                      descr.modified_at))
+
+    def test_index_is_rebuilt_after_changes(self) -> None:
+        self.assertEqual(0, len(self._image_index(self.db)))
+        index = self._image_index(self.db)
+        self.assertIs(index, self.db.image_index())
+        generation = self.db.images_generation()
+        list(scan_images(self.db, self.src))
+        self.assertGreater(self.db.images_generation(), generation)
+        index = self._image_index(self.db)
+        self.assertEqual(self.db.images_generation(), index.generation)
+        self.assertEqual(len(EXPECTED_IMAGES), len(index))
+        # a second database connection reuses the index file
+        other_db = KnipseDB(str(self.index_path)[:-len('.idx')])
+        mtime = self.index_path.stat().st_mtime_ns
+        self.assertEqual(len(EXPECTED_IMAGES),
+                         len(self._image_index(other_db)))
+        self.assertEqual(mtime, self.index_path.stat().st_mtime_ns)
+        other_db.db.close()
+        # deactivated images are removed from the index
+        image_id, path = next(iter(self.db.load_image_paths()))
+        self.db.deactivate_images([image_id])
+        recgn = self.db.get_recognizer()
+        assert isinstance(recgn, MappedImageRecognizer)
+        self.assertEqual(len(EXPECTED_IMAGES) - 1, len(recgn.index))
+        self.assertIsNone(recgn.by_path(self.src, self.src / path))
+
+    def test_corrupt_index_file(self) -> None:
+        self.index_path.write_bytes(b'no index')
+        self.assertEqual(0, len(self._image_index(self.db)))
+        with self.assertRaises(ValueError):
+            ImageIndex(Path(self.tmp.name) / 'knipse.sqlite')
+
+    def test_truncated_index_file(self) -> None:
+        list(scan_images(self.db, self.src))
+        self.db.image_index()
+        data = self.index_path.read_bytes()
+        self.db.db.close()
+        for size in (100, len(data) - 1):
+            self.index_path.write_bytes(data[:size])
+            with self.assertRaises(ValueError):
+                ImageIndex(self.index_path)
+            db = KnipseDB(str(self.index_path)[:-len('.idx')])
+            self.assertEqual(len(EXPECTED_IMAGES), len(self._image_index(db)))
+            db.close()
+        self.db = KnipseDB(str(self.index_path)[:-len('.idx')])
+
+    def test_failing_rebuild_falls_back(self) -> None:
+        list(scan_images(self.db, self.src))
+        with mock.patch('knipse.db.write_index_records',
+                        side_effect=PermissionError('read-only')):
+            self.assertIsNone(self.db.image_index())
+            recgn = self.db.get_recognizer()
+        self.assertIsInstance(recgn, LazyImageRecognizer)
+        descr = next(iter(self.db.load_all_images()))
+        self.assertEqual(descr, recgn.by_md5(descr.md5))
+
+    def test_index_is_written_from_database(self) -> None:
+        list(scan_images(self.db, self.src))
+        self.db.deactivate_images([1])
+        self.db.image_index()
+        path = Path(self.tmp.name) / 'images.idx'
+        write_index(path, self.db.images_generation(),
+                    self.db.load_all_images())
+        self.assertEqual(path.read_bytes(), self.index_path.read_bytes())
+
+    def test_failed_write_keeps_index(self) -> None:
+        path = Path(self.tmp.name) / 'images.idx'
+        write_index(path, 1, [])
+
+        def records():
+            yield bytes(16), bytes(16), 1, 'a.jpg', 0, 0
+            raise OSError('disk full')
+        with self.assertRaises(OSError):
+            write_index_records(path, 2, records(), list, list)
+        self.assertEqual({'images.idx', 'knipse.sqlite'},
+                         set(os.listdir(self.tmp.name)) - {
+                             'knipse.sqlite-wal', 'knipse.sqlite-shm'})
+        with ImageIndex(path) as index:
+            self.assertEqual(1, index.generation)
+
+    def test_write_index(self) -> None:
+        db = KnipseDB(':memory:')
+        list(scan_images(db, self.src))
+        path = Path(self.tmp.name) / 'images.idx'
+        write_index(path, 42, db.load_all_images())
+        with ImageIndex(path) as index:
+            self.assertEqual(42, index.generation)
+            for descr in db.load_all_images():
+                self.assertEqual(descr, index.by_path(str(descr.path)))
@@ -3,9 +3,13 @@
 import unittest
 from pathlib import Path
 
+from click.testing import CliRunner
+
 from knipse.db import KnipseDB
 from knipse.scan import scan_images
-from knipse.lists import image_id_from_string
+from knipse.descriptor import ListDescriptor
+from knipse.lists import image_id_from_string, cli_append_to_list, \
+    cli_insert_into_list, cli_move_list_entry
 from .test_walk import EXPECTED_IMAGES
 
 
@@ -27,3 +31,74 @@ class TestKnipseDatabase(unittest.TestCase):
         self.assertEqual(1, image_id)
         image_id = image_id_from_string('I002', self.src, recgn)
         self.assertEqual(2, image_id)
+
+    def test_appending_to_list(self) -> None:
+        list(scan_images(self.db, self.src))
+        lst = self.db.store_list(ListDescriptor(None, 'favourites',
+                                                Path('.')))
+        runner = CliRunner()
+        obj = {'database': self.db, 'source': self.src}
+        result = runner.invoke(cli_append_to_list,
+                               ['-l', 'L{}'.format(lst.list_id), 'I3',
+                                str(self.src / 'img_0002.jpg')], obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        result = runner.invoke(cli_append_to_list,
+                               ['-l', str(lst.list_id), '--stdin', 'I5'],
+                               input='I4\n\n{}\n'.format(
+                                   self.src / 'img_0002.jpg'), obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        result = runner.invoke(cli_append_to_list,
+                               ['-l', str(lst.list_id), '--stdin'],
+                               input='I6\nunknown.jpg\n', obj=obj)
+        self.assertNotEqual(0, result.exit_code)
+        self.assertEqual([3, 1, 5, 4, 1],
+                         [entry.image_id for entry, _
+                          in self.db.load_list_entries(lst)])
+
+    def test_appending_is_atomic(self) -> None:
+        '''Nothing is appended if looking up one of the images fails.'''
+        list(scan_images(self.db, self.src))
+        lst = self.db.store_list(ListDescriptor(None, 'favourites',
+                                                Path('.')))
+        assert isinstance(lst.list_id, int)
+        recgn = self.db.get_recognizer(lazy=True)
+        images = [str(self.src / 'img_0002.jpg'), 'I3',
+                  str(self.src / 'folder1' / 'unknown.jpg')]
+        with self.assertRaises(Exception):
+            self.db.append_to_list(lst.list_id, (
+                image_id_from_string(image, self.src, recgn)
+                for image in images))
+        self.assertEqual([], list(self.db.load_list_entries(lst)))
+        result = CliRunner().invoke(
+            cli_append_to_list, ['-l', str(lst.list_id), '--stdin'],
+            input='\n'.join(images), obj={'database': self.db,
+                                          'source': self.src})
+        self.assertNotEqual(0, result.exit_code)
+        self.assertEqual([], list(self.db.load_list_entries(lst)))
+
+    def test_reordering_list(self) -> None:
+        list(scan_images(self.db, self.src))
+        lst = self.db.store_list(ListDescriptor(None, 'favourites',
+                                                Path('.')))
+        assert isinstance(lst.list_id, int)
+        self.db.append_to_list(lst.list_id, [1, 2, 3])
+        first, second, third = (entry.list_entry_id for entry, _
+                                in self.db.load_list_entries(lst))
+        runner = CliRunner()
+        obj = {'database': self.db, 'source': self.src}
+        result = runner.invoke(cli_insert_into_list,
+                               ['-a', str(first), '--stdin', 'I5'],
+                               input='I4\n', obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        result = runner.invoke(cli_move_list_entry,
+                               [str(third), '--before', str(first)], obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual([3, 1, 5, 4, 2],
+                         [entry.image_id for entry, _
+                          in self.db.load_list_entries(lst)])
+        result = runner.invoke(cli_move_list_entry,
+                               [str(third), '-a', str(first), '-b',
+                                str(second)], obj=obj)
+        self.assertNotEqual(0, result.exit_code)
+        result = runner.invoke(cli_insert_into_list, ['I1'], obj=obj)
+        self.assertNotEqual(0, result.exit_code)
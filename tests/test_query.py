@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from click.testing import CliRunner
+
+from knipse.db import KnipseDB
+from knipse.descriptor import ImageDescriptor, ListDescriptor
+from knipse.scan import scan_images
+from knipse.query import ImageQuery, query_images, cli_query, cli_search
+
+
+class TestImageQuery(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.src = Path(__file__).resolve().parent / 'images' / 'various'
+        self.db = KnipseDB(':memory:')
+        list(scan_images(self.db, self.src))
+        # distinct creation dates, one image without
+        self.start = datetime(2019, 1, 1)
+        with self.db.batch() as batch:
+            for i, descr in enumerate(self.db.load_all_images()):
+                descr.created_at = self.start + timedelta(days=i) \
+                    if i else None
+                batch.store_image(descr)
+        self.images = list(self.db.load_all_images())
+
+    def _query(self, **filters) -> list:
+        return sorted(str(descr.path) for descr in
+                      query_images(self.db, ImageQuery(**filters)))
+
+    def _expected(self, condition) -> list:
+        return sorted(str(descr.path) for descr in self.images
+                      if condition(descr))
+
+    def test_filters(self) -> None:
+        self.assertEqual(self._expected(lambda d: True), self._query())
+        self.assertEqual(
+            self._expected(lambda d: str(d.path).startswith('folder2/')),
+            self._query(folder=Path('folder2')))
+        self.assertEqual(self._expected(lambda d: True),
+                         self._query(folder=Path('.')))
+        self.assertEqual([], self._query(folder=Path('folder')))
+        after = self.start + timedelta(days=3)
+        before = self.start + timedelta(days=7)
+        self.assertEqual(
+            self._expected(lambda d: d.created_at is not None
+                           and after <= d.created_at < before),
+            self._query(created_after=after, created_before=before))
+        self.assertEqual(
+            self._expected(lambda d: d.created_at is not None
+                           and d.created_at < before
+                           and str(d.path).startswith('folder2/')),
+            self._query(created_before=before, folder=Path('folder2')))
+        modified_at = self.images[0].modified_at
+        self.assertEqual(
+            self._expected(lambda d: d.modified_at >= modified_at),
+            self._query(modified_after=modified_at))
+        self.assertEqual(
+            self._expected(lambda d: d.modified_at < modified_at),
+            self._query(modified_before=modified_at))
+        descr = self.images[3]
+        self.assertEqual([str(descr.path)], self._query(md5=descr.md5))
+        self.assertEqual([str(descr.path)], self._query(dhash=descr.dhash))
+        self.assertEqual([], self._query(md5=descr.md5,
+                                         folder=Path('unknown')))
+
+    def test_lists_and_state(self) -> None:
+        self.db.store_list(ListDescriptor(None, 'favourites', Path('.')),
+                           self.images[2:5])
+        self.assertEqual(
+            sorted(str(descr.path) for descr in self.images[2:5]),
+            self._query(list_name='favourites'))
+        self.assertEqual([], self._query(list_name='unknown'))
+        assert isinstance(self.images[2].image_id, int)
+        self.db.deactivate_images([self.images[2].image_id])
+        self.assertEqual(
+            sorted(str(descr.path) for descr in self.images[3:5]),
+            self._query(list_name='favourites'))
+        self.assertEqual([str(self.images[2].path)],
+                         self._query(active=False))
+        self.assertEqual(self._expected(lambda d: True),
+                         self._query(active=None))
+
+    def test_order_and_limit(self) -> None:
+        paths = [str(descr.path) for descr in query_images(
+            self.db, ImageQuery(order_by='path', limit=3))]
+        self.assertEqual(self._expected(lambda d: True)[:3], paths)
+        ids = [descr.image_id for descr in query_images(
+            self.db, ImageQuery(order_by='id'))]
+        self.assertEqual(sorted(ids), ids)
+        with self.assertRaises(AssertionError):
+            ImageQuery(order_by='md5; DROP TABLE images')
+
+    def test_query_plans_use_indexes(self) -> None:
+        for query, index in (
+                (ImageQuery(folder=Path('folder2')), 'images_path'),
+                (ImageQuery(created_after=self.start), 'images_created_at'),
+                (ImageQuery(modified_before=self.start),
+                 'images_modified_at'),
+                (ImageQuery(md5=bytes(16)), 'images_md5'),
+                (ImageQuery(dhash=bytes(16)), 'images_dhash')):
+            sql, params = query.sql()
+            with self.db.db as conn:
+                plan = '\n'.join(row[-1] for row in conn.execute(
+                    'EXPLAIN QUERY PLAN ' + sql, params))
+            self.assertIn('USING INDEX ' + index, plan)
+
+    def test_query_command(self) -> None:
+        runner = CliRunner()
+        obj = {'database': self.db, 'source': str(self.src)}
+        result = runner.invoke(cli_query,
+                               ['--folder', 'folder1', '-f', 'path',
+                                '-o', 'path', '--header'], obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual(['path'] + self._expected(
+            lambda d: str(d.path).startswith('folder1/')),
+            result.output.splitlines())
+        result = runner.invoke(cli_query,
+                               ['--created-after', '2019-01-05',
+                                '--md5', self.images[5].md5.hex(),
+                                '-f', 'image_id'], obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual([str(self.images[5].image_id)],
+                         result.output.splitlines())
+        result = runner.invoke(cli_query, ['--md5', 'abc'], obj=obj)
+        self.assertNotEqual(0, result.exit_code)
+        result = runner.invoke(cli_query, ['--folder', 'unknown', '-h'],
+                               obj=obj)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual(1, len(result.output.splitlines()))
+
+
+class TestPathSearch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = KnipseDB(':memory:')
+        self.paths = ['2019/Summer Holidays/DSC_0001.jpg',
+                      '2019/Summer Holidays/DSC_0002.jpg',
+                      '2019/summer party/IMG_1000.jpg',
+                      '2020/100%_sharp/dsc-0003.jpg',
+                      '2020/"quoted"/x_y.jpg']
+        for i, path in enumerate(self.paths):
+            self.db.store_image(ImageDescriptor(
+                None, Path(path), None, datetime(2020, 1, 1),
+                bytes([i]) * 16, bytes(16), True))
+
+    def _search(self, text: str) -> list:
+        return sorted(str(descr.path)
+                      for descr in self.db.search_images(text))
+
+    def _expected(self, text: str) -> list:
+        return sorted(path for path in self.paths
+                      if text.lower() in path.lower())
+
+    def test_search(self) -> None:
+        self.assertTrue(self.db.path_search)
+        for text in ('DSC_', 'dsc', 'summer', 'Holidays/DSC', '0%_', '"q',
+                     '_', 'y', '%', '2019/', 'unknown', '.jpg'):
+            self.assertEqual(self._expected(text), self._search(text), text)
+        self.assertEqual(2, len(list(self.db.search_images('.jpg', 2))))
+
+    def test_search_follows_changes(self) -> None:
+        descr = next(iter(self.db.search_images('IMG_1000')))
+        descr.path = Path('2019/renamed/IMG_1001.jpg')
+        self.db.store_image(descr)
+        self.assertEqual([], self._search('IMG_1000'))
+        self.assertEqual([str(descr.path)], self._search('IMG_1001'))
+        assert isinstance(descr.image_id, int)
+        self.db.deactivate_images([descr.image_id])
+        self.assertEqual([], self._search('IMG_1001'))
+        with self.db.db as conn:
+            conn.execute('DELETE FROM images WHERE rowid = ?;',
+                         (descr.image_id,))
+            self.assertEqual(0, conn.execute(
+                "SELECT COUNT(*) FROM images_fts WHERE path MATCH 'renamed';"
+            ).fetchone()[0])
+
+    def test_existing_images_are_indexed(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / 'knipse.sqlite')
+            db = KnipseDB(db_path)
+            db.store_image(ImageDescriptor(
+                None, Path('a/DSC_0001.jpg'), None, datetime(2020, 1, 1),
+                bytes(16), bytes(16), True))
+            with db.db as conn:
+                conn.execute('DROP TABLE images_fts;')
+                for event in ('insert', 'update', 'delete'):
+                    conn.execute('DROP TRIGGER images_fts_{};'.format(event))
+            db.close()
+            db = KnipseDB(db_path)
+            self.assertEqual(['a/DSC_0001.jpg'],
+                             [str(descr.path)
+                              for descr in db.search_images('dsc_')])
+            db.close()
+
+    def test_search_without_index(self) -> None:
+        self.db.path_search = False
+        for text in ('DSC_', 'summer', '0%_', '_', '"q', '!'):
+            self.assertEqual(self._expected(text), self._search(text), text)
+
+    def test_search_command(self) -> None:
+        result = CliRunner().invoke(cli_search, ['-f', 'path', 'summer'],
+                                    obj={'database': self.db})
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual(self._expected('summer'),
+                         sorted(result.output.splitlines()))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from click.testing import CliRunner
+
+from knipse.db import KnipseDB
+from knipse.dhash import hamming_distance
+from knipse.scan import scan_images
+from knipse.similar import DhashIndex, cli_similar, load_dhash_index
+
+
+def _random_hashes(n: int, seed: int = 42) -> list:
+    '''Random hashes, half of them near copies of the other half.'''
+    rnd = np.random.RandomState(seed)
+    hashes = rnd.randint(0, 256, size=(n // 2, 16)).astype(np.uint8)
+    flips = np.packbits(rnd.random_sample((n // 2, 128)) < 0.05, axis=1)
+    return [bytes(hsh) for hsh in np.concatenate([hashes, hashes ^ flips])]
+
+
+class TestDhashIndex(unittest.TestCase):
+
+    def test_query_equals_linear_search(self) -> None:
+        hashes = _random_hashes(2000)
+        image_ids = list(range(100, 100 + len(hashes)))
+        index = DhashIndex(image_ids, hashes)
+        self.assertEqual(len(hashes), len(index))
+        for max_distance in (0, 3, 7, 8, 12, 20, 128):
+            for query in hashes[::97] + [bytes(16)]:
+                expected = sorted((hamming_distance(query, hsh), image_id)
+                                  for image_id, hsh in zip(image_ids, hashes)
+                                  if hamming_distance(query, hsh)
+                                  <= max_distance)
+                self.assertEqual(expected, index.query(query, max_distance))
+
+    def test_empty_index(self) -> None:
+        index = DhashIndex.from_pairs([])
+        self.assertEqual(0, len(index))
+        self.assertEqual([], index.query(bytes(16), 10))
+
+    def test_save_and_load(self) -> None:
+        hashes = _random_hashes(500)
+        index = DhashIndex(range(len(hashes)), hashes)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'images.dhx'
+            index.save(path, 7)
+            generation, loaded = DhashIndex.load(path)
+            self.assertEqual(7, generation)
+            self.assertEqual(len(index), len(loaded))
+            for query in hashes[::50]:
+                self.assertEqual(index.query(query, 10),
+                                 loaded.query(query, 10))
+            data = path.read_bytes()
+            for corrupt in (b'no index', data[:-1]):
+                path.write_bytes(corrupt)
+                with self.assertRaises(ValueError):
+                    DhashIndex.load(path)
+
+    def test_index_file_is_reused(self) -> None:
+        src = Path(__file__).resolve().parent / 'images' / 'various'
+        with tempfile.TemporaryDirectory() as tmp:
+            db = KnipseDB(str(Path(tmp) / 'knipse.sqlite'))
+            list(scan_images(db, src))
+            expected = DhashIndex.from_pairs(db.load_image_dhashes())
+            query = next(iter(db.load_all_images())).dhash
+            index = load_dhash_index(db)
+            self.assertTrue((Path(tmp) / 'knipse.sqlite.dhx').exists())
+            self.assertEqual(expected.query(query, 20),
+                             index.query(query, 20))
+            with mock.patch.object(DhashIndex, '__init__') as init:
+                index = load_dhash_index(db)
+            init.assert_not_called()
+            self.assertEqual(expected.query(query, 20),
+                             index.query(query, 20))
+            _, image_id = expected.query(query, 0)[0]
+            db.deactivate_images([image_id])
+            index = load_dhash_index(db)
+            self.assertEqual(len(expected) - 1, len(index))
+            self.assertNotIn(image_id, [i for _, i in index.query(query, 0)])
+            db.close()
+
+    def test_similar_command(self) -> None:
+        '''Find images similar to a file of the scanned image folder.'''
+        src = Path(__file__).resolve().parent / 'images' / 'various'
+        db = KnipseDB(':memory:')
+        list(scan_images(db, src))
+        runner = CliRunner()
+        result = runner.invoke(cli_similar,
+                               [str(src / 'img_0002.jpg'), '-k', '0'],
+                               obj={'database': db, 'source': str(src)})
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('0\timg_0002.jpg', result.output.splitlines())
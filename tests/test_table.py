@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+
+from knipse.db import KnipseDB
+from knipse.descriptor import ImageDescriptor
+from knipse.scan import scan_images
+from knipse.table import ImageTable
+from .test_walk import EXPECTED_IMAGES
+
+
+class TestImageTable(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.src = Path(__file__).resolve().parent / 'images' / 'various'
+        self.db = KnipseDB(':memory:')
+
+    def test_table_equals_descriptors(self) -> None:
+        list(scan_images(self.db, self.src))
+        self.db.store_image(ImageDescriptor(
+            None, Path('no_date.jpg'), None, datetime(2019, 1, 1, 11, 11),
+            bytes(16), b'\xff' * 16, True))
+        descrs = list(self.db.load_all_images())
+        for chunk_size in (1, 3, 1000):
+            table = self.db.load_image_table(chunk_size)
+            self.assertEqual(len(EXPECTED_IMAGES) + 1, len(table))
+            self.assertEqual(descrs, list(table))
+            self.assertEqual([str(descr.path) for descr in descrs],
+                             list(table.paths()))
+        self.assertEqual(np.int64, table.image_ids.dtype)
+        self.assertEqual((len(table), 16), table.md5.shape)
+        self.assertEqual((len(table), 16), table.dhash.shape)
+        self.assertTrue(np.isnat(table.created_at[-1]))
+        self.assertTrue(table.active.all())
+        # folders are stored once
+        self.assertEqual(len(set(table.folders)), len(table.folders))
+        self.assertEqual(set(str(descr.path.parent).replace('.', '')
+                             for descr in descrs), set(table.folders))
+        in_folder1 = table.in_folder('folder1')
+        self.assertEqual(sorted(str(descr.path) for descr in descrs
+                                if str(descr.path.parent) == 'folder1'),
+                         sorted(table.path(i) for i in in_folder1))
+        self.assertEqual(0, len(table.in_folder('unknown')))
+
+    def test_empty_table(self) -> None:
+        table = self.db.load_image_table()
+        self.assertEqual(0, len(table))
+        self.assertEqual([], list(table))
+        self.assertEqual((0, 16), table.dhash.shape)
+        self.assertEqual([], ImageTable.from_chunks([]).folders)
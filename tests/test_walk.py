@@ -53,3 +53,44 @@ class TestImageWalking(unittest.TestCase):
 
         for file_path, img, progress in walk_images(self.src, _filter):
             raise Exception('should not happen')
+
+    def test_walking_progress(self) -> None:
+        '''Test that progress is increasing and bounded by one'''
+        last_progress = 0.0
+        for file_path, img, progress in walk_images(self.src):
+            self.assertGreater(progress, last_progress)
+            self.assertLessEqual(progress, 1.0)
+            last_progress = progress
+
+    def test_filter_modification_time(self) -> None:
+        '''Test that the filters receive the modification time of files
+           and folders, that symlinks are not passed to the filter and
+           that files of folders rejected by the folder filter are
+           skipped'''
+        filtered_files = []
+        filtered_folders = []
+
+        def _filter(source: Path, path: Path, mtime: datetime) -> bool:
+            self.assertFalse(path.is_symlink())
+            self.assertEqual(get_modification_time(path), mtime)
+            filtered_files.append(str(path.relative_to(source)))
+            return True
+
+        def _folder_filter(source: Path, folder: Path, mtime: datetime,
+                           entries: int) -> bool:
+            self.assertEqual(get_modification_time(folder), mtime)
+            self.assertEqual(len(list(folder.iterdir())), entries)
+            rel_path = str(folder.relative_to(source))
+            filtered_folders.append(rel_path)
+            return rel_path != 'folder2/folder3'
+
+        walked = [str(file_path.relative_to(self.src))
+                  for file_path, img, progress
+                  in walk_images(self.src, _filter,
+                                 folder_filter=_folder_filter)]
+        self.assertEqual(['.', 'folder1', 'folder2', 'folder2/folder3',
+                          'folder2/folder4'], sorted(filtered_folders))
+        expected = [path for path in EXPECTED_IMAGES
+                    if not path.startswith('folder2/folder3/')]
+        self.assertEqual(sorted(expected), sorted(walked))
+        self.assertEqual(sorted(walked), sorted(filtered_files))
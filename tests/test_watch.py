@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+from knipse.db import KnipseDB, ImageRecognizer, LazyImageRecognizer
+from knipse.scan import scan_images
+from knipse.watch import ImageWatcher, apply_changes, rescan_images
+from .test_walk import EXPECTED_IMAGES
+
+
+class TestImageWatching(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = Path(self.tmp.name) / 'various'
+        shutil.copytree(str(Path(__file__).resolve().parent
+                            / 'images' / 'various'),
+                        str(self.src), symlinks=True)
+        self.db = KnipseDB(':memory:')
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def _active_paths(self):
+        return set(str(descr.path) for descr in self.db.load_all_images())
+
+    def test_applying_changes(self) -> None:
+        '''Scan a folder structure, then add, move and delete images
+           and apply these changes without scanning again.'''
+        list(scan_images(self.db, self.src))
+        recgn = self.db.get_recognizer(mapped=False)
+        assert isinstance(recgn, ImageRecognizer)
+        new_image = self.src / 'folder1' / 'img_new.jpg'
+        Image.new('RGB', (30, 20), 'red').save(str(new_image))
+        moved_from = self.src / 'img_0002.jpg'
+        moved_to = self.src / 'folder1' / 'img_0002.jpg'
+        moved_from.rename(moved_to)
+        deleted = self.src / 'folder2' / 'img_0010.jpg'
+        deleted.unlink()
+        shutil.rmtree(str(self.src / 'folder2' / 'folder4'))
+        actions = list(apply_changes(self.db, recgn, self.src,
+                                     [new_image, moved_to],
+                                     [moved_from, deleted],
+                                     [self.src / 'folder2' / 'folder4']))
+        self.assertEqual(6, len(actions))
+        paths = self._active_paths()
+        self.assertEqual(len(EXPECTED_IMAGES) - 4 + 1, len(paths))
+        self.assertIn('folder1/img_new.jpg', paths)
+        self.assertIn('folder1/img_0002.jpg', paths)
+        self.assertNotIn('img_0002.jpg', paths)
+        self.assertNotIn('folder2/img_0010.jpg', paths)
+        # recognizer is updated, hence changes are not applied twice
+        self.assertEqual([], list(apply_changes(self.db, recgn, self.src,
+                                                [new_image, moved_to],
+                                                [moved_from, deleted])))
+        self.assertEqual(recgn.known_files.keys(), paths)
+
+    def test_applying_changes_lazily(self) -> None:
+        '''Apply changes using a recognizer that queries the database.'''
+        list(scan_images(self.db, self.src))
+        recgn = self.db.get_recognizer(lazy=True)
+        assert isinstance(recgn, LazyImageRecognizer)
+        moved_from = self.src / 'img_0002.jpg'
+        moved_to = self.src / 'folder1' / 'img_0002.jpg'
+        moved_from.rename(moved_to)
+        shutil.rmtree(str(self.src / 'folder2' / 'folder4'))
+        actions = list(apply_changes(self.db, recgn, self.src, [moved_to],
+                                     [moved_from],
+                                     [self.src / 'folder2' / 'folder4']))
+        self.assertEqual(4, len(actions))
+        self.assertEqual(('Moved', Path('folder1/img_0002.jpg')), actions[0])
+        paths = self._active_paths()
+        self.assertEqual(len(EXPECTED_IMAGES) - 3, len(paths))
+        self.assertFalse(any(path.startswith('folder2/folder4/')
+                             for path in paths))
+        self.assertEqual([], list(apply_changes(
+            self.db, recgn, self.src, [moved_to], [moved_from],
+            [self.src / 'folder2' / 'folder4'])))
+
+    def test_rescan_after_missed_events(self) -> None:
+        '''Rescanning stores new images and deactivates deleted ones.'''
+        list(scan_images(self.db, self.src))
+        new_image = self.src / 'folder1' / 'img_new.jpg'
+        Image.new('RGB', (30, 20), 'red').save(str(new_image))
+        (self.src / 'folder2' / 'img_0010.jpg').unlink()
+        self.assertEqual([('Deactivated', Path('folder2/img_0010.jpg'))],
+                         list(rescan_images(self.db, self.src)))
+        paths = self._active_paths()
+        self.assertEqual(len(EXPECTED_IMAGES), len(paths))
+        self.assertIn('folder1/img_new.jpg', paths)
+        self.assertNotIn('folder2/img_0010.jpg', paths)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'),
+                         'inotify is only available on Linux')
+    def test_watching_events(self) -> None:
+        '''Watch a folder structure and test if created, moved and
+           deleted files and folders are reported.'''
+        with ImageWatcher(self.src) as watcher:
+            new_image = self.src / 'folder1' / 'img_new.jpg'
+            Image.new('RGB', (30, 20), 'red').save(str(new_image))
+            (self.src / 'img_0002.jpg').rename(self.src / 'folder1' / 'a.jpg')
+            (self.src / 'folder2' / 'img_0010.jpg').unlink()
+            shutil.rmtree(str(self.src / 'folder2' / 'folder4'))
+            new_folder = self.src / 'folder5'
+            new_folder.mkdir()
+            changed, removed, removed_folders = \
+                watcher.poll(timeout=5, debounce=0.2)
+            self.assertEqual({new_image, self.src / 'folder1' / 'a.jpg'},
+                             changed)
+            self.assertIn(self.src / 'img_0002.jpg', removed)
+            self.assertIn(self.src / 'folder2' / 'img_0010.jpg', removed)
+            self.assertEqual({self.src / 'folder2' / 'folder4'},
+                             removed_folders)
+            self.assertIn(new_folder, watcher.watches.values())
+            # files in newly watched folders are reported as well
+            (new_folder / 'img.jpg').write_bytes(new_image.read_bytes())
+            changed, _, _ = watcher.poll(timeout=5, debounce=0.2)
+            self.assertEqual({new_folder / 'img.jpg'}, changed)